@@ -1,211 +1,1193 @@
-from PIL import Image, ImageOps
+from PIL import Image
 import cv2
 import numpy as np
 import os
 import random
-from scipy.io import wavfile
-import soundfile as sf
 import subprocess
+import argparse
+import threading
+import queue
+import time
+import tempfile
+import shutil
+import hashlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from itertools import islice
+from escritura import EscritorVideoAsincrono
+from cache_imagenes import agregar_opciones_cache, cache_desde_args, hash_archivo
+from perfilado import Perfilador, agregar_opcion_perfil, resumen_perfil
 
 # Configuración
 WIDTH, HEIGHT = 1920, 1080
 FPS = 30
 WAIT_DURATION = 5.0  # 5 segundos por foto
 OUTPUT_FOLDER = "Output"
+OUTPUT_NAME = "animacion_fotos.mp4"
 SHUTTER_SOUND_PATH = "shutter.mp3"
 FLASH_DURATION = 0.2  # Restaurado a 0.2 segundos
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+FRAME_BORDER = 20  # Marco blanco que se añade a cada foto al cargarla
+PREFETCH = 4  # Fotos decodificadas por adelantado mientras se renderiza
 
-# Solicitar al usuario la carpeta de entrada
-print("\n=== Iniciando proceso de creación de animación ===")
-INPUT_FOLDER = input("Por favor, introduce la ruta de la carpeta donde están las fotos: ").strip()
-if not os.path.exists(INPUT_FOLDER):
-    raise ValueError(f"La carpeta '{INPUT_FOLDER}' no existe.")
-
-def load_images_with_frame():
-    print("\nCargando imágenes...")
-    images = []
-    for fname in sorted(os.listdir(INPUT_FOLDER)):
-        if fname.lower().endswith(('.jpg', '.jpeg', '.png')):
-            print(f"Procesando: {fname}")
-            path = os.path.join(INPUT_FOLDER, fname)
-            img = Image.open(path).convert("RGB")
-            img = ImageOps.expand(img, border=20, fill='white')
-            # Convertir PIL Image a numpy array para OpenCV
-            img = np.array(img)
-            # Convertir RGB a BGR (formato de OpenCV)
-            img = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
-            images.append((fname, img))
-    print(f"Total de imágenes cargadas: {len(images)}")
-    # Mezclar aleatoriamente las imágenes
-    random.shuffle(images)
-    return images
-
-def create_animation(images):
-    if not images:
-        raise ValueError("No se han encontrado imágenes en la carpeta especificada.")
+# Pipeline (--pipeline): elementos en espera entre etapas e hilos de preparación
+PIPELINE_QUEUE_SIZE = 4
+PIPELINE_PREPARE_WORKERS = 2
+
+# Codificación de vídeo: 'opencv' (mp4v + remux del audio) o 'ffmpeg' (una sola pasada)
+ENCODER = 'opencv'
+VIDEO_CODEC = 'libx264'
+VIDEO_PRESET = 'medium'
+VIDEO_CRF = None  # None = valor por defecto del códec
+ENCODER_THREADS = 0  # 0 = ffmpeg elige según los núcleos disponibles
+WRITE_QUEUE = 8  # Tandas de frames en cola hacia el hilo del codificador (0 = codificar en el hilo principal)
+
+IMAGE_CACHE = None  # cache_imagenes.CacheImagenes con las fotos ya reducidas (--cache-imagenes)
+
+# Audio: música de fondo opcional (--musica), en bucle y mezclada por ffmpeg
+# bajo el obturador, y caché del click ya decodificado y remuestreado
+MUSIC_PATH = None
+MUSIC_VOLUME = 0.3
+AUDIO_SAMPLE_RATE = 44100
+AUDIO_CACHE_FOLDER = os.path.join(OUTPUT_FOLDER, ".cache_audio")
+CLICK_CACHE = {}  # (hash, frecuencia, FLASH_DURATION) -> click
+
+# Borrador (--borrador): mismo orden y tiempos que el vídeo final, pero a 480p y
+# 10 fps, con x264 ultrafast y una hoja de contactos con el orden de las fotos
+DRAFT = False
+DRAFT_WIDTH, DRAFT_HEIGHT = 854, 480
+DRAFT_FPS = 10
+DRAFT_PRESET = 'ultrafast'
+DRAFT_SAMPLE_RATE = 16000  # El AAC de una pista larga pesa más que el vídeo del borrador
+CONTACT_THUMB = (160, 120)  # Tamaño máximo de cada miniatura de la hoja de contactos
+CONTACT_COLUMNS = 10
+
+# Perfilado (--profile): tiempos por etapa. Sin modo no mide nada
+PROFILE = None
+PROFILER = Perfilador('animacion')
+
+INPUT_FOLDER = None  # Se pide al usuario al ejecutar el script
+
+def list_images(folder, seed=None):
+    # Fotos de la carpeta en orden aleatorio (se ordenan antes para que el
+    # resultado del shuffle solo dependa de la semilla). Con la misma semilla
+    # sale siempre el mismo orden, así que el borrador y el vídeo final coinciden
+    names = [fname for fname in sorted(os.listdir(folder))
+             if fname.lower().endswith(IMAGE_EXTENSIONS)]
+    random.Random(seed).shuffle(names)
+    return [os.path.join(folder, fname) for fname in names]
+
+def display_geometry(width, height):
+    # Tamaño de pantalla de una foto y grosor de su marco, a partir de sus
+    # dimensiones originales. La escala es la misma que aplicará prepare_image
+    scale = min((WIDTH - 100) / (width + 2 * FRAME_BORDER),
+                (HEIGHT - 100) / (height + 2 * FRAME_BORDER), 1.0)
+    content_size = (max(1, int(width * scale)), max(1, int(height * scale)))
+    return content_size, max(1, int(FRAME_BORDER * scale))
+
+def decode_image(path):
+    # Decodifica una foto a la menor resolución que sigue bastando para mostrarla
+    # (en JPEG, 1/2, 1/4 o 1/8 gracias al modo draft) y devuelve la imagen BGR
+    # junto con su tamaño original. Con IMAGE_CACHE la foto sale ya a su tamaño
+    # de pantalla de la caché, si está, y si no se guarda en ella
+    with PROFILER.etapa('decodificacion', os.path.basename(path)):
+        return _decode_image(path)
+
+def _decode_image(path):
+    img = Image.open(path)
+    original_size = img.size
+    content_size, _ = display_geometry(*original_size)
+    if IMAGE_CACHE is not None:
+        img.close()
+        return IMAGE_CACHE.obtener(path, content_size, 'area', lambda: decode_to_size(path, content_size)), \
+            original_size
+    img.draft("RGB", content_size)
+    img = img.convert("RGB")
+    # Convertir PIL Image a numpy array para OpenCV (RGB a BGR)
+    return cv2.cvtColor(np.asarray(img), cv2.COLOR_RGB2BGR), original_size
+
+def decode_to_size(path, content_size):
+    # Rendición que se guarda en la caché: decodificación reducida y INTER_AREA
+    img = Image.open(path)
+    img.draft("RGB", content_size)
+    img = cv2.cvtColor(np.asarray(img.convert("RGB")), cv2.COLOR_RGB2BGR)
+    if (img.shape[1], img.shape[0]) != content_size:
+        img = cv2.resize(img, content_size, interpolation=cv2.INTER_AREA)
+    return img
+
+def fit_image(img, original_size):
+    # Lleva una foto decodificada a su tamaño de pantalla y le añade el marco blanco
+    content_size, border = display_geometry(*original_size)
+    with PROFILER.etapa('ajuste'):
+        if (img.shape[1], img.shape[0]) != content_size:
+            img = cv2.resize(img, content_size, interpolation=cv2.INTER_AREA)
+        return cv2.copyMakeBorder(
+            img, border, border, border, border,
+            cv2.BORDER_CONSTANT, value=(255, 255, 255)
+        )
+
+def load_display_image(path):
+    # Decodifica una foto directamente al tamaño con el que se mostrará, con su
+    # marco blanco, sin pasar nunca por la resolución completa de la cámara
+    return fit_image(*decode_image(path))
+
+def iter_images_with_frame(paths, prefetch=PREFETCH):
+    # Carga perezosa: las fotos se decodifican en segundo plano y se entregan a
+    # medida que el render las pide, con como mucho `prefetch` fotos por delante.
+    # La memoria usada no depende del número de fotos de la carpeta.
+    prefetch = max(1, prefetch)
+    paths = iter(paths)
+    with ThreadPoolExecutor(max_workers=min(prefetch, os.cpu_count() or 1)) as pool:
+        pending = deque((path, pool.submit(load_display_image, path))
+                        for path in islice(paths, prefetch))
+        while pending:
+            path, future = pending.popleft()
+            img = future.result()
+            for next_path in islice(paths, 1):
+                pending.append((next_path, pool.submit(load_display_image, next_path)))
+            yield os.path.basename(path), img
+
+def prepare_image(img):
+    # Asegurarnos de que la imagen quepa en la pantalla
+    scale_w = (WIDTH - 100) / img.shape[1]  # Dejamos 50px de margen a cada lado
+    scale_h = (HEIGHT - 100) / img.shape[0]  # Dejamos 50px de margen arriba y abajo
+    scale = min(scale_w, scale_h, 1.0)  # No escalamos si la imagen es más pequeña
+
+    if scale < 1.0:
+        new_width = int(img.shape[1] * scale)
+        new_height = int(img.shape[0] * scale)
+        img = cv2.resize(img, (new_width, new_height))
+
+    # Añadir borde blanco (estilo Polaroid)
+    border = 20
+    img_with_border = cv2.copyMakeBorder(
+        img, border, border, border, border,
+        cv2.BORDER_CONSTANT, value=(255, 255, 255)
+    )
+
+    # Calcular posición central
+    center_x = (WIDTH - img_with_border.shape[1]) // 2
+    center_y = (HEIGHT - img_with_border.shape[0]) // 2
+    return img_with_border, center_x, center_y
+
+def paste_image(canvas, img, x, y):
+    try:
+        canvas[y:y + img.shape[0], x:x + img.shape[1]] = img
+    except ValueError:
+        pass  # Ignorar errores de tamaño
+
+def iter_frame_runs(prepared_images, total_frames, first_frame=0):
+    # Compositor incremental: cada foto se pega una sola vez en un lienzo persistente
+    # cuando llega su momento, y se devuelven tandas (frame, repeticiones) de frames
+    # idénticos. El buffer devuelto se reutiliza entre tandas, así que quien lo consuma
+    # debe escribirlo (o copiarlo) antes de pedir la siguiente.
+    # prepared_images puede ser cualquier iterable ordenado por tiempo de inicio; solo
+    # se pide la siguiente foto cuando la anterior ya está pegada.
+    # Con first_frame se genera solo el tramo [first_frame, total_frames) de la
+    # línea de tiempo; las fotos anteriores que deban verse se pegan al empezar.
+    canvas = np.zeros((HEIGHT, WIDTH, 3), dtype=np.uint8)
+    flash = np.full((HEIGHT, WIDTH, 3), 255, dtype=np.uint8)
+    pending = iter(prepared_images)
+    next_image = next(pending, None)
+    current_start = None
+    run_state = None
+    run_length = 0
+
+    for frame in range(first_frame, total_frames):
+        current_time = frame / FPS
+
+        # Pegar las fotos cuyo momento ya ha llegado (normalmente solo una)
+        while next_image is not None and current_time >= next_image[3]:
+            if run_length:
+                yield (flash if run_state[1] else canvas), run_length
+                run_length = 0
+            img_with_border, center_x, center_y, current_start = next_image
+            with PROFILER.etapa('composicion'):
+                paste_image(canvas, img_with_border, center_x, center_y)
+            next_image = next(pending, None)
+
+        # Destello blanco solo durante los primeros instantes de la foto actual
+        in_flash = current_start is not None and current_time - current_start < FLASH_DURATION
+        state = (current_start, in_flash)
+        if run_length and state != run_state:
+            yield (flash if run_state[1] else canvas), run_length
+            run_length = 0
+        run_state = state
+        run_length += 1
+
+    if run_length:
+        yield (flash if run_state[1] else canvas), run_length
+
+def iter_prepared_images(images, start_times=None):
+    # Por defecto la foto i empieza en i * WAIT_DURATION
+    for i, (name, img) in enumerate(images):
+        with PROFILER.etapa('preparacion'):
+            img_with_border, center_x, center_y = prepare_image(img)
+        start_time = i * WAIT_DURATION if start_times is None else start_times[i]
+        yield img_with_border, center_x, center_y, start_time
+
+def load_click(sample_rate):
+    # Sonido del obturador recortado a FLASH_DURATION, remuestreado a
+    # sample_rate y normalizado (float32, muestras x canales). Se guarda en
+    # memoria y en disco por hash del archivo y frecuencia, así que solo se
+    # decodifica y remuestrea la primera vez
+    sha256 = hash_archivo(SHUTTER_SOUND_PATH)
+    key = (sha256, sample_rate, FLASH_DURATION)
+    if key in CLICK_CACHE:
+        return CLICK_CACHE[key]
+    cache_path = os.path.join(AUDIO_CACHE_FOLDER,
+                              f"click_{sha256[:16]}_{sample_rate}_{round(FLASH_DURATION * 1000)}ms.npy")
+    try:
+        click_audio = np.load(cache_path)
+    except (OSError, ValueError):
+        import soundfile as sf  # Solo hace falta para el audio; así el script arranca antes
+        click_audio, click_sr = sf.read(SHUTTER_SOUND_PATH)
+
+        # Asegurarnos de que el click no sea más largo que FLASH_DURATION
+        click_audio = click_audio[:int(FLASH_DURATION * click_sr)]
+
+        # Resamplear si es necesario
+        if click_sr != sample_rate:
+            from scipy import signal
+            click_audio = signal.resample(click_audio, int(len(click_audio) * sample_rate / click_sr))
+
+        # Normalizar el audio del click
+        click_audio = click_audio / np.max(np.abs(click_audio))
+        if click_audio.ndim == 1:
+            click_audio = click_audio[:, np.newaxis]
+        click_audio = click_audio.astype(np.float32)
+
+        os.makedirs(AUDIO_CACHE_FOLDER, exist_ok=True)
+        temp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as f:
+            np.save(f, click_audio)
+        os.replace(temp_path, cache_path)
+    CLICK_CACHE[key] = click_audio
+    return click_audio
+
+class ShutterTrack:
+    # Pista del obturador en forma dispersa: el click y las muestras en las que
+    # empieza cada repetición. chunks() genera la pista por trozos de float32,
+    # así que la memoria no depende de la duración del vídeo
+    def __init__(self, click, offsets, length, sample_rate):
+        self.click = click
+        self.offsets = sorted(offset for offset in offsets if offset < length)
+        self.length = length
+        self.sample_rate = sample_rate
+        self.channels = click.shape[1]
+        # El click ya está normalizado; solo puede quedar por debajo de 1 si el
+        # final del vídeo o el click siguiente lo cortan. Igual que antes, la
+        # pista se normaliza entera, así que se busca el pico de lo que se oye
+        ends = self.offsets[1:] + [length]
+        peak = max((np.max(np.abs(click[:min(end, length) - offset]))
+                    for offset, end in zip(self.offsets, ends) if end > offset), default=0.0)
+        self.gain = 1.0 / peak if peak else 1.0
+
+    def __len__(self):
+        return self.length
+
+    def chunks(self, chunk_size=1 << 16):
+        click_len = len(self.click)
+        first = 0  # Primer click que aún puede solaparse con el trozo
+        for start in range(0, self.length, chunk_size):
+            end = min(start + chunk_size, self.length)
+            chunk = np.zeros((end - start, self.channels), dtype=np.float32)
+            while first < len(self.offsets) and self.offsets[first] + click_len <= start:
+                first += 1
+            for offset in self.offsets[first:]:
+                if offset >= end:
+                    break
+                # Si dos clicks se solapan, el posterior sobrescribe al anterior
+                lo, hi = max(offset, start), min(offset + click_len, end)
+                chunk[lo - start:hi - start] = self.click[lo - offset:hi - offset]
+            if self.gain != 1.0:
+                chunk *= self.gain
+            yield chunk
 
+def build_shutter_track(num_images, total_frames, sample_rate=None):
+    # Pista de audio con el sonido del obturador al inicio de cada foto
+    sample_rate = sample_rate or AUDIO_SAMPLE_RATE
+    total_duration = total_frames / FPS
+    offsets = [int(i * WAIT_DURATION * sample_rate) for i in range(num_images)]
+    return ShutterTrack(load_click(sample_rate), offsets, int(total_duration * sample_rate), sample_rate)
+
+def open_audio_pipe(audio, chunk_size=1 << 16):
+    # Prepara una tubería por la que ffmpeg leerá la pista desde memoria.
+    # Devuelve los argumentos de entrada para ffmpeg, el descriptor que debe
+    # heredar el proceso y la función que escribe las muestras en la tubería
+    read_fd, write_fd = os.pipe()
+    args = ['-f', 'f32le', '-ar', str(audio.sample_rate), '-ac', str(audio.channels),
+            '-i', f'pipe:{read_fd}']
+
+    def feed():
+        # La pista se genera y se escribe por trozos, sin tenerla entera en memoria
+        try:
+            with open(write_fd, 'wb') as pipe:
+                for chunk in audio.chunks(chunk_size):
+                    pipe.write(chunk.astype('<f4', copy=False).tobytes())
+        except BrokenPipeError:
+            pass  # ffmpeg ha terminado antes (por ejemplo, por -shortest)
+
+    return args, read_fd, feed
+
+def audio_inputs(audio, first_input, audio_file=None):
+    # Entradas de audio para un comando de ffmpeg cuyas primeras entradas son
+    # de vídeo: la pista del obturador por tubería (o desde audio_file, si se
+    # indica) y, con MUSIC_PATH, la música de fondo en bucle, que ffmpeg mezcla
+    # a MUSIC_VOLUME sobre la marcha. first_input es el índice que tendrá la
+    # primera entrada de audio.
+    # Devuelve (argumentos de entrada, argumentos de mapeo y códec, descriptores
+    # que debe heredar ffmpeg, función que alimenta la tubería), o None si no
+    # hay audio
+    if audio is not None and audio_file is None and os.name != 'posix':
+        print("La pista de audio en memoria solo está disponible en sistemas POSIX; se omite el obturador.")
+        audio = None
+    if audio is None and audio_file is None and not MUSIC_PATH:
+        return None
+    input_args, pass_fds, feed_audio, streams = [], (), None, []
+    if audio_file is not None:
+        input_args += ['-i', audio_file]
+        streams.append(f'{first_input}:a')
+    elif audio is not None:
+        pipe_args, audio_fd, feed_audio = open_audio_pipe(audio)
+        input_args += pipe_args
+        pass_fds = (audio_fd,)
+        streams.append(f'{first_input}:a')
+    if MUSIC_PATH:
+        input_args += ['-stream_loop', '-1', '-i', MUSIC_PATH]
+        music = f'[{first_input + len(streams)}:a]volume={MUSIC_VOLUME}'
+        if streams:
+            # duration=first: la mezcla dura lo que la pista del obturador
+            graph = f'{music}[bed];[{streams[0]}][bed]amix=inputs=2:duration=first:normalize=0[aout]'
+        else:
+            graph = f'{music}[aout]'
+        map_args = ['-filter_complex', graph, '-map', '[aout]']
+    else:
+        map_args = ['-map', streams[0]]
+    map_args += ['-c:a', 'aac', '-shortest']
+    return input_args, map_args, pass_fds, feed_audio
+
+def start_audio_feeder(feed_audio, pass_fds):
+    # Una vez lanzado ffmpeg, cierra nuestra copia del extremo de lectura y
+    # alimenta la tubería desde un hilo para no bloquear el envío de frames
+    if feed_audio is None:
+        return None
+    for fd in pass_fds:
+        os.close(fd)
+    thread = threading.Thread(target=feed_audio, daemon=True)
+    thread.start()
+    return thread
+
+def wait_ffmpeg(process, audio_thread=None):
+    # Espera a que termine ffmpeg y al hilo que le pasa el audio, y convierte
+    # un código de salida distinto de 0 en una excepción
+    returncode = process.wait()
+    if audio_thread is not None:
+        audio_thread.join()
+    if returncode != 0:
+        raise RuntimeError(f"ffmpeg terminó con código {returncode}")
+
+def run_ffmpeg(command, pass_fds=(), feed_audio=None):
+    # Ejecuta un comando de ffmpeg que no recibe frames por stdin, alimentando
+    # la tubería de audio (ver audio_inputs) si la hay
+    process = subprocess.Popen(command, pass_fds=pass_fds)
+    wait_ffmpeg(process, start_audio_feeder(feed_audio, pass_fds))
+
+class FFmpegWriter:
+    # Codifica el vídeo en una sola pasada: los frames se envían en crudo por una
+    # tubería a un único proceso de ffmpeg, que recibe también la pista del
+    # obturador desde memoria por una segunda tubería. Interfaz compatible con
+    # cv2.VideoWriter (write/release).
+    def __init__(self, output_path, audio=None, codec=None, preset=None, crf=None, threads=None):
+        codec = codec or VIDEO_CODEC
+        preset = preset or VIDEO_PRESET
+        crf = VIDEO_CRF if crf is None else crf
+        threads = ENCODER_THREADS if threads is None else threads
+
+        command = [
+            'ffmpeg', '-y', '-loglevel', 'error',
+            '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f'{WIDTH}x{HEIGHT}', '-r', str(FPS),
+            '-i', 'pipe:0',
+        ]
+        pass_fds = ()
+        feed_audio = None
+        inputs = audio_inputs(audio, 1)
+        if inputs is not None:
+            audio_args, map_args, pass_fds, feed_audio = inputs
+            command += audio_args
+        command += ['-c:v', codec, '-pix_fmt', 'yuv420p', '-threads', str(threads)]
+        if preset and codec.startswith('libx26'):
+            command += ['-preset', preset]
+        if crf is not None:
+            command += ['-crf', str(crf)]
+        if inputs is not None:
+            command += ['-map', '0:v'] + map_args
+        command += ['-movflags', '+faststart', output_path]
+
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, pass_fds=pass_fds)
+        self._audio_thread = start_audio_feeder(feed_audio, pass_fds)
+
+    def write(self, frame):
+        self.process.stdin.write(np.ascontiguousarray(frame).data)
+
+    def release(self):
+        self.process.stdin.close()
+        wait_ffmpeg(self.process, self._audio_thread)
+
+class DraftWriter:
+    # Escritor del borrador. Recibe tandas de frames iguales (write(frame,
+    # repeat)) y guarda cada frame distinto una sola vez como JPEG; al
+    # liberarlo, ffmpeg los codifica con la duración de cada tanda (demuxer
+    # concat) en un vídeo de frame rate variable. Así x264 codifica un par de
+    # frames por foto en lugar de todos, y los destellos comparten archivo.
+    def __init__(self, output_path, audio=None):
+        self.output_path = output_path
+        self.audio = audio
+        self.temp_dir = tempfile.mkdtemp(dir=os.path.dirname(output_path) or '.', prefix='.borrador_')
+        self.files = {}  # Hash del frame -> JPEG
+        self.runs = []  # [JPEG, frames]
+
+    def write(self, frame, repeat=1):
+        key = hashlib.sha1(np.ascontiguousarray(frame).data).digest()
+        if key not in self.files:
+            self.files[key] = os.path.join(self.temp_dir, f"frame_{len(self.files):06d}.jpg")
+            cv2.imwrite(self.files[key], frame, [cv2.IMWRITE_JPEG_QUALITY, 90])
+        if self.runs and self.runs[-1][0] == self.files[key]:
+            self.runs[-1][1] += repeat
+        else:
+            self.runs.append([self.files[key], repeat])
+
+    def release(self):
+        try:
+            list_path = os.path.join(self.temp_dir, "frames.txt")
+            with open(list_path, 'w') as f:
+                for path, frames in self.runs:
+                    f.write(f"file '{os.path.abspath(path)}'\nduration {frames / FPS}\n")
+                if self.runs:
+                    # concat no aplica la duración del último archivo si no se repite
+                    f.write(f"file '{os.path.abspath(self.runs[-1][0])}'\n")
+
+            command = ['ffmpeg', '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0', '-i', list_path]
+            pass_fds = ()
+            feed_audio = None
+            inputs = audio_inputs(self.audio, 1)
+            if inputs is not None:
+                audio_args, map_args, pass_fds, feed_audio = inputs
+                command += audio_args + ['-map', '0:v'] + map_args + ['-ac', '1', '-ar', str(DRAFT_SAMPLE_RATE)]
+            command += ['-c:v', VIDEO_CODEC, '-pix_fmt', 'yuv420p', '-fps_mode', 'vfr']
+            if VIDEO_PRESET and VIDEO_CODEC.startswith('libx26'):
+                command += ['-preset', VIDEO_PRESET]
+            command += ['-movflags', '+faststart', self.output_path]
+
+            run_ffmpeg(command, pass_fds, feed_audio)
+        finally:
+            shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+def open_video_writer(output_path, audio=None):
+    if DRAFT:
+        return DraftWriter(output_path, audio)
+    if ENCODER == 'ffmpeg':
+        return FFmpegWriter(output_path, audio)
+    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+    return cv2.VideoWriter(output_path, fourcc, FPS, (WIDTH, HEIGHT))
+
+def add_shutter_sound(output_path, num_images, total_frames):
+    # Añade la pista del obturador (y la música de fondo) a un vídeo ya
+    # codificado (modo OpenCV). La pista llega a ffmpeg por una tubería; solo
+    # fuera de POSIX se escribe antes en un WAV temporal, también por trozos
+    print("\nAñadiendo sonido al video...")
+    try:
+        # Crear una copia del video original
+        backup_video = "backup_video.mp4"
+        subprocess.run(['cp', output_path, backup_video], check=True)
+
+        audio = None
+        if os.path.exists(SHUTTER_SOUND_PATH):
+            with PROFILER.etapa('audio'):
+                audio = build_shutter_track(num_images, total_frames)
+        temp_audio = None
+        if audio is not None and os.name != 'posix':
+            import soundfile as sf
+            temp_audio = "temp_audio.wav"
+            with sf.SoundFile(temp_audio, 'w', audio.sample_rate, audio.channels) as f:
+                for chunk in audio.chunks():
+                    f.write(chunk)
+        audio_args, map_args, pass_fds, feed_audio = audio_inputs(audio, 1, temp_audio)
+        command = ['ffmpeg', '-i', backup_video] + audio_args
+
+        # Combinar video y audio usando ffmpeg
+        temp_output = "temp_output.mp4"
+        print("Combinando video y audio...")
+        run_ffmpeg(command + ['-c:v', 'copy', '-map', '0:v'] + map_args + [temp_output], pass_fds, feed_audio)
+
+        # Verificar que el nuevo archivo tiene un tamaño razonable
+        if os.path.getsize(temp_output) > os.path.getsize(backup_video) * 0.5:  # Al menos 50% del tamaño original
+            os.replace(temp_output, output_path)
+            print("Audio añadido correctamente")
+        else:
+            print("Error: El video resultante es demasiado pequeño. Manteniendo el video original.")
+            os.remove(temp_output)
+
+        # Limpiar archivos temporales
+        if temp_audio is not None:
+            os.remove(temp_audio)
+        os.remove(backup_video)
+    except Exception as e:
+        print(f"No se pudo añadir el audio: {e}")
+        print("Manteniendo el video original sin audio.")
+
+def partial_path(output_path):
+    # El vídeo se escribe con otro nombre y solo sustituye al de la ejecución
+    # anterior cuando el render termina bien (ver finish_video)
+    base, ext = os.path.splitext(output_path)
+    return f"{base}.parcial{ext}"
+
+def discard_partial(output_path):
+    try:
+        os.remove(partial_path(output_path))
+    except FileNotFoundError:
+        pass
+
+def start_video(num_images):
     print("\nPreparando la animación...")
     # Calcular duración total
-    total_frames = int(WAIT_DURATION * len(images) * FPS)
+    total_frames = int(WAIT_DURATION * num_images * FPS)
     print(f"Duración total: {total_frames/FPS:.1f} segundos")
-    
+
+    # Con ffmpeg el audio se multiplexa en la misma pasada que el vídeo
+    audio = None
+    if ENCODER == 'ffmpeg' and os.path.exists(SHUTTER_SOUND_PATH):
+        try:
+            with PROFILER.etapa('audio'):
+                audio = build_shutter_track(num_images, total_frames)
+        except Exception as e:
+            print(f"No se pudo preparar el audio: {e}")
+            print("El video se generará sin audio.")
+
     # Crear el video writer
-    output_path = os.path.join(OUTPUT_FOLDER, "animacion_fotos.mp4")
+    output_path = os.path.join(OUTPUT_FOLDER, OUTPUT_NAME)
     print(f"\nCreando video en: {output_path}")
-    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-    out = cv2.VideoWriter(output_path, fourcc, FPS, (WIDTH, HEIGHT))
+    out = open_video_writer(partial_path(output_path), audio)
+    return output_path, out, audio, total_frames
 
-    # Preparar imágenes
-    print("Preparando imágenes...")
-    prepared_images = []
+def open_async_writer(out, output_path=None):
+    # Los frames se codifican en un hilo aparte mientras se compone el
+    # siguiente (salvo en el borrador, que solo guarda un JPEG por tanda)
+    if WRITE_QUEUE > 0 and not isinstance(out, DraftWriter):
+        return EscritorVideoAsincrono(out, WRITE_QUEUE, output_path)
+    return out
 
-    for i, (name, img) in enumerate(images):
-        print(f"Preparando imagen {i+1}/{len(images)}: {name}")
-        
-        # Asegurarnos de que la imagen quepa en la pantalla
-        scale_w = (WIDTH - 100) / img.shape[1]  # Dejamos 50px de margen a cada lado
-        scale_h = (HEIGHT - 100) / img.shape[0]  # Dejamos 50px de margen arriba y abajo
-        scale = min(scale_w, scale_h, 1.0)  # No escalamos si la imagen es más pequeña
-        
-        if scale < 1.0:
-            new_width = int(img.shape[1] * scale)
-            new_height = int(img.shape[0] * scale)
-            img = cv2.resize(img, (new_width, new_height))
-        
-        # Añadir borde blanco (estilo Polaroid)
-        border = 20
-        img_with_border = cv2.copyMakeBorder(
-            img, border, border, border, border,
-            cv2.BORDER_CONSTANT, value=(255, 255, 255)
-        )
-        
-        # Calcular posición central
-        center_x = (WIDTH - img_with_border.shape[1]) // 2
-        center_y = (HEIGHT - img_with_border.shape[0]) // 2
-        
-        prepared_images.append((img_with_border, center_x, center_y, i * WAIT_DURATION))
+def write_frames(out, frame_img, repeat):
+    # El escritor del borrador recibe la tanda entera; los demás, frame a frame
+    if isinstance(out, DraftWriter):
+        out.write(frame_img, repeat)
+    else:
+        for _ in range(repeat):
+            out.write(frame_img)
+
+def write_run(out, frame_img, repeat):
+    if isinstance(out, EscritorVideoAsincrono):
+        out.write(frame_img, repeat)
+    else:
+        with PROFILER.etapa('codificacion'):
+            write_frames(out, frame_img, repeat)
+
+def release_writer(out):
+    # Cierra el escritor; con el asíncrono devuelve sus estadísticas y anota su
+    # tiempo de codificación en el perfil
+    out.release()
+    if not isinstance(out, EscritorVideoAsincrono):
+        return None
+    stats = out.resumen()
+    PROFILER.sumar('codificacion', stats['segundos'], n=stats['frames'])
+    return stats
+
+def abort_writer(out):
+    # Cierra el escritor tras un error en el render, sin tapar la excepción
+    # original. Con el asíncrono se espera a su hilo: si el proceso termina
+    # con el hilo dentro de cv2.VideoWriter.write, se aborta (SIGABRT)
+    try:
+        if isinstance(out, DraftWriter):
+            shutil.rmtree(out.temp_dir, ignore_errors=True)
+        else:
+            out.release()
+    except Exception:
+        pass
+
+def finish_video(output_path, out, audio, num_images, total_frames):
+    # Liberar recursos
+    print("\nFinalizando video...")
+    with PROFILER.etapa('finalizacion'):
+        stats = release_writer(out)
+        if stats is not None:
+            print(f"Codificación: {stats['frames']} frames en {stats['segundos']:.1f} s "
+                  f"({stats['bytes'] / 1024 ** 2:.1f} MB)")
+        if ENCODER == 'ffmpeg' and (audio is not None or MUSIC_PATH):
+            print("Audio añadido correctamente")
+
+        # Añadir sonido si existe
+        if ENCODER != 'ffmpeg' and (os.path.exists(SHUTTER_SOUND_PATH) or MUSIC_PATH):
+            add_shutter_sound(partial_path(output_path), num_images, total_frames)
+    os.replace(partial_path(output_path), output_path)
+
+def contact_thumbnail(path):
+    # Miniatura de la hoja de contactos; en JPEG se decodifica ya reducida (draft)
+    with Image.open(path) as img:
+        img.draft("RGB", CONTACT_THUMB)
+        img = img.convert("RGB")
+    img.thumbnail(CONTACT_THUMB)
+    return img
+
+class ContactSheet:
+    # Hoja de contactos con las fotos en el orden del vídeo: bajo cada miniatura,
+    # su número, el momento en que aparece y el nombre del archivo
+    def __init__(self, num_images, columns=CONTACT_COLUMNS):
+        from PIL import ImageDraw, ImageFont
+        self.columns = columns
+        self.cell_width, self.cell_height = CONTACT_THUMB[0] + 10, CONTACT_THUMB[1] + 40
+        rows = max(1, -(-num_images // columns))
+        self.sheet = Image.new("RGB", (columns * self.cell_width + 10, rows * self.cell_height + 10), "white")
+        self.draw = ImageDraw.Draw(self.sheet)
+        self.font = ImageFont.load_default()
+
+    def add(self, index, name, thumb):
+        # thumb es una miniatura PIL o una foto BGR de OpenCV, que se reduce aquí
+        if isinstance(thumb, np.ndarray):
+            scale = min(CONTACT_THUMB[0] / thumb.shape[1], CONTACT_THUMB[1] / thumb.shape[0], 1.0)
+            size = (max(1, int(thumb.shape[1] * scale)), max(1, int(thumb.shape[0] * scale)))
+            thumb = Image.fromarray(cv2.cvtColor(cv2.resize(thumb, size, interpolation=cv2.INTER_AREA),
+                                                 cv2.COLOR_BGR2RGB))
+        thumb_width, thumb_height = CONTACT_THUMB
+        x = 10 + (index % self.columns) * self.cell_width
+        y = 10 + (index // self.columns) * self.cell_height
+        self.sheet.paste(thumb, (x + (thumb_width - thumb.width) // 2, y + (thumb_height - thumb.height) // 2))
+        start = int(index * WAIT_DURATION)
+        self.draw.text((x, y + thumb_height + 4), f"{index + 1}  ({start // 60}:{start % 60:02d})",
+                       fill="black", font=self.font)
+        self.draw.text((x, y + thumb_height + 18), name[:26], fill="gray", font=self.font)
+
+    def collect(self, images):
+        # Deja pasar las fotos que va a renderizar el vídeo y añade cada una a
+        # la hoja, para no decodificarlas dos veces
+        for index, (name, img) in enumerate(images):
+            with PROFILER.etapa('hoja_contactos'):
+                self.add(index, name, img)
+            yield name, img
+
+    def save(self, output_path):
+        self.sheet.save(output_path, quality=90)
+
+def save_contact_sheet(paths, output_path):
+    # Hoja de contactos por separado, decodificando solo miniaturas (para los
+    # modos que no pasan las fotos por ContactSheet.collect)
+    sheet = ContactSheet(len(paths))
+    with ThreadPoolExecutor(max_workers=os.cpu_count() or 1) as pool:
+        for index, (path, thumb) in enumerate(zip(paths, pool.map(contact_thumbnail, paths))):
+            sheet.add(index, os.path.basename(path), thumb)
+    sheet.save(output_path)
+
+def progress_bar(frame, total_frames, bar_length=50):
+    progress = (frame + 1) / total_frames  # Sumamos 1 para asegurar que llegue a 1.0
+    filled_length = int(bar_length * progress)
+    bar = '█' * filled_length + '░' * (bar_length - filled_length)
+    return f'Progreso: |{bar}| {progress * 100:.1f}%'
+
+def create_animation(images, num_images=None):
+    # images puede ser una lista o un iterador perezoso; en ese caso hay que
+    # indicar cuántas fotos contiene para calcular la duración
+    if num_images is None:
+        num_images = len(images)
+    if not num_images:
+        raise ValueError("No se han encontrado imágenes en la carpeta especificada.")
+
+    output_path, out, audio, total_frames = start_video(num_images)
+    out = open_async_writer(out, partial_path(output_path))
+
+    # Las imágenes se preparan a medida que el compositor las necesita
+    prepared_images = iter_prepared_images(images)
 
     print("\nGenerando frames del video...")
     # Generar frames
-    bar_length = 50  # Longitud de la barra de progreso
-    for frame in range(total_frames):
-        current_time = frame / FPS
-        
-        # Crear frame negro
-        frame_img = np.zeros((HEIGHT, WIDTH, 3), dtype=np.uint8)
-        
-        # Añadir cada imagen
-        for img_with_border, center_x, center_y, start_time in prepared_images:
-            if current_time >= start_time:
-                # Añadir destello blanco solo para la imagen actual
-                if current_time - start_time < FLASH_DURATION:
-                    # Mantener las imágenes anteriores
-                    for prev_img, prev_x, prev_y, prev_time in prepared_images:
-                        if prev_time < start_time:
-                            try:
-                                frame_img[prev_y:prev_y + prev_img.shape[0], 
-                                        prev_x:prev_x + prev_img.shape[1]] = prev_img
-                            except ValueError:
-                                pass
-                    # Destello blanco
-                    frame_img = np.ones((HEIGHT, WIDTH, 3), dtype=np.uint8) * 255
-                else:
-                    try:
-                        frame_img[center_y:center_y + img_with_border.shape[0], 
-                                center_x:center_x + img_with_border.shape[1]] = img_with_border
-                    except ValueError:
-                        pass  # Ignorar errores de tamaño
-        
-        # Escribir frame
-        out.write(frame_img)
-        
-        # Mostrar barra de progreso
-        if frame % 30 == 0 or frame == total_frames - 1:  # Actualizar cada segundo y en el último frame
-            progress = (frame + 1) / total_frames  # Sumamos 1 para asegurar que llegue a 1.0
-            filled_length = int(bar_length * progress)
-            bar = '█' * filled_length + '░' * (bar_length - filled_length)
-            percent = progress * 100
-            print(f'\rProgreso: |{bar}| {percent:.1f}%', end='', flush=True)
+    frame = 0
+    try:
+        for frame_img, repeat in iter_frame_runs(prepared_images, total_frames):
+            # Escribir el mismo buffer para todos los frames idénticos de la tanda
+            write_run(out, frame_img, repeat)
+            for _ in range(repeat):
+                # Mostrar barra de progreso
+                if frame % 30 == 0 or frame == total_frames - 1:  # Actualizar cada segundo y en el último frame
+                    print(f'\r{progress_bar(frame, total_frames)}', end='', flush=True)
+                frame += 1
+    except BaseException:
+        print()
+        abort_writer(out)
+        discard_partial(output_path)
+        raise
     
     print()  # Nueva línea al final
+    finish_video(output_path, out, audio, num_images, total_frames)
 
-    # Liberar recursos
-    print("\nFinalizando video...")
-    out.release()
-    
-    # Añadir sonido si existe
+# Variables de configuración que se copian a los procesos de render en paralelo
+CONFIG_NAMES = (
+    'WIDTH', 'HEIGHT', 'FPS', 'WAIT_DURATION', 'FLASH_DURATION', 'FRAME_BORDER', 'PREFETCH',
+    'ENCODER', 'VIDEO_CODEC', 'VIDEO_PRESET', 'VIDEO_CRF', 'ENCODER_THREADS', 'WRITE_QUEUE', 'IMAGE_CACHE',
+    'PROFILE', 'DRAFT', 'MUSIC_PATH',
+)
+
+def _init_worker(config):
+    globals().update(config)
+
+def prepared_rect(path):
+    # Rectángulo (x, y, ancho, alto) que ocupará la foto en el lienzo, calculado
+    # solo con la cabecera del archivo, sin decodificarla
+    with Image.open(path) as img:
+        (width, height), border = display_geometry(*img.size)
+    width, height = width + 2 * border, height + 2 * border
+    scale = min((WIDTH - 100) / width, (HEIGHT - 100) / height, 1.0)
+    if scale < 1.0:
+        width, height = int(width * scale), int(height * scale)
+    width, height = width + 40, height + 40  # Borde de prepare_image
+    return (WIDTH - width) // 2, (HEIGHT - height) // 2, width, height
+
+def visible_predecessors(rects, first):
+    # Índices de las fotos anteriores a `first` que siguen viéndose en el lienzo
+    # cuando empieza la foto `first`. Una foto queda oculta si alguna posterior
+    # la cubre por completo; las ocultas no hace falta ni decodificarlas.
+    covering = [rects[first]]
+    visible = []
+    for i in range(first - 1, -1, -1):
+        x, y, width, height = rects[i]
+        if not any(cx <= x and cy <= y and cx + cw >= x + width and cy + ch >= y + height
+                   for cx, cy, cw, ch in covering):
+            visible.append(i)
+            covering.append(rects[i])
+    return visible[::-1]
+
+def first_frame_at(start_time):
+    # Primer frame cuyo instante (frame / FPS) alcanza start_time, con la misma
+    # aritmética que el compositor para que los cortes sean exactos
+    frame = int(start_time * FPS)
+    while frame / FPS < start_time:
+        frame += 1
+    while frame > 0 and (frame - 1) / FPS >= start_time:
+        frame -= 1
+    return frame
+
+def render_segment(items, first_frame, end_frame, segment_path):
+    # Renderiza y codifica un tramo de la línea de tiempo en un proceso aparte.
+    # items son pares (ruta, inicio) con las fotos visibles anteriores al tramo
+    # seguidas de las fotos del propio tramo. Devuelve los frames escritos y
+    # los tiempos por etapa del tramo
+    global PROFILER
+    PROFILER = Perfilador('animacion', PROFILE)
+    paths = [path for path, _ in items]
+    start_times = [start_time for _, start_time in items]
+    images = iter_images_with_frame(paths, PREFETCH)
+    out = open_async_writer(open_video_writer(segment_path))
+    try:
+        for frame_img, repeat in iter_frame_runs(iter_prepared_images(images, start_times),
+                                                 end_frame, first_frame):
+            write_run(out, frame_img, repeat)
+    except BaseException:
+        abort_writer(out)
+        raise
+    release_writer(out)
+    return end_frame - first_frame, PROFILER.etapas
+
+def concat_segments(segment_paths, output_path, audio=None):
+    # Une los tramos sin recodificar con el demuxer concat de ffmpeg y, si hay
+    # pista de obturador o música, la multiplexa en la misma pasada
+    list_path = os.path.join(os.path.dirname(segment_paths[0]), "segments.txt")
+    with open(list_path, 'w') as f:
+        for path in segment_paths:
+            f.write(f"file '{os.path.abspath(path)}'\n")
+
+    command = ['ffmpeg', '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0', '-i', list_path]
+    pass_fds = ()
+    feed_audio = None
+    inputs = audio_inputs(audio, 1)
+    if inputs is not None:
+        audio_args, map_args, pass_fds, feed_audio = inputs
+        command += audio_args + ['-map', '0:v'] + map_args
+    command += ['-c:v', 'copy', '-movflags', '+faststart', output_path]
+
+    run_ffmpeg(command, pass_fds, feed_audio)
+    return inputs is not None
+
+def create_animation_parallel(paths, workers):
+    # Divide la línea de tiempo en tramos por fronteras de foto y renderiza cada
+    # tramo en su propio proceso; después se concatenan sin pérdidas con ffmpeg
+    num_images = len(paths)
+    if not num_images:
+        raise ValueError("No se han encontrado imágenes en la carpeta especificada.")
+    num_segments = min(workers, num_images)
+
+    print("\nPreparando la animación...")
+    total_frames = int(WAIT_DURATION * num_images * FPS)
+    print(f"Duración total: {total_frames/FPS:.1f} segundos")
+    print(f"Renderizando en {num_segments} tramos con {workers} procesos")
+
+    audio = None
     if os.path.exists(SHUTTER_SOUND_PATH):
-        print("\nAñadiendo sonido al video...")
         try:
-            # Crear una copia del video original
-            backup_video = "backup_video.mp4"
-            subprocess.run(['cp', output_path, backup_video], check=True)
-            
-            # Crear un archivo de audio temporal con silencio
-            temp_audio = "temp_audio.wav"
-            sample_rate = 44100
-            total_duration = total_frames / FPS
-            
-            # Leer el sonido original para obtener el número de canales
-            click_audio, click_sr = sf.read(SHUTTER_SOUND_PATH)
-            num_channels = 2 if len(click_audio.shape) > 1 else 1
-            
-            # Crear silencio con el mismo número de canales que el sonido original
-            silence = np.zeros((int(total_duration * sample_rate), num_channels))
-            
-            # Asegurarnos de que el click no sea más largo que FLASH_DURATION
-            click_audio = click_audio[:int(FLASH_DURATION * click_sr)]
-            
-            # Resamplear si es necesario
-            if click_sr != sample_rate:
-                from scipy import signal
-                click_audio = signal.resample(click_audio, int(len(click_audio) * sample_rate / click_sr))
-            
-            # Normalizar el audio del click
-            click_audio = click_audio / np.max(np.abs(click_audio))
-            
-            # Añadir el sonido de click en cada transición
-            for i in range(len(images)):
-                click_time = i * WAIT_DURATION
-                click_samples = int(click_time * sample_rate)
-                # Añadir el click al silencio
-                silence[click_samples:click_samples + len(click_audio)] = click_audio
-            
-            # Normalizar el audio final
-            silence = silence / np.max(np.abs(silence))
-            
-            # Guardar el audio temporal
-            sf.write(temp_audio, silence, sample_rate)
-            
-            # Combinar video y audio usando ffmpeg
-            temp_output = "temp_output.mp4"
-            print("Combinando video y audio...")
-            subprocess.run([
-                'ffmpeg', '-i', backup_video, '-i', temp_audio,
-                '-c:v', 'copy', '-c:a', 'aac', '-map', '0:v', '-map', '1:a',
-                '-shortest', temp_output
-            ], check=True)
-            
-            # Verificar que el nuevo archivo tiene un tamaño razonable
-            if os.path.getsize(temp_output) > os.path.getsize(backup_video) * 0.5:  # Al menos 50% del tamaño original
-                os.replace(temp_output, output_path)
-                print("Audio añadido correctamente")
-            else:
-                print("Error: El video resultante es demasiado pequeño. Manteniendo el video original.")
-                os.remove(temp_output)
-            
-            # Limpiar archivos temporales
-            os.remove(temp_audio)
-            os.remove(backup_video)
+            with PROFILER.etapa('audio'):
+                audio = build_shutter_track(num_images, total_frames)
         except Exception as e:
-            print(f"No se pudo añadir el audio: {e}")
-            print("Manteniendo el video original sin audio.")
+            print(f"No se pudo preparar el audio: {e}")
+            print("El video se generará sin audio.")
+
+    # Cada tramo necesita saber qué fotos anteriores siguen viéndose
+    rects = [prepared_rect(path) for path in paths]
+    bounds = [round(i * num_images / num_segments) for i in range(num_segments + 1)]
+
+    # Repartir los hilos de ffmpeg entre los procesos para no saturar la máquina
+    config = {name: globals()[name] for name in CONFIG_NAMES}
+    if not config['ENCODER_THREADS']:
+        config['ENCODER_THREADS'] = max(1, (os.cpu_count() or 1) // num_segments)
+    # La música se mezcla una sola vez al concatenar; sin esto, cada tramo
+    # (que hereda MUSIC_PATH al hacer fork) la decodificaría y mezclaría para
+    # nada, porque concat solo copia el video de los tramos
+    config['MUSIC_PATH'] = None
+
+    output_path = os.path.join(OUTPUT_FOLDER, OUTPUT_NAME)
+    print(f"\nCreando video en: {output_path}")
+    with tempfile.TemporaryDirectory(dir=OUTPUT_FOLDER) as temp_dir:
+        tasks = []
+        for index, (first, end) in enumerate(zip(bounds, bounds[1:])):
+            items = [(paths[i], i * WAIT_DURATION)
+                     for i in visible_predecessors(rects, first) + list(range(first, end))]
+            first_frame = first_frame_at(first * WAIT_DURATION)
+            end_frame = first_frame_at(end * WAIT_DURATION) if end < num_images else total_frames
+            segment_path = os.path.join(temp_dir, f"segment_{index:04d}.mp4")
+            tasks.append((items, first_frame, end_frame, segment_path))
+
+        print("\nGenerando frames del video...")
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(config,)) as pool:
+            futures = [pool.submit(render_segment, *task) for task in tasks]
+            for done, future in enumerate(as_completed(futures), 1):
+                _, stages = future.result()
+                # Los tiempos de los procesos se suman a los del perfil principal
+                for name, stage in stages.items():
+                    PROFILER.sumar(name, stage['wall'], stage['cpu'], stage['n'])
+                print(f'\rTramos terminados: {done}/{len(tasks)}', end='', flush=True)
+        print()
+
+        print("\nUniendo tramos...")
+        # Se une dentro de la carpeta temporal y solo entonces sustituye al
+        # vídeo anterior
+        joined_path = os.path.join(temp_dir, OUTPUT_NAME)
+        with PROFILER.etapa('finalizacion'):
+            muxed_audio = concat_segments([task[3] for task in tasks], joined_path, audio)
+        os.replace(joined_path, output_path)
+        if muxed_audio:
+            print("Audio añadido correctamente")
+
+class StageStats:
+    # Métricas de una etapa del pipeline: elementos procesados, tiempo de trabajo
+    # acumulado y profundidad de la cola por la que recibe el trabajo
+    def __init__(self, name, unit, workers=1, queue=None):
+        self.name = name
+        self.unit = unit
+        self.workers = workers
+        self.queue = queue
+        self.items = 0
+        self.busy = 0.0
+        self.depths = []
+        self._lock = threading.Lock()
+
+    def add(self, seconds, items=1):
+        with self._lock:
+            self.items += items
+            self.busy += seconds
+
+    def sample(self):
+        if self.queue is not None:
+            self.depths.append(self.queue.qsize())
+
+    def capacity(self):
+        # Elementos por segundo que la etapa podría procesar si nunca esperase
+        return self.items * self.workers / self.busy if self.busy else float('inf')
+
+    def summary(self, elapsed):
+        line = (f"   - {self.name}: {self.items} {self.unit}, {self.items / elapsed:.1f} {self.unit}/s "
+                f"(capacidad {self.capacity():.1f} {self.unit}/s con {self.workers} hilo(s)/proceso(s))")
+        if self.depths:
+            line += (f", cola media {sum(self.depths) / len(self.depths):.1f}"
+                     f"/{self.queue.maxsize} (máx {max(self.depths)})")
+        return line
+
+def _timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+def _fit_and_prepare(img, original_size):
+    # Mismas etapas del perfil que en serie: 'ajuste' y 'preparacion'
+    img = fit_image(img, original_size)
+    with PROFILER.etapa('preparacion'):
+        return prepare_image(img)
+
+def _put(q, item, failed):
+    # put bloqueante que se rinde si otra etapa ha fallado
+    while True:
+        try:
+            q.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            if failed.is_set():
+                raise RuntimeError("Pipeline detenido por un error en otra etapa")
+
+def _get(q, failed):
+    while True:
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            if failed.is_set():
+                raise RuntimeError("Pipeline detenido por un error en otra etapa")
+
+def run_pipeline(paths, out, total_frames, decode_workers, decode_processes=False):
+    # Pipeline productor/consumidor con colas acotadas entre etapas, para que la
+    # siguiente foto se decodifique y prepare mientras la actual se renderiza y
+    # se codifica:
+    #   decodificación (pool de hilos o procesos) -> preparación (pool de hilos)
+    #   -> render (compositor, hilo principal) -> codificación (hilo propio)
+    decoded = queue.Queue(PIPELINE_QUEUE_SIZE)   # futures de decodificación, en orden
+    prepared = queue.Queue(PIPELINE_QUEUE_SIZE)  # futures de preparación, en orden
+    runs = queue.Queue(PIPELINE_QUEUE_SIZE)      # tandas (frame, repeticiones)
+    stats = [
+        StageStats("decodificación", "fotos", decode_workers, decoded),
+        StageStats("preparación", "fotos", PIPELINE_PREPARE_WORKERS, prepared),
+        StageStats("render", "frames"),
+        StageStats("codificación", "frames", 1, runs),
+    ]
+    decode_stats, prepare_stats, render_stats, encode_stats = stats
+    failed = threading.Event()
+    errors = []
+    encoded = [0]
+
+    def stage(target):
+        # Ejecuta una etapa en su hilo; si falla, avisa al resto para que paren
+        def run():
+            try:
+                target()
+            except BaseException as e:
+                errors.append(e)
+                failed.set()
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    if decode_processes:
+        config = {name: globals()[name] for name in CONFIG_NAMES}
+        decode_pool = ProcessPoolExecutor(decode_workers, initializer=_init_worker, initargs=(config,))
+    else:
+        decode_pool = ThreadPoolExecutor(decode_workers)
+    prepare_pool = ThreadPoolExecutor(PIPELINE_PREPARE_WORKERS)
+
+    def feed_decode():
+        for path in paths:
+            _put(decoded, decode_pool.submit(_timed, decode_image, path), failed)
+        _put(decoded, None, failed)
+
+    def feed_prepare():
+        while (future := _get(decoded, failed)) is not None:
+            (img, original_size), seconds = future.result()
+            decode_stats.add(seconds)
+            _put(prepared, prepare_pool.submit(_timed, _fit_and_prepare, img, original_size), failed)
+        _put(prepared, None, failed)
+
+    def encode():
+        while (item := _get(runs, failed)) is not None:
+            frame_img, repeat = item
+            start = time.perf_counter()
+            write_frames(out, frame_img, repeat)
+            encode_stats.add(time.perf_counter() - start, repeat)
+            encoded[0] += repeat
+
+    def report():
+        # Muestra el progreso y muestrea la profundidad de las colas
+        while not done.wait(0.5):
+            for stage_stats in stats:
+                stage_stats.sample()
+            depths = " ".join(f"{s.name[:3]}:{s.queue.qsize()}/{s.queue.maxsize}"
+                              for s in stats if s.queue is not None)
+            print(f'\r{progress_bar(max(encoded[0] - 1, 0), total_frames)} · colas {depths}   ',
+                  end='', flush=True)
+
+    waited = [0.0]
+
+    def prepared_images():
+        index = 0
+        while True:
+            start = time.perf_counter()
+            future = _get(prepared, failed)
+            if future is None:
+                return
+            prepared_image, seconds = future.result()
+            waited[0] += time.perf_counter() - start
+            prepare_stats.add(seconds)
+            yield (*prepared_image, index * WAIT_DURATION)
+            index += 1
+
+    done = threading.Event()
+    started = time.perf_counter()
+    threads = [stage(feed_decode), stage(feed_prepare), stage(encode)]
+    reporter = threading.Thread(target=report, daemon=True)
+    reporter.start()
+    try:
+        render_start = time.perf_counter()
+        for frame_img, repeat in iter_frame_runs(prepared_images(), total_frames):
+            # El compositor reutiliza su lienzo: la cola recibe una copia por tanda
+            frame_img = frame_img.copy()
+            start = time.perf_counter()
+            _put(runs, (frame_img, repeat), failed)
+            waited[0] += time.perf_counter() - start
+            render_stats.items += repeat
+        render_stats.busy = time.perf_counter() - render_start - waited[0]
+        _put(runs, None, failed)
+    except BaseException as e:
+        errors.append(e)
+        failed.set()
+    finally:
+        for thread in threads:
+            thread.join()
+        done.set()
+        reporter.join()
+        decode_pool.shutdown(cancel_futures=True)
+        prepare_pool.shutdown(cancel_futures=True)
+    print(f'\r{progress_bar(total_frames - 1, total_frames)}' + ' ' * 40)
+    if errors:
+        raise errors[0]
+
+    elapsed = time.perf_counter() - started
+    # La codificación y el render no pasan por write_run ni por un escritor
+    # asíncrono; la decodificación en procesos no se mide en este proceso
+    PROFILER.sumar('codificacion', encode_stats.busy, n=encode_stats.items)
+    PROFILER.sumar('render', render_stats.busy, n=render_stats.items)
+    if decode_processes:
+        PROFILER.sumar('decodificacion', decode_stats.busy, n=decode_stats.items)
+    print(f"\n📊 Pipeline ({elapsed:.1f} s):")
+    for stage_stats in stats:
+        print(stage_stats.summary(elapsed))
+    # Comparar todas las etapas en fotos por segundo
+    frames_per_photo = total_frames / len(paths)
+    slowest = min(stats, key=lambda s: s.capacity() / (1 if s.unit == "fotos" else frames_per_photo))
+    print(f"   Cuello de botella probable: {slowest.name}")
+
+def create_animation_pipelined(paths, decode_workers=None, decode_processes=False):
+    # Igual que create_animation, pero con decodificación, preparación, render y
+    # codificación solapados en un pipeline (ver run_pipeline)
+    if not paths:
+        raise ValueError("No se han encontrado imágenes en la carpeta especificada.")
+    decode_workers = decode_workers or os.cpu_count() or 1
+    output_path, out, audio, total_frames = start_video(len(paths))
+    print("\nGenerando frames del video...")
+    try:
+        run_pipeline(paths, out, total_frames, decode_workers, decode_processes)
+    except BaseException:
+        abort_writer(out)
+        discard_partial(output_path)
+        raise
+    finish_video(output_path, out, audio, len(paths), total_frames)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Crea una presentación en vídeo con las fotos de una carpeta.")
+    parser.add_argument("carpeta", nargs="?", help="Carpeta con las fotos (si no se indica, se pregunta)")
+    parser.add_argument("--prefetch", type=int, default=PREFETCH,
+                        help=f"Fotos decodificadas por adelantado (por defecto: {PREFETCH})")
+    parser.add_argument("--encoder", choices=['opencv', 'ffmpeg'], default=ENCODER,
+                        help="'ffmpeg' codifica vídeo y audio en una sola pasada por tubería")
+    parser.add_argument("--codec", default=VIDEO_CODEC, help=f"Códec de vídeo para ffmpeg (por defecto: {VIDEO_CODEC})")
+    parser.add_argument("--preset", default=VIDEO_PRESET, help=f"Preset del códec (por defecto: {VIDEO_PRESET})")
+    parser.add_argument("--crf", type=int, default=VIDEO_CRF, help="Calidad constante del códec (opcional)")
+    parser.add_argument("--threads", type=int, default=ENCODER_THREADS,
+                        help="Hilos de codificación de ffmpeg (0 = automático)")
+    parser.add_argument("--write-queue", type=int, default=WRITE_QUEUE,
+                        help=f"Tandas de frames en cola hacia el hilo del codificador; 0 codifica en el hilo "
+                             f"principal (por defecto: {WRITE_QUEUE})")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Procesos de render en paralelo; con más de 1 la línea de tiempo se divide en tramos")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="Solapa decodificación, preparación, render y codificación con colas acotadas")
+    parser.add_argument("--decode-workers", type=int, default=None,
+                        help="Hilos (o procesos) de decodificación del pipeline (por defecto: núcleos disponibles)")
+    parser.add_argument("--decode-processes", action="store_true",
+                        help="Decodificar en un pool de procesos en lugar de hilos")
+    parser.add_argument("--musica", default=MUSIC_PATH,
+                        help="Música de fondo (cualquier formato que lea ffmpeg); se repite hasta el final del vídeo")
+    parser.add_argument("--volumen-musica", type=float, default=MUSIC_VOLUME,
+                        help=f"Volumen de la música respecto al obturador (por defecto: {MUSIC_VOLUME})")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="Semilla del orden aleatorio de las fotos (por defecto, una nueva en cada ejecución; "
+                             "siempre se muestra la usada)")
+    parser.add_argument("--borrador", action="store_true",
+                        help=f"Vista previa rápida: {DRAFT_WIDTH}x{DRAFT_HEIGHT} a {DRAFT_FPS} fps con x264 "
+                             f"{DRAFT_PRESET}, más una hoja de contactos con el orden de las fotos")
+    agregar_opciones_cache(parser)
+    agregar_opcion_perfil(parser)
+    args = parser.parse_args()
+    ENCODER, VIDEO_CODEC, VIDEO_PRESET = args.encoder, args.codec, args.preset
+    VIDEO_CRF, ENCODER_THREADS, WRITE_QUEUE = args.crf, args.threads, args.write_queue
+    IMAGE_CACHE = cache_desde_args(args)
+    MUSIC_PATH, MUSIC_VOLUME = args.musica, args.volumen_musica
+    if args.borrador:
+        # Las fotos se decodifican al tamaño de pantalla del borrador, así que
+        # en JPEG el modo draft ya las lee casi a tamaño miniatura. El audio
+        # se multiplexa en la misma pasada, como con --encoder ffmpeg
+        DRAFT, WIDTH, HEIGHT, FPS = True, DRAFT_WIDTH, DRAFT_HEIGHT, DRAFT_FPS
+        ENCODER, VIDEO_CODEC, VIDEO_PRESET = 'ffmpeg', 'libx264', DRAFT_PRESET
+        OUTPUT_NAME, AUDIO_SAMPLE_RATE = "animacion_fotos_borrador.mp4", DRAFT_SAMPLE_RATE
+    seed = args.seed if args.seed is not None else random.randrange(2 ** 32)
+    if MUSIC_PATH and not os.path.exists(MUSIC_PATH):
+        parser.error(f"No existe el archivo de música: {MUSIC_PATH}")
+    PROFILE = args.profile
+    PROFILER = Perfilador('animacion', PROFILE).iniciar()
+
+    # Solicitar al usuario la carpeta de entrada
+    print("\n=== Iniciando proceso de creación de animación ===")
+    INPUT_FOLDER = args.carpeta or input("Por favor, introduce la ruta de la carpeta donde están las fotos: ").strip()
+    if not os.path.exists(INPUT_FOLDER):
+        raise ValueError(f"La carpeta '{INPUT_FOLDER}' no existe.")
+
     if not os.path.exists(OUTPUT_FOLDER):
         print(f"\nCreando carpeta de salida: {OUTPUT_FOLDER}")
         os.makedirs(OUTPUT_FOLDER)
 
-    images = load_images_with_frame()
-    create_animation(images)
-    print("\n=== ¡Video creado exitosamente! ===")
\ No newline at end of file
+    paths = list_images(INPUT_FOLDER, seed)
+    print(f"\nTotal de imágenes encontradas: {len(paths)}")
+    print(f"Semilla del orden: {seed} (usa --seed {seed} para repetir este orden)")
+    PREFETCH = args.prefetch
+    contact_sheet = None
+    if args.borrador and args.workers > 1:
+        # Los tramos del borrador no se pueden unir con la precisión de frame
+        # del vídeo final (cada uno acaba con un frame de más), y en serie ya es rápido
+        print("El borrador se renderiza en serie; se ignora --workers")
+        args.workers = 1
+    if args.borrador and paths:
+        contact_sheet_path = os.path.join(OUTPUT_FOLDER, "animacion_fotos_borrador_contactos.jpg")
+        if args.pipeline:
+            with PROFILER.etapa('hoja_contactos'):
+                save_contact_sheet(paths, contact_sheet_path)
+            print(f"Hoja de contactos: {contact_sheet_path}")
+        else:
+            # En serie se aprovechan las fotos que ya decodifica el render
+            contact_sheet = ContactSheet(len(paths))
+    if args.workers > 1:
+        create_animation_parallel(paths, args.workers)
+    elif args.pipeline:
+        create_animation_pipelined(paths, args.decode_workers, args.decode_processes)
+    else:
+        images = iter_images_with_frame(paths, args.prefetch)
+        create_animation(contact_sheet.collect(images) if contact_sheet else images, len(paths))
+    if contact_sheet is not None:
+        contact_sheet.save(contact_sheet_path)
+        print(f"Hoja de contactos: {contact_sheet_path}")
+    if IMAGE_CACHE is not None and args.workers <= 1:
+        print(f"Caché de fotos: {IMAGE_CACHE.resumen()}")
+    profile_path = PROFILER.terminar(OUTPUT_FOLDER, len(paths))
+    if profile_path:
+        print()
+        for line in resumen_perfil(profile_path):
+            print(line)
+    print("\n=== ¡Video creado exitosamente! ===")
@@ -0,0 +1,431 @@
+import os
+import sys
+import csv
+import json
+import glob
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import importlib.util
+import subprocess
+import tracemalloc
+from datetime import datetime
+import numpy as np
+from PIL import Image, ImageDraw
+from vigilancia import cargar_modulo
+
+# Benchmarks reproducibles de animacion.py, enhancer.py y "collage photos.py".
+# Genera sin conexión corpus sintéticos y deterministas (JPEG y PNG de varias
+# resoluciones, con orientaciones EXIF, y su 'Lista alumnos.csv'), ejecuta cada
+# herramienta de principio a fin y algunas de sus funciones por separado con
+# varios tamaños de corpus, y compara el resultado con una línea base guardada.
+
+CARPETA_REPO = os.path.dirname(os.path.abspath(__file__))
+CARPETA_BENCHMARK = os.path.join("Output", "benchmark")
+VERSION_CORPUS = 1  # Cambiarla si cambia la forma de generar las fotos
+SEMILLA = 1234
+TAMANOS = [10, 40]  # Fotos de cada corpus (la mitad de alumnos, con su foto de antes y de después)
+UMBRAL = 0.15  # Empeoramiento máximo respecto a la línea base (15 %)
+# Diferencia tolerada entre mejorar_imagen_autoenhance_array y la versión de PIL
+DIFERENCIA_MAXIMA_AUTOENHANCE = 2  # Niveles, en cualquier canal y píxel
+DIFERENCIA_MEDIA_AUTOENHANCE = 0.01  # Niveles, de media en cada foto
+
+# (ancho, alto) de las fotos; las verticales simulan fotos de móvil
+RESOLUCIONES = [(640, 480), (1280, 960), (2048, 1536), (3000, 2000), (1080, 1920), (1536, 2048)]
+ORIENTACIONES = [1, 1, 1, 3, 6, 8]  # Valores de la etiqueta EXIF de orientación
+PROPORCION_PNG = 0.25
+
+NOMBRES = ["Lucía", "Hugo", "Martina", "Mateo", "Sofía", "Martín", "María", "Pablo", "Julia", "Álvaro",
+           "Paula", "Leo", "Valeria", "Daniel", "Emma", "Alejandro", "Jimena", "Íñigo", "Noa", "Adrián"]
+APELLIDOS = ["García", "Rodríguez", "González", "Fernández", "López", "Martínez", "Sánchez", "Pérez",
+             "Gómez", "Martín", "Jiménez", "Ruiz", "Hernández", "Díaz", "Moreno", "Muñoz", "Álvarez",
+             "Romero", "Alonso", "Gutiérrez", "Navarro", "Torres", "Domínguez", "Vázquez", "Ramos"]
+
+HERRAMIENTAS = ["enhancer", "collage", "animacion"]
+FUNCIONES = ["autoenhance", "autoenhance_pil", "escalar_sin_recorte", "cargar_escalada",
+             "load_display_image", "composicion_animacion"]
+
+# --- Corpus sintético ---
+
+def generar_foto(rng, ancho, alto):
+    # Degradado de fondo con figuras y ruido: se comprime como una foto real,
+    # no como un color plano
+    x = np.linspace(0, 1, ancho, dtype=np.float32)[None, :, None]
+    y = np.linspace(0, 1, alto, dtype=np.float32)[:, None, None]
+    c0, c1, c2 = (rng.uniform(0, 255, 3).astype(np.float32) for _ in range(3))
+    fondo = c0 + (c1 - c0) * x + (c2 - c0) * y
+    fondo += rng.normal(0, 6, (alto, ancho, 1)).astype(np.float32)
+    img = Image.fromarray(np.clip(fondo, 0, 255).astype(np.uint8))
+    draw = ImageDraw.Draw(img)
+    for _ in range(12):
+        x0, x1 = sorted(rng.integers(0, ancho, 2))
+        y0, y1 = sorted(rng.integers(0, alto, 2))
+        color = tuple(int(v) for v in rng.integers(0, 256, 3))
+        if rng.random() < 0.5:
+            draw.ellipse([x0, y0, x1, y1], fill=color)
+        else:
+            draw.rectangle([x0, y0, x1, y1], fill=color)
+    return img
+
+def generar_corpus(carpeta, tamano, semilla=SEMILLA):
+    # Crea (o reutiliza si ya existe) un corpus con `tamano` fotos en
+    # carpeta/Fotos, como {N}_bf y {N}_af, y carpeta/'Lista alumnos.csv'.
+    # El contenido solo depende del tamaño, la semilla y VERSION_CORPUS
+    parametros = {"version": VERSION_CORPUS, "tamano": tamano, "semilla": semilla}
+    ruta_parametros = os.path.join(carpeta, "corpus.json")
+    if os.path.exists(ruta_parametros):
+        with open(ruta_parametros, encoding="utf-8") as f:
+            if json.load(f) == parametros:
+                return carpeta
+    shutil.rmtree(carpeta, ignore_errors=True)
+    fotos = os.path.join(carpeta, "Fotos")
+    os.makedirs(fotos)
+
+    rng = np.random.default_rng([semilla, tamano])
+    with open(os.path.join(carpeta, "Lista alumnos.csv"), "w", newline="", encoding="utf-8") as f:
+        escritor = csv.writer(f, delimiter=";")
+        escritor.writerow(["N", "Nombre", "Apellido 1", "Apellido 2"])
+        for n in range(1, tamano // 2 + 1):
+            escritor.writerow([n, rng.choice(NOMBRES), rng.choice(APELLIDOS), rng.choice(APELLIDOS)])
+            for momento in ("bf", "af"):
+                ancho, alto = RESOLUCIONES[rng.integers(len(RESOLUCIONES))]
+                img = generar_foto(rng, ancho, alto)
+                if rng.random() < PROPORCION_PNG:
+                    img.save(os.path.join(fotos, f"{n}_{momento}.png"))
+                else:
+                    exif = Image.Exif()
+                    exif[274] = int(rng.choice(ORIENTACIONES))
+                    img.save(os.path.join(fotos, f"{n}_{momento}.jpg"), quality=90, exif=exif)
+
+    with open(ruta_parametros, "w", encoding="utf-8") as f:
+        json.dump(parametros, f)
+    return carpeta
+
+def fotos_corpus(carpeta):
+    fotos = os.path.join(carpeta, "Fotos")
+    return [os.path.join(fotos, nombre) for nombre in sorted(os.listdir(fotos))]
+
+# --- Métricas ---
+
+def metricas(segundos_total, elementos, latencias=None, pico_mb=None, unidad="fotos"):
+    # Resumen común a todos los casos; latencias en segundos
+    resultado = {
+        "segundos": segundos_total,
+        "elementos": elementos,
+        "unidad": unidad,
+        "por_segundo": elementos / segundos_total if segundos_total else None,
+        "pico_mb": pico_mb,
+    }
+    if latencias:
+        p50, p95, p99 = np.percentile(np.asarray(latencias) * 1000, [50, 95, 99])
+        resultado.update({"p50_ms": float(p50), "p95_ms": float(p95), "p99_ms": float(p99)})
+    return resultado
+
+def mediana_repeticiones(medidas):
+    # De varias repeticiones se queda con la de tiempo mediano y con el mayor
+    # pico de memoria
+    medidas = sorted(medidas, key=lambda m: m["segundos"])
+    resultado = dict(medidas[len(medidas) // 2])
+    picos = [m["pico_mb"] for m in medidas if m["pico_mb"] is not None]
+    resultado["pico_mb"] = max(picos) if picos else None
+    resultado["repeticiones"] = len(medidas)
+    return resultado
+
+# --- De principio a fin ---
+
+def ejecutar(comando, cwd):
+    # Ejecuta una herramienta en un proceso aparte. Devuelve el tiempo real y el
+    # pico de memoria (RSS) del proceso y de los suyos, si el sistema lo da
+    with tempfile.TemporaryFile() as errores:
+        inicio = time.perf_counter()
+        proceso = subprocess.Popen(comando, cwd=cwd, stdout=subprocess.DEVNULL, stderr=errores)
+        if hasattr(os, "wait4"):
+            # wait4 devuelve el uso de recursos de este proceso en concreto
+            _, estado, uso = os.wait4(proceso.pid, 0)
+            proceso.returncode = os.waitstatus_to_exitcode(estado)
+            pico_mb = uso.ru_maxrss / 1024 ** 2 if sys.platform == "darwin" else uso.ru_maxrss / 1024
+        else:
+            proceso.wait()
+            pico_mb = None
+        segundos = time.perf_counter() - inicio
+        if proceso.returncode != 0:
+            errores.seek(0)
+            raise RuntimeError(f"{' '.join(comando)} terminó con código {proceso.returncode}:\n"
+                               f"{errores.read().decode(errors='replace')}")
+    return segundos, pico_mb
+
+def latencias_perfil(carpeta):
+    # Latencia de cada elemento (suma de sus etapas) según el --profile de la herramienta
+    rutas = sorted(glob.glob(os.path.join(carpeta, "perfil_*.json")))
+    if not rutas:
+        return []
+    with open(rutas[-1], encoding="utf-8") as f:
+        perfil = json.load(f)
+    latencias = {}
+    for item in perfil["items"]:
+        latencias[item["item"]] = latencias.get(item["item"], 0.0) + sum(e["wall"] for e in item["etapas"].values())
+    return list(latencias.values())
+
+def preparar_ejecucion(herramienta, corpus, temporal, workers):
+    # Comando, carpeta de trabajo, carpeta donde queda el perfil y elementos de una ejecución
+    fotos = os.path.abspath(os.path.join(corpus, "Fotos"))
+    num_fotos = len(os.listdir(fotos))
+    if herramienta == "enhancer":
+        salida = os.path.join(temporal, "salida")
+        comando = [sys.executable, os.path.join(CARPETA_REPO, "enhancer.py"), fotos, "--salida", salida,
+                   "--escala", "down", "--autoenhance", "--sin-cache", "--workers", str(workers), "--profile"]
+        return comando, temporal, salida, num_fotos, "fotos"
+    if herramienta == "collage":
+        # El collage escribe en <dir>/Output: se le da una carpeta propia que
+        # apunta a las fotos y a la lista del corpus
+        for nombre in ("Fotos", "Lista alumnos.csv"):
+            origen, destino = os.path.abspath(os.path.join(corpus, nombre)), os.path.join(temporal, nombre)
+            try:
+                os.symlink(origen, destino)
+            except OSError:
+                (shutil.copytree if os.path.isdir(origen) else shutil.copy)(origen, destino)
+        comando = [sys.executable, os.path.join(CARPETA_REPO, "collage photos.py"), "--dir", temporal,
+                   "--workers", str(workers), "--profile"]
+        return comando, temporal, os.path.join(temporal, "Output"), num_fotos // 2, "collages"
+    if herramienta == "animacion":
+        # Sin shutter.mp3 en la carpeta de trabajo, así que sin audio
+        comando = [sys.executable, os.path.join(CARPETA_REPO, "animacion.py"), fotos, "--profile"]
+        if shutil.which("ffmpeg"):
+            comando += ["--encoder", "ffmpeg", "--preset", "ultrafast"]
+        if workers > 1:
+            comando += ["--workers", str(workers)]
+        return comando, temporal, os.path.join(temporal, "Output"), num_fotos, "fotos"
+    raise ValueError(f"Herramienta desconocida: {herramienta}")
+
+def medir_herramienta(herramienta, corpus, workers=1, repeticiones=1):
+    medidas = []
+    for _ in range(repeticiones):
+        with tempfile.TemporaryDirectory(prefix="benchmark_") as temporal:
+            comando, cwd, carpeta_perfil, elementos, unidad = preparar_ejecucion(herramienta, corpus, temporal,
+                                                                                 workers)
+            segundos, pico_mb = ejecutar(comando, cwd)
+            medidas.append(metricas(segundos, elementos, latencias_perfil(carpeta_perfil), pico_mb, unidad))
+    return mediana_repeticiones(medidas)
+
+# --- Funciones por separado ---
+
+def medir_llamadas(funcion, entradas, unidad="fotos"):
+    # Llama a funcion(entrada) para cada entrada, ya cargada en memoria, y mide
+    # la latencia de cada llamada y el pico de memoria de Python/NumPy (la que
+    # reservan PIL u OpenCV por dentro no se ve)
+    latencias = []
+    tracemalloc.start()
+    inicio = time.perf_counter()
+    for entrada in entradas:
+        t = time.perf_counter()
+        funcion(entrada)
+        latencias.append(time.perf_counter() - t)
+    total = time.perf_counter() - inicio
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return metricas(total, len(latencias), latencias, pico / 1024 ** 2, unidad)
+
+def comprobar_autoenhance(enhancer, rutas):
+    # Compara mejorar_imagen_autoenhance_array con la versión original de PIL
+    # sobre los mismos píxeles (la entrada se le pasa como PNG, sin pérdidas) y
+    # falla si alguna foto se sale de la tolerancia. Devuelve las diferencias
+    # máxima y media más altas
+    import cv2
+    peor_maxima, peor_media = 0, 0.0
+    with tempfile.TemporaryDirectory(prefix="benchmark_") as temporal:
+        entrada, salida = os.path.join(temporal, "entrada.png"), os.path.join(temporal, "salida.png")
+        for ruta in rutas:
+            img = cv2.imread(ruta)
+            cv2.imwrite(entrada, img)
+            enhancer.mejorar_imagen_autoenhance(entrada, salida)
+            diferencia = np.abs(enhancer.mejorar_imagen_autoenhance_array(img).astype(np.int16)
+                                - cv2.imread(salida))
+            maxima, media = int(diferencia.max()), float(diferencia.mean())
+            if maxima > DIFERENCIA_MAXIMA_AUTOENHANCE or media >= DIFERENCIA_MEDIA_AUTOENHANCE:
+                raise AssertionError(
+                    f"autoenhance se aleja de PIL en {os.path.basename(ruta)}: diferencia máxima {maxima} "
+                    f"(tolerancia {DIFERENCIA_MAXIMA_AUTOENHANCE}), media {media:.4f} "
+                    f"(tolerancia {DIFERENCIA_MEDIA_AUTOENHANCE})")
+            peor_maxima, peor_media = max(peor_maxima, maxima), max(peor_media, media)
+    return peor_maxima, peor_media
+
+def medir_funcion(nombre, corpus, repeticiones=1):
+    # Genera (caso, métricas); cargar_escalada da un caso por método de escalado
+    rutas = fotos_corpus(corpus)
+    if nombre in ("autoenhance", "autoenhance_pil"):
+        enhancer = cargar_modulo("enhancer", "enhancer.py")
+        if nombre == "autoenhance":
+            import cv2
+            maxima, media = comprobar_autoenhance(enhancer, rutas)
+            print(f"   ✔️  autoenhance frente a PIL: diferencia máxima {maxima}, media {media:.4f}")
+            imagenes = [cv2.imread(ruta) for ruta in rutas]
+            caso = lambda: medir_llamadas(enhancer.mejorar_imagen_autoenhance_array, imagenes)
+        else:
+            # La versión original de PIL, de archivo a archivo
+            with tempfile.TemporaryDirectory(prefix="benchmark_") as temporal:
+                destinos = [os.path.join(temporal, os.path.basename(ruta)) for ruta in rutas]
+                medidas = [medir_llamadas(lambda par: enhancer.mejorar_imagen_autoenhance(*par),
+                                          list(zip(rutas, destinos)))
+                           for _ in range(repeticiones)]
+            yield nombre, mediana_repeticiones(medidas)
+            return
+    elif nombre in ("escalar_sin_recorte", "cargar_escalada"):
+        collage = cargar_modulo("collage_photos", "collage photos.py")
+        if nombre == "escalar_sin_recorte":
+            imagenes = []
+            for ruta in rutas:
+                im = collage.corregir_orientacion(Image.open(ruta))
+                im.load()
+                imagenes.append(im)
+            caso = lambda: medir_llamadas(collage.escalar_sin_recorte, imagenes)
+        else:
+            # Decodificación y escalado de una mitad del collage con cada método
+            for metodo in collage.METODOS_ESCALADO:
+                if metodo == "opencv" and importlib.util.find_spec("cv2") is None:
+                    continue
+                medidas = [medir_llamadas(lambda ruta: collage.cargar_escalada(ruta, metodo), rutas)
+                           for _ in range(repeticiones)]
+                yield f"{nombre}[{metodo}]", mediana_repeticiones(medidas)
+            return
+    elif nombre in ("load_display_image", "composicion_animacion"):
+        animacion = cargar_modulo("animacion", "animacion.py")
+        if nombre == "load_display_image":
+            caso = lambda: medir_llamadas(animacion.load_display_image, rutas)
+        else:
+            # Compositor de create_animation sin codificar: frames por segundo
+            imagenes = [animacion.load_display_image(ruta) for ruta in rutas]
+            total_frames = int(animacion.WAIT_DURATION * len(imagenes) * animacion.FPS)
+
+            def caso():
+                preparadas = animacion.iter_prepared_images((os.path.basename(r), img)
+                                                            for r, img in zip(rutas, imagenes))
+                latencias, frames = [], 0
+                tracemalloc.start()
+                inicio = t = time.perf_counter()
+                for _, repeat in animacion.iter_frame_runs(preparadas, total_frames):
+                    latencias.append(time.perf_counter() - t)
+                    frames += repeat
+                    t = time.perf_counter()
+                total = time.perf_counter() - inicio
+                _, pico = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                return metricas(total, frames, latencias, pico / 1024 ** 2, "frames")
+    else:
+        raise ValueError(f"Función desconocida: {nombre}")
+    yield nombre, mediana_repeticiones([caso() for _ in range(repeticiones)])
+
+# --- Comparación con la línea base ---
+
+# Métricas que se comparan y si es mejor que suban (True) o que bajen (False)
+METRICAS_COMPARADAS = {"por_segundo": True, "p95_ms": False, "pico_mb": False}
+MIN_MB_COMPARADO = 1.0  # Picos de memoria menores son ruido y no se comparan
+
+def comparar(resultados, base, umbral=UMBRAL):
+    # Devuelve (líneas del informe, regresiones). Solo se comparan los casos y
+    # métricas que están en los dos
+    lineas, regresiones = [], []
+    for caso, actual in resultados["casos"].items():
+        anterior = base["casos"].get(caso)
+        if anterior is None:
+            continue
+        for metrica, mejor_si_sube in METRICAS_COMPARADAS.items():
+            valor, referencia = actual.get(metrica), anterior.get(metrica)
+            if not valor or not referencia or (metrica == "pico_mb" and referencia < MIN_MB_COMPARADO):
+                continue
+            cambio = valor / referencia - 1
+            empeora = -cambio if mejor_si_sube else cambio
+            marca = "❌" if empeora > umbral else "✅"
+            linea = f"   {marca} {caso} {metrica}: {referencia:.1f} -> {valor:.1f} ({cambio:+.1%})"
+            lineas.append(linea)
+            if empeora > umbral:
+                regresiones.append(linea)
+    return lineas, regresiones
+
+def describir(caso, m):
+    linea = f"   - {caso}: {m['por_segundo']:.1f} {m['unidad']}/s ({m['segundos']:.2f} s)"
+    if "p50_ms" in m:
+        linea += f", p50 {m['p50_ms']:.1f} ms, p95 {m['p95_ms']:.1f} ms, p99 {m['p99_ms']:.1f} ms"
+    if m["pico_mb"] is not None:
+        linea += f", pico {m['pico_mb']:.0f} MB"
+    return linea
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmarks de las herramientas con corpus sintéticos y deterministas.")
+    parser.add_argument("--tamanos", default=",".join(map(str, TAMANOS)),
+                        help=f"Fotos de cada corpus, separadas por comas (por defecto: {','.join(map(str, TAMANOS))})")
+    parser.add_argument("--herramientas", default=",".join(HERRAMIENTAS),
+                        help="Herramientas que se ejecutan de principio a fin ('' para ninguna)")
+    parser.add_argument("--funciones", default=",".join(FUNCIONES),
+                        help="Funciones que se miden por separado ('' para ninguna)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Procesos de las ejecuciones de principio a fin (por defecto: 1)")
+    parser.add_argument("--repeticiones", type=int, default=3,
+                        help="Repeticiones de cada caso; se toma la de tiempo mediano (por defecto: 3)")
+    parser.add_argument("--semilla", type=int, default=SEMILLA, help=f"Semilla del corpus (por defecto: {SEMILLA})")
+    parser.add_argument("--salida", default=CARPETA_BENCHMARK,
+                        help=f"Carpeta de los corpus y los resultados (por defecto: {CARPETA_BENCHMARK})")
+    parser.add_argument("--guardar-base", metavar="RUTA", help="Guardar los resultados como línea base")
+    parser.add_argument("--comparar", metavar="RUTA", help="Comparar con una línea base y fallar si empeora")
+    parser.add_argument("--umbral", type=float, default=UMBRAL,
+                        help=f"Empeoramiento tolerado al comparar, en tanto por uno (por defecto: {UMBRAL})")
+    args = parser.parse_args()
+
+    tamanos = [int(t) for t in args.tamanos.split(",") if t]
+    herramientas = [h for h in args.herramientas.split(",") if h]
+    funciones = [f for f in args.funciones.split(",") if f]
+    for nombre in herramientas:
+        if nombre not in HERRAMIENTAS:
+            parser.error(f"Herramienta desconocida: {nombre} (usa {', '.join(HERRAMIENTAS)})")
+    for nombre in funciones:
+        if nombre not in FUNCIONES:
+            parser.error(f"Función desconocida: {nombre} (usa {', '.join(FUNCIONES)})")
+
+    resultados = {
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "cpus": os.cpu_count(),
+        "semilla": args.semilla,
+        "workers": args.workers,
+        "casos": {},
+    }
+    for tamano in tamanos:
+        print(f"\n🧪 Corpus de {tamano} fotos")
+        corpus = generar_corpus(os.path.join(args.salida, f"corpus_{tamano}_s{args.semilla}"), tamano, args.semilla)
+        for herramienta in herramientas:
+            caso = f"{herramienta}/n={tamano}"
+            resultados["casos"][caso] = medir_herramienta(herramienta, corpus, args.workers, args.repeticiones)
+            print(describir(caso, resultados["casos"][caso]))
+        for funcion in funciones:
+            for nombre, medida in medir_funcion(funcion, corpus, args.repeticiones):
+                caso = f"{nombre}/n={tamano}"
+                resultados["casos"][caso] = medida
+                print(describir(caso, medida))
+
+    ruta = os.path.join(args.salida, f"benchmark_{datetime.now():%Y%m%d-%H%M%S}.json")
+    with open(ruta, "w", encoding="utf-8") as f:
+        json.dump(resultados, f, ensure_ascii=False, indent=1)
+    print(f"\n📄 Resultados guardados en: {ruta}")
+    if args.guardar_base:
+        shutil.copy(ruta, args.guardar_base)
+        print(f"📌 Línea base guardada en: {args.guardar_base}")
+
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            base = json.load(f)
+        lineas, regresiones = comparar(resultados, base, args.umbral)
+        print(f"\n📊 Comparación con {args.comparar} (umbral {args.umbral:.0%}):")
+        for linea in lineas:
+            print(linea)
+        if not lineas:
+            print("   (ningún caso en común con la línea base)")
+        if regresiones:
+            print(f"\n❌ {len(regresiones)} regresiones por encima del umbral")
+            sys.exit(1)
+        print("\n✅ Sin regresiones")
+
+if __name__ == "__main__":
+    main()
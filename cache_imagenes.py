@@ -0,0 +1,232 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+
+# Caché de fotos ya decodificadas y reducidas, compartida por animacion.py,
+# enhancer.py y "collage photos.py". Cada versión reducida ("rendición") se
+# guarda como .npy (BGR, uint8, en la orientación de los píxeles del archivo, sin
+# aplicar la rotación EXIF) y un índice sqlite la localiza por hash y fecha de
+# modificación del original, tamaño de destino e interpolación. Encima del disco
+# hay una capa en memoria para las fotos que se piden varias veces en el mismo
+# proceso.
+
+CARPETA_CACHE = os.path.join("Output", ".cache_imagenes")
+MAX_MB_CACHE = 2048  # Tamaño máximo en disco; al pasarse se borran las menos usadas
+MAX_MB_MEMORIA = 256  # Tamaño máximo de la capa en memoria de cada proceso
+
+def hash_archivo(ruta, bloque=1 << 20):
+    sha256 = hashlib.sha256()
+    with open(ruta, "rb") as f:
+        for trozo in iter(lambda: f.read(bloque), b""):
+            sha256.update(trozo)
+    return sha256.hexdigest()
+
+class CacheImagenes:
+    # obtener(ruta, tamano, interpolacion, generar) devuelve la rendición de
+    # `ruta` a `tamano` (ancho, alto): de memoria, del disco o, si no está,
+    # llamando a generar() y guardando el resultado. Con derivar=True, si falta
+    # la rendición exacta pero hay otra mayor de la misma foto (por ejemplo la de
+    # los collages al montar la animación), se reduce esa con INTER_AREA en
+    # lugar de decodificar el original.
+    # Los arrays devueltos son de solo lectura porque pueden compartirse.
+    # Se puede pasar a otros procesos: cada uno abre su propia conexión.
+    def __init__(self, carpeta=CARPETA_CACHE, max_mb=MAX_MB_CACHE, max_mb_memoria=MAX_MB_MEMORIA, derivar=True):
+        self.carpeta = carpeta
+        self.max_bytes = int(max_mb * 1024 ** 2)
+        self.max_bytes_memoria = int(max_mb_memoria * 1024 ** 2)
+        self.derivar = derivar
+        self._iniciar()
+
+    def _iniciar(self):
+        self._conexion = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._memoria = OrderedDict()
+        self._bytes_memoria = 0
+        self.estadisticas = {"memoria": 0, "disco": 0, "derivadas": 0, "generadas": 0, "expulsadas": 0}
+
+    def __getstate__(self):
+        return {"carpeta": self.carpeta, "max_bytes": self.max_bytes,
+                "max_bytes_memoria": self.max_bytes_memoria, "derivar": self.derivar}
+
+    def __setstate__(self, estado):
+        self.__dict__.update(estado)
+        self._iniciar()
+
+    def _abrir(self):
+        # Una conexión por proceso (también tras un fork)
+        if self._conexion is None or self._pid != os.getpid():
+            os.makedirs(self.carpeta, exist_ok=True)
+            conexion = sqlite3.connect(os.path.join(self.carpeta, "indice.sqlite"), timeout=60,
+                                       check_same_thread=False, isolation_level=None)
+            conexion.execute("PRAGMA journal_mode=WAL")
+            conexion.execute("""CREATE TABLE IF NOT EXISTS origenes (
+                ruta TEXT PRIMARY KEY, tamano INTEGER, mtime_ns INTEGER, sha256 TEXT)""")
+            conexion.execute("""CREATE TABLE IF NOT EXISTS rendiciones (
+                sha256 TEXT, mtime_ns INTEGER, ancho INTEGER, alto INTEGER, interpolacion TEXT,
+                archivo TEXT, bytes INTEGER, ultimo_uso REAL,
+                PRIMARY KEY (sha256, mtime_ns, ancho, alto, interpolacion))""")
+            self._conexion, self._pid = conexion, os.getpid()
+        return self._conexion
+
+    def _huella(self, ruta):
+        # (sha256, mtime_ns) del original; el hash solo se recalcula (fuera del
+        # lock) si el tamaño o la fecha de modificación han cambiado
+        estado = os.stat(ruta)
+        ruta_abs = os.path.abspath(ruta)
+        with self._lock:
+            fila = self._abrir().execute("SELECT tamano, mtime_ns, sha256 FROM origenes WHERE ruta = ?",
+                                         (ruta_abs,)).fetchone()
+        if fila and fila[0] == estado.st_size and fila[1] == estado.st_mtime_ns:
+            return fila[2], estado.st_mtime_ns
+        sha256 = hash_archivo(ruta)
+        with self._lock:
+            self._abrir().execute("INSERT OR REPLACE INTO origenes VALUES (?, ?, ?, ?)",
+                                  (ruta_abs, estado.st_size, estado.st_mtime_ns, sha256))
+        return sha256, estado.st_mtime_ns
+
+    def _leer(self, conexion, clave, archivo):
+        try:
+            img = np.load(os.path.join(self.carpeta, archivo))
+        except (OSError, ValueError):
+            # Rendición borrada o corrupta: se olvida y se regenera
+            conexion.execute("DELETE FROM rendiciones WHERE sha256 = ? AND mtime_ns = ? AND ancho = ? "
+                             "AND alto = ? AND interpolacion = ?", clave)
+            return None
+        conexion.execute("UPDATE rendiciones SET ultimo_uso = ? WHERE sha256 = ? AND mtime_ns = ? AND ancho = ? "
+                         "AND alto = ? AND interpolacion = ?", (time.time(), *clave))
+        return img
+
+    def _guardar(self, conexion, clave, img):
+        archivo = hashlib.sha1(repr(clave).encode()).hexdigest()
+        archivo = os.path.join(archivo[:2], archivo + ".npy")
+        ruta = os.path.join(self.carpeta, archivo)
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        temporal = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporal, "wb") as f:
+            np.save(f, np.ascontiguousarray(img))
+        os.replace(temporal, ruta)
+        conexion.execute("INSERT OR REPLACE INTO rendiciones VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                         (*clave, archivo, os.path.getsize(ruta), time.time()))
+        self._expulsar(conexion)
+
+    def _expulsar(self, conexion):
+        # LRU por tamaño: al pasar del máximo se borran las rendiciones usadas
+        # hace más tiempo hasta quedar en el 90 %
+        total = conexion.execute("SELECT COALESCE(SUM(bytes), 0) FROM rendiciones").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for *clave, archivo, tamano in conexion.execute(
+                "SELECT sha256, mtime_ns, ancho, alto, interpolacion, archivo, bytes FROM rendiciones "
+                "ORDER BY ultimo_uso").fetchall():
+            if total <= 0.9 * self.max_bytes:
+                break
+            conexion.execute("DELETE FROM rendiciones WHERE sha256 = ? AND mtime_ns = ? AND ancho = ? "
+                             "AND alto = ? AND interpolacion = ?", clave)
+            try:
+                os.remove(os.path.join(self.carpeta, archivo))
+            except OSError:
+                pass
+            total -= tamano
+            self.estadisticas["expulsadas"] += 1
+
+    def _recordar(self, clave, img):
+        img.flags.writeable = False
+        if img.nbytes > self.max_bytes_memoria:
+            return img
+        with self._lock:
+            if clave not in self._memoria:
+                self._memoria[clave] = img
+                self._bytes_memoria += img.nbytes
+            while self._bytes_memoria > self.max_bytes_memoria:
+                _, antigua = self._memoria.popitem(last=False)
+                self._bytes_memoria -= antigua.nbytes
+        return img
+
+    def obtener(self, ruta, tamano, interpolacion, generar):
+        ancho, alto = tamano
+        clave = (*self._huella(ruta), ancho, alto, interpolacion)
+        with self._lock:
+            conexion = self._abrir()
+            if clave in self._memoria:
+                self._memoria.move_to_end(clave)
+                self.estadisticas["memoria"] += 1
+                return self._memoria[clave]
+
+            fila = conexion.execute(
+                "SELECT archivo FROM rendiciones WHERE sha256 = ? AND mtime_ns = ? AND ancho = ? AND alto = ? "
+                "AND interpolacion = ?", clave).fetchone()
+            img = self._leer(conexion, clave, fila[0]) if fila else None
+            if img is not None:
+                self.estadisticas["disco"] += 1
+            elif self.derivar:
+                # La menor rendición de la misma foto que no se quede corta
+                for *origen, archivo in conexion.execute(
+                        "SELECT sha256, mtime_ns, ancho, alto, interpolacion, archivo FROM rendiciones "
+                        "WHERE sha256 = ? AND mtime_ns = ? AND ancho >= ? AND alto >= ? "
+                        "ORDER BY ancho * alto LIMIT 1", (*clave[:2], ancho, alto)).fetchall():
+                    mayor = self._leer(conexion, tuple(origen), archivo)
+                    if mayor is not None:
+                        import cv2  # Solo hace falta para derivar (el collage no lo necesita por defecto)
+                        img = cv2.resize(mayor, (ancho, alto), interpolation=cv2.INTER_AREA)
+                        self._guardar(conexion, clave, img)
+                        self.estadisticas["derivadas"] += 1
+        if img is None:
+            # La decodificación se hace fuera del lock para que varios hilos
+            # puedan decodificar a la vez
+            img = generar()
+            with self._lock:
+                self._guardar(self._abrir(), clave, img)
+                self.estadisticas["generadas"] += 1
+        return self._recordar(clave, img)
+
+    def resumen(self):
+        e = self.estadisticas
+        return (f"{e['memoria'] + e['disco']} aciertos ({e['memoria']} en memoria), {e['derivadas']} derivadas "
+                f"de una versión mayor, {e['generadas']} decodificadas, {e['expulsadas']} expulsadas")
+
+    def cerrar(self):
+        if self._conexion is not None and self._pid == os.getpid():
+            self._conexion.close()
+        self._conexion = None
+
+def orientar(img, orientacion):
+    # Aplica a un array la orientación EXIF (1-8) igual que cv2.imread
+    import cv2
+    if orientacion == 2:
+        return cv2.flip(img, 1)
+    if orientacion == 3:
+        return cv2.rotate(img, cv2.ROTATE_180)
+    if orientacion == 4:
+        return cv2.flip(img, 0)
+    if orientacion == 5:
+        return cv2.transpose(img)
+    if orientacion == 6:
+        return cv2.rotate(img, cv2.ROTATE_90_CLOCKWISE)
+    if orientacion == 7:
+        return cv2.rotate(cv2.transpose(img), cv2.ROTATE_180)
+    if orientacion == 8:
+        return cv2.rotate(img, cv2.ROTATE_90_COUNTERCLOCKWISE)
+    return img
+
+def agregar_opciones_cache(parser):
+    grupo = parser.add_argument_group("caché de fotos decodificadas")
+    grupo.add_argument("--cache-imagenes", nargs="?", const="", default=None, metavar="CARPETA",
+                       help="Reutilizar las fotos ya decodificadas y reducidas en ejecuciones anteriores "
+                            "(por defecto en .cache_imagenes dentro de la carpeta de salida)")
+    grupo.add_argument("--cache-max-mb", type=float, default=MAX_MB_CACHE,
+                       help=f"Tamaño máximo de la caché en disco (por defecto: {MAX_MB_CACHE} MB)")
+    return grupo
+
+def cache_desde_args(args, carpeta_salida=None):
+    # Sin carpeta explícita, la caché va en la carpeta de salida de la herramienta
+    if args.cache_imagenes is None:
+        return None
+    carpeta = args.cache_imagenes
+    if not carpeta:
+        carpeta = os.path.join(carpeta_salida, ".cache_imagenes") if carpeta_salida else CARPETA_CACHE
+    return CacheImagenes(carpeta, args.cache_max_mb)
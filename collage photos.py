@@ -1,26 +1,20 @@
 import os
-import pandas as pd
+import csv
+import sys
+import time
+import argparse
+import numpy as np
 from PIL import Image, ImageDraw, ImageFont
 import glob
-
-# Rutas
-base_dir = "."
-fotos_dir = os.path.join(base_dir, "Fotos")
-output_dir = os.path.join(base_dir, "Output")
-csv_path = os.path.join(base_dir, "Lista alumnos.csv")
-log_path = os.path.join(output_dir, "log_procesado.csv")
-
-# Verificación de archivos y directorios
-print("🔍 Verificando archivos y directorios...")
-print(f"Directorio actual: {os.getcwd()}")
-print(f"¿Existe directorio Fotos?: {os.path.exists(fotos_dir)}")
-print(f"¿Existe archivo CSV?: {os.path.exists(csv_path)}")
-print(f"Contenido del directorio actual: {os.listdir('.')}")
-
-os.makedirs(output_dir, exist_ok=True)
-
-print(f"📁 Directorio de fotos: {fotos_dir}")
-print(f"📁 Directorio de salida: {output_dir}")
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from functools import lru_cache
+from cache_imagenes import agregar_opciones_cache, cache_desde_args
+from escritura import (AjustesEscritura, EscritorAsincrono, agregar_opciones_escritura, ajustes_desde_args,
+                       describir_escritura, guardar_imagen)
+from perfilado import Cronometro, Perfilador, agregar_opcion_perfil, resumen_perfil
+from reparto import (agregar_opciones_reparto, archivos_de_shards, limpiar_reclamos, reclamos_sin_terminar,
+                     reparto_desde_args)
 
 # Dimensiones y márgenes
 ANCHO_FINAL = 1920
@@ -28,98 +22,218 @@ ALTO_FINAL = 1080
 MARGEN_INFERIOR = 0
 MARGEN_LATERAL_TEXTO = 100
 
-# Fuente para el texto (aún más grande)
-try:
-    fuente = ImageFont.truetype("arial.ttf", 110)
-except:
-    fuente = ImageFont.load_default()
-
-# Leer CSV
-print(f"📄 Leyendo archivo CSV: {csv_path}")
-df = pd.read_csv(csv_path, sep=';')
-log = []
-
-# Procesar cada alumno
-print("\n🔄 Procesando alumnos...")
-for _, fila in df.iterrows():
-    nombre = str(fila['Nombre']).strip()
-    apellido1 = str(fila['Apellido 1']).strip()
-    apellido2 = str(fila['Apellido 2']) if 'Apellido 2' in fila and pd.notna(fila['Apellido 2']) else ''
-    apellido2 = apellido2.strip() if apellido2 else ''
-    identificador = str(fila['N']).strip()
-    if apellido2:
-        nombre_completo = f"{nombre} {apellido1} {apellido2}"
-    else:
-        nombre_completo = f"{nombre} {apellido1}"
-    
-    print(f"\n👤 Procesando: {nombre_completo} (ID: {identificador})")
-
-    # Buscar imágenes (cualquier combinación de extensiones)
-    ruta_bf = ruta_af = None
-    extensiones = ["jpg", "jpeg", "png"]
-    for ext_bf in extensiones:
-        bf = os.path.join(fotos_dir, f"{identificador}_bf.{ext_bf}")
-        if os.path.exists(bf):
-            ruta_bf = bf
-            break
-    for ext_af in extensiones:
-        af = os.path.join(fotos_dir, f"{identificador}_af.{ext_af}")
-        if os.path.exists(af):
-            ruta_af = af
-            break
-
-    if ruta_bf and ruta_af:
-        print(f"📸 Imágenes encontradas:")
-        print(f"   - Antes: {ruta_bf}")
-        print(f"   - Después: {ruta_af}")
-    else:
-        print(f"❌ No se encontraron las imágenes para {nombre_completo}")
-        log.append({"N": identificador, "Nombre completo": nombre_completo, "Estado": "❌ Imágenes no encontradas"})
-        continue
+# Fuentes para el texto, en orden de preferencia. Se puede indicar otra con la
+# variable de entorno COLLAGE_FUENTE
+POSIBLES_FUENTES = [
+    "/Library/Fonts/Arial.ttf",
+    "/System/Library/Fonts/Supplemental/Arial.ttf",
+    "/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf",
+    "/usr/share/fonts/liberation-sans/LiberationSans-Regular.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/dejavu/DejaVuSans.ttf",
+    "C:\\Windows\\Fonts\\arial.ttf",
+]
+TAMANOS_FUENTE = list(range(100, 10, -2))  # De mayor a menor: 100, 98, ..., 12
+
+def buscar_fuente(candidatas):
+    # Primera fuente TrueType que se puede cargar, o None
+    for ruta in candidatas:
+        try:
+            cargar_fuente(ruta, TAMANOS_FUENTE[0])
+            return ruta
+        except OSError:
+            continue
+    return None
+
+@lru_cache(maxsize=64)
+def cargar_fuente(ruta, tamano):
+    # Cada tamaño de cada fuente se lee del disco una sola vez
+    return ImageFont.truetype(ruta, tamano)
+
+def ajustar_fuente(draw, texto, ruta, ancho_maximo):
+    # Búsqueda binaria del mayor tamaño de TAMANOS_FUENTE con el que el texto
+    # cabe en ancho_maximo. Si no cabe con ninguno se usa el más pequeño.
+    # Devuelve (fuente, bbox)
+    if ruta is None:
+        fuente = ImageFont.load_default()
+        return fuente, draw.textbbox((0, 0), texto, font=fuente)
+    bajo, alto = 0, len(TAMANOS_FUENTE) - 1
+    mejor = None
+    while bajo <= alto:
+        medio = (bajo + alto) // 2
+        fuente = cargar_fuente(ruta, TAMANOS_FUENTE[medio])
+        bbox = draw.textbbox((0, 0), texto, font=fuente)
+        if bbox[2] - bbox[0] <= ancho_maximo:
+            mejor = (fuente, bbox)
+            alto = medio - 1
+        else:
+            bajo = medio + 1
+    if mejor is None:
+        fuente = cargar_fuente(ruta, TAMANOS_FUENTE[-1])
+        mejor = (fuente, draw.textbbox((0, 0), texto, font=fuente))
+    return mejor
 
+# Índice de fotos: una sola pasada por la carpeta en lugar de comprobar la
+# existencia de cada combinación de nombre y extensión para cada alumno
+EXTENSIONES_FOTO = ["jpg", "jpeg", "png"]  # En orden de preferencia
+
+def indexar_fotos(carpeta):
+    # Devuelve {identificador: {"bf": ruta, "af": ruta}} a partir de los archivos
+    # {N}_bf.{ext} y {N}_af.{ext}; la extensión no distingue mayúsculas
+    indice = {}
+    rangos = {}
+    if not os.path.isdir(carpeta):
+        return indice
+    with os.scandir(carpeta) as entradas:
+        for entrada in entradas:
+            base, ext = os.path.splitext(entrada.name)
+            ext = ext[1:].lower()
+            identificador, separador, tipo = base.rpartition("_")
+            if ext not in EXTENSIONES_FOTO or not separador or tipo not in ("bf", "af"):
+                continue
+            if not entrada.is_file():
+                continue
+            rango = EXTENSIONES_FOTO.index(ext)
+            if rango < rangos.get((identificador, tipo), len(EXTENSIONES_FOTO)):
+                indice.setdefault(identificador, {})[tipo] = entrada.path
+                rangos[(identificador, tipo)] = rango
+    return indice
+
+def fotos_huerfanas(indice, identificadores):
+    # Fotos cuyo identificador no aparece en ninguna fila del CSV
+    return sorted(ruta for identificador, fotos in indice.items()
+                  if identificador not in identificadores for ruta in fotos.values())
+
+# Corregir orientación usando EXIF si es necesario
+def orientacion_exif(im):
     try:
-        # Cargar y escalar imágenes
-        print("🖼️ Cargando y escalando imágenes...")
-        img_bf = Image.open(ruta_bf)
-        img_af = Image.open(ruta_af)
-
-        # Corregir orientación usando EXIF si es necesario
-        def corregir_orientacion(im):
-            try:
-                exif = im._getexif()
-                if exif is not None:
-                    orientation = exif.get(274)
-                    if orientation == 3:
-                        im = im.rotate(180, expand=True)
-                    elif orientation == 6:
-                        im = im.rotate(270, expand=True)
-                    elif orientation == 8:
-                        im = im.rotate(90, expand=True)
-            except Exception:
-                pass
-            return im
-
-        img_bf = corregir_orientacion(img_bf)
-        img_af = corregir_orientacion(img_af)
-
-        ANCHO_IMAGEN = ANCHO_FINAL // 2
-        ALTO_IMAGEN = ALTO_FINAL  # Ahora es 1080 px exactos
-
-        # Escalar para que el alto llene el canvas, sin recortar nada
-        def escalar_sin_recorte(im):
-            escala = ALTO_IMAGEN / im.height
-            nuevo_ancho = int(im.width * escala)
-            nuevo_alto = ALTO_IMAGEN
-            im_redim = im.resize((nuevo_ancho, nuevo_alto), Image.Resampling.LANCZOS)
-            # Si el ancho es menor que la mitad, centrar en fondo blanco
-            fondo_temp = Image.new("RGB", (ANCHO_IMAGEN, ALTO_IMAGEN), "white")
-            x_offset = (ANCHO_IMAGEN - nuevo_ancho) // 2
-            fondo_temp.paste(im_redim, (x_offset, 0))
-            return fondo_temp
-
-        img_bf = escalar_sin_recorte(img_bf)
-        img_af = escalar_sin_recorte(img_af)
+        exif = im._getexif()
+        if exif is not None:
+            return exif.get(274)
+    except Exception:
+        pass
+    return None
+
+ROTACIONES_EXIF = {
+    3: Image.Transpose.ROTATE_180,
+    6: Image.Transpose.ROTATE_270,
+    8: Image.Transpose.ROTATE_90,
+}
+
+def corregir_orientacion(im):
+    orientation = orientacion_exif(im)
+    if orientation == 3:
+        im = im.rotate(180, expand=True)
+    elif orientation == 6:
+        im = im.rotate(270, expand=True)
+    elif orientation == 8:
+        im = im.rotate(90, expand=True)
+    return im
+
+ANCHO_IMAGEN = ANCHO_FINAL // 2
+ALTO_IMAGEN = ALTO_FINAL  # Ahora es 1080 px exactos
+
+# Escalar para que el alto llene el canvas, sin recortar nada
+def escalar_sin_recorte(im):
+    escala = ALTO_IMAGEN / im.height
+    nuevo_ancho = int(im.width * escala)
+    nuevo_alto = ALTO_IMAGEN
+    im_redim = im.resize((nuevo_ancho, nuevo_alto), Image.Resampling.LANCZOS)
+    return centrar_en_mitad(im_redim)
+
+def centrar_en_mitad(im_redim):
+    # Si el ancho es menor que la mitad, centrar en fondo blanco
+    fondo_temp = Image.new("RGB", (ANCHO_IMAGEN, ALTO_IMAGEN), "white")
+    x_offset = (ANCHO_IMAGEN - im_redim.width) // 2
+    fondo_temp.paste(im_redim, (x_offset, 0))
+    return fondo_temp
 
+# Métodos de escalado: "lanczos" decodifica la foto entera, la gira y la reduce
+# con LANCZOS (el resultado de referencia); "draft" decodifica los JPEG
+# directamente a 1/2, 1/4 o 1/8 del tamaño, reduce con LANCZOS y gira ya
+# reducida; "opencv" es como "draft" pero reduce con cv2.INTER_AREA
+METODOS_ESCALADO = ["lanczos", "draft", "opencv"]
+
+def reducir(im, tamano, metodo):
+    # El JPEG se decodifica a la menor escala potencia de dos que no quede por debajo del destino
+    im.draft("RGB", tamano)
+    if metodo == "opencv":
+        import cv2  # Solo hace falta para este método
+        arr = cv2.resize(np.asarray(im.convert("RGB")), tamano, interpolation=cv2.INTER_AREA)
+        return Image.fromarray(arr)
+    return im.resize(tamano, Image.Resampling.LANCZOS)
+
+# Interpolación con la que cada método guarda sus fotos reducidas en la caché
+# compartida (la misma etiqueta que usa animacion.py para draft + INTER_AREA)
+INTERPOLACION_CACHE = {"draft": "lanczos", "opencv": "area"}
+
+def cargar_escalada(ruta, metodo="lanczos", cache=None):
+    # Abre una foto y devuelve su mitad del collage (ANCHO_IMAGEN x ALTO_IMAGEN).
+    # Con una caché (cache_imagenes.CacheImagenes), los métodos draft y opencv
+    # reutilizan la foto ya reducida; lanczos, el de referencia, siempre
+    # decodifica el original
+    im = Image.open(ruta)
+    if metodo == "lanczos":
+        return escalar_sin_recorte(corregir_orientacion(im))
+
+    orientacion = orientacion_exif(im)
+    girada = orientacion in (6, 8)
+    ancho, alto = (im.height, im.width) if girada else im.size
+    nuevo_ancho = int(ancho * (ALTO_IMAGEN / alto))
+    # Tamaño de destino antes de girar
+    tamano = (ALTO_IMAGEN, nuevo_ancho) if girada else (nuevo_ancho, ALTO_IMAGEN)
+    if cache is None:
+        im_redim = reducir(im, tamano, metodo)
+    else:
+        # La caché guarda arrays BGR sin girar
+        im.close()
+        bgr = cache.obtener(ruta, tamano, INTERPOLACION_CACHE[metodo],
+                            lambda: np.asarray(reducir(Image.open(ruta), tamano, metodo).convert("RGB"))[:, :, ::-1])
+        im_redim = Image.fromarray(np.ascontiguousarray(bgr[:, :, ::-1]))
+    if orientacion in ROTACIONES_EXIF:
+        im_redim = im_redim.transpose(ROTACIONES_EXIF[orientacion])
+    return centrar_en_mitad(im_redim)
+
+def psnr(mse):
+    return float(10 * np.log10(255 ** 2 / mse)) if mse else float("inf")
+
+def comparar_escalado(rutas, metodos):
+    # Compara cada método con "lanczos" sobre las fotos dadas. Devuelve, por
+    # método, el PSNR con el error medio de todas las fotos y el de la peor foto, la diferencia máxima por píxel y el
+    # tiempo medio por foto (incluido "lanczos")
+    tiempos = {metodo: 0.0 for metodo in ["lanczos"] + metodos}
+    mses = {metodo: [] for metodo in metodos}
+    max_dif = {metodo: 0 for metodo in metodos}
+    for ruta in rutas:
+        inicio = time.perf_counter()
+        referencia = np.asarray(cargar_escalada(ruta, "lanczos"), dtype=np.float64)
+        tiempos["lanczos"] += time.perf_counter() - inicio
+        for metodo in metodos:
+            inicio = time.perf_counter()
+            rapida = np.asarray(cargar_escalada(ruta, metodo), dtype=np.float64)
+            tiempos[metodo] += time.perf_counter() - inicio
+            mses[metodo].append(np.mean((referencia - rapida) ** 2))
+            max_dif[metodo] = max(max_dif[metodo], int(np.abs(referencia - rapida).max()))
+    resultado = {"lanczos": {"tiempo_medio": tiempos["lanczos"] / max(1, len(rutas))}}
+    for metodo in metodos:
+        resultado[metodo] = {
+            "psnr_medio": psnr(np.mean(mses[metodo])) if mses[metodo] else None,
+            "psnr_minimo": psnr(max(mses[metodo])) if mses[metodo] else None,
+            "max_dif": max_dif[metodo],
+            "tiempo_medio": tiempos[metodo] / max(1, len(rutas)),
+        }
+    return resultado
+
+def crear_collage(nombre_completo, ruta_bf, ruta_af, font_path, escalado="lanczos", cache=None, crono=None):
+    # crono (perfilado.Cronometro) recoge el tiempo de cada etapa
+    crono = crono or Cronometro()
+
+    # Cargar y escalar imágenes (con la orientación EXIF corregida)
+    with crono.etapa("carga_y_escalado"):
+        img_bf = cargar_escalada(ruta_bf, escalado, cache)
+        img_af = cargar_escalada(ruta_af, escalado, cache)
+
+    with crono.etapa("composicion"):
         # Crear fondo blanco
         fondo = Image.new("RGB", (ANCHO_FINAL, ALTO_FINAL), "white")
         draw = ImageDraw.Draw(fondo, "RGBA")
@@ -128,74 +242,402 @@ for _, fila in df.iterrows():
         fondo.paste(img_bf, (0, 0))
         fondo.paste(img_af, (ANCHO_FINAL // 2, 0))
 
-        # --- Buscar fuente Arial como única opción ---
-        posibles_fuentes = [
-            "/Library/Fonts/Arial.ttf",
-            "/System/Library/Fonts/Supplemental/Arial.ttf",
-        ]
-        font_path = None
-        for fuente in posibles_fuentes:
-            try:
-                ImageFont.truetype(fuente, 40)
-                font_path = fuente
-                break
-            except:
-                continue
-        if font_path:
-            print(f"✅ Fuente utilizada: {font_path}")
-        else:
-            print("⚠️ No se encontró Arial. Se usará la fuente por defecto.")
-
-        # --- Añadir cuadro de texto con nombre y apellidos ---
-        texto = nombre_completo
-        font_size = 100  # Tamaño inicial más pequeño
-        fuente_temp = None
-        aviso_fuente = False
-        while font_size > 10:
-            try:
-                if font_path:
-                    fuente_temp = ImageFont.truetype(font_path, font_size)
-                else:
-                    raise Exception("No font path")
-            except:
-                fuente_temp = ImageFont.load_default()
-                aviso_fuente = True
-            bbox = draw.textbbox((0, 0), texto, font=fuente_temp)
-            ancho_texto = bbox[2] - bbox[0]
-            if ancho_texto <= ANCHO_FINAL - 100:  # Solo 50px de margen a cada lado
-                break
-            font_size -= 2
-        fuente_final = fuente_temp
-        if aviso_fuente:
-            print("⚠️ No se pudo cargar una fuente TrueType, usando fuente por defecto. El texto puede verse pequeño.")
-        alto_texto = bbox[3] - bbox[1]
-        x_texto = (ANCHO_FINAL - ancho_texto) // 2
-        padding = 40
-        margen_inferior_extra = 30
-        # Calcular la altura total del cuadro
-        altura_cuadro = alto_texto + padding + margen_inferior_extra
-        y_texto = ALTO_FINAL - altura_cuadro  # Subir el cuadro para que no se salga
-        box_coords = [
-            x_texto - padding,
-            y_texto - padding // 2,
-            x_texto + ancho_texto + padding,
-            y_texto + alto_texto + padding // 2 + margen_inferior_extra
-        ]
-        radio = 30
-        grosor_borde = 6
-        draw.rounded_rectangle(box_coords, radius=radio, fill=(255, 255, 255, 255), outline=(0, 102, 255), width=grosor_borde)
-        draw.text((x_texto, y_texto), texto, fill="black", font=fuente_final)
-
-        # Guardar imagen
-        salida_path = os.path.join(output_dir, f"{identificador}_final.jpg")
-        fondo.save(salida_path)
-        print(f"✅ Collage guardado en: {salida_path}")
-        log.append({"N": identificador, "Nombre completo": nombre_completo, "Estado": "✅ Procesado"})
+    with crono.etapa("texto"):
+        dibujar_nombre(draw, nombre_completo, font_path)
+
+    return fondo
+
+def dibujar_nombre(draw, nombre_completo, font_path):
+    # --- Añadir cuadro de texto con nombre y apellidos ---
+    texto = nombre_completo
+    fuente_final, bbox = ajustar_fuente(draw, texto, font_path, ANCHO_FINAL - 100)  # Solo 50px de margen a cada lado
+    ancho_texto = bbox[2] - bbox[0]
+    alto_texto = bbox[3] - bbox[1]
+    x_texto = (ANCHO_FINAL - ancho_texto) // 2
+    padding = 40
+    margen_inferior_extra = 30
+    # Calcular la altura total del cuadro
+    altura_cuadro = alto_texto + padding + margen_inferior_extra
+    y_texto = ALTO_FINAL - altura_cuadro  # Subir el cuadro para que no se salga
+    box_coords = [
+        x_texto - padding,
+        y_texto - padding // 2,
+        x_texto + ancho_texto + padding,
+        y_texto + alto_texto + padding // 2 + margen_inferior_extra
+    ]
+    radio = 30
+    grosor_borde = 6
+    draw.rounded_rectangle(box_coords, radius=radio, fill=(255, 255, 255, 255), outline=(0, 102, 255), width=grosor_borde)
+    draw.text((x_texto, y_texto), texto, fill="black", font=fuente_final)
+
+def ruta_collage(output_dir, identificador, ajustes=None):
+    return (ajustes or AjustesEscritura()).ruta(os.path.join(output_dir, f"{identificador}_final.jpg"))
 
+def procesar_alumno(identificador, nombre_completo, ruta_bf, ruta_af, output_dir, font_path, escalado="lanczos",
+                    ajustes=None, cache=None, escritor=None):
+    # Genera el collage de un alumno. Los mensajes se devuelven en lugar de
+    # imprimirse para que, en paralelo, la salida no se mezcle entre alumnos.
+    # Con un escritor el collage se guarda en segundo plano y se devuelve el
+    # Future; sin él se guarda aquí mismo. Devuelve (fila del log, mensajes,
+    # escritura, tiempos por etapa), que terminar_alumno completa
+    mensajes = [f"\n👤 Procesando: {nombre_completo} (ID: {identificador})"]
+    log = {"N": identificador, "Nombre completo": nombre_completo}
+    crono = Cronometro()
+    if not (ruta_bf and ruta_af):
+        mensajes.append(f"❌ No se encontraron las imágenes para {nombre_completo}")
+        log["Estado"] = "❌ Imágenes no encontradas"
+        return log, mensajes, None, crono.etapas
+    mensajes += [
+        f"📸 Imágenes encontradas:",
+        f"   - Antes: {ruta_bf}",
+        f"   - Después: {ruta_af}",
+        "🖼️ Cargando y escalando imágenes...",
+    ]
+    try:
+        salida_path = ruta_collage(output_dir, identificador, ajustes)
+        fondo = crear_collage(nombre_completo, ruta_bf, ruta_af, font_path, escalado, cache, crono)
+        if escritor is not None:
+            return log, mensajes, escritor.guardar(fondo, salida_path), crono.etapas
+        with crono.etapa("escritura"):
+            escritura = guardar_imagen(fondo, salida_path, ajustes)
+        return log, mensajes, escritura, crono.etapas
     except Exception as e:
-        print(f"❌ Error procesando {nombre_completo}: {str(e)}")
-        log.append({"N": identificador, "Nombre completo": nombre_completo, "Estado": f"❌ Error: {e}"})
+        mensajes.append(f"❌ Error procesando {nombre_completo}: {str(e)}")
+        log["Estado"] = f"❌ Error: {e}"
+        return log, mensajes, None, crono.etapas
+
+def terminar_alumno(resultado):
+    # Espera a que se guarde el collage (si se estaba guardando en segundo
+    # plano) y devuelve (fila del log, mensajes, tiempos por etapa) con el
+    # estado final
+    log, mensajes, escritura, etapas = resultado
+    if escritura is None:
+        return log, mensajes, etapas
+    try:
+        if isinstance(escritura, Future):
+            escritura = escritura.result()
+            # Se guardó en otro hilo: solo se conoce su tiempo real
+            Cronometro(etapas).sumar("escritura", escritura["segundos"], 0.0)
+        mensajes.append(f"✅ Collage guardado en: {escritura['ruta']} ({describir_escritura(escritura)})")
+        log["Estado"] = "✅ Procesado"
+    except Exception as e:
+        mensajes.append(f"❌ Error procesando {log['Nombre completo']}: {str(e)}")
+        log["Estado"] = f"❌ Error: {e}"
+    return log, mensajes, etapas
+
+TAMANO_BLOQUE_CSV = 1000  # Filas del CSV que se leen de cada vez
+NOMBRE_LOG = "log_procesado.csv"
+CAMPOS_LOG = ["N", "Nombre completo", "Estado"]
+
+def iterar_alumnos(csv_path, tamano_bloque=TAMANO_BLOQUE_CSV):
+    # Recorre el CSV por bloques y va devolviendo (identificador, nombre completo)
+    # de cada fila, sin cargar la lista entera en memoria
+    import pandas as pd  # Se importa aquí porque tarda en cargar y solo hace falta para el CSV
+    for bloque in pd.read_csv(csv_path, sep=';', chunksize=tamano_bloque):
+        identificadores = bloque['N'].astype(str).str.strip()
+        nombres = bloque['Nombre'].astype(str).str.strip() + " " + bloque['Apellido 1'].astype(str).str.strip()
+        if 'Apellido 2' in bloque:
+            apellido2 = bloque['Apellido 2'].fillna('').astype(str).str.strip()
+            nombres = nombres.where(apellido2 == '', nombres + " " + apellido2)
+        yield from zip(identificadores, nombres)
+
+def leer_log(log_path):
+    # Filas de un log anterior, o ninguna si no existe
+    if not os.path.exists(log_path):
+        return []
+    with open(log_path, newline="", encoding="utf-8") as f:
+        return list(csv.DictReader(f))
+
+def abrir_log(log_path, filas_previas=()):
+    # Empieza el log con las filas previas que se conservan y lo deja abierto
+    # para ir añadiendo una fila por collage. La cabecera y las filas previas
+    # se escriben en un temporal que sustituye al log de una vez
+    with open(log_path + ".tmp", "w", newline="", encoding="utf-8") as f:
+        escritor = csv.DictWriter(f, fieldnames=CAMPOS_LOG, lineterminator=os.linesep)
+        escritor.writeheader()
+        escritor.writerows(filas_previas)
+    os.replace(log_path + ".tmp", log_path)
+    return open(log_path, "a", newline="", encoding="utf-8")
+
+def ordenar_filas(filas, csv_path):
+    # Filas del log (diccionario N -> fila) en el orden del CSV; las de alumnos
+    # que ya no están en el CSV, al final
+    ordenadas = [filas.pop(identificador) for identificador, _ in iterar_alumnos(csv_path) if identificador in filas]
+    return ordenadas + list(filas.values())
+
+def ordenar_log(log_path, csv_path):
+    # Reescribe el log en el orden del CSV (al reanudar, las filas previas
+    # quedan delante de las nuevas)
+    filas = {fila["N"]: fila for fila in leer_log(log_path)}
+    abrir_log(log_path, ordenar_filas(filas, csv_path)).close()
+
+def fusionar_logs(output_dir, csv_path, nombre_log=NOMBRE_LOG):
+    # Combina el log normal con los que dejó cada shard en uno solo, en el
+    # orden del CSV (si un alumno aparece en varios, manda el último shard), y
+    # borra los de cada shard y los reclamos. Devuelve las filas combinadas y
+    # los alumnos reclamados que ningún nodo terminó, o None si no había logs
+    # de shards
+    rutas = archivos_de_shards(output_dir, nombre_log)
+    if not rutas:
+        return None
+    sin_terminar = reclamos_sin_terminar(output_dir, "collage")
+    log_path = os.path.join(output_dir, nombre_log)
+    filas = {}
+    for ruta in [log_path] + rutas:
+        for fila in leer_log(ruta):
+            filas[fila["N"]] = fila
+    combinadas = ordenar_filas(filas, csv_path)
+    abrir_log(log_path, combinadas).close()
+    for ruta in rutas:
+        os.remove(ruta)
+    limpiar_reclamos(output_dir, "collage")
+    return combinadas, sin_terminar
+
+# Caché de fotos de cada proceso del pool. Se le pasa una sola vez al crearlo
+# (ver _iniciar_worker), no con cada alumno: así cada proceso mantiene su
+# conexión a SQLite y su nivel en memoria entre collages
+CACHE_WORKER = None
+
+def _iniciar_worker(cache):
+    global CACHE_WORKER
+    CACHE_WORKER = cache
+
+def _procesar_alumno_worker(*tarea):
+    return procesar_alumno(*tarea, cache=CACHE_WORKER)
+
+def generar_collages(alumnos, indice_fotos, output_dir, font_path, registrar, workers=1, escalado="lanczos",
+                     ajustes=None, hilos_escritura=2, cache=None, perfil=None):
+    # Genera los collages repartiendo los alumnos entre `workers` procesos y
+    # llama a registrar(fila) con la fila del log de cada uno. Los resultados se
+    # recogen en el orden del CSV aunque terminen desordenados, así que el log
+    # y los mensajes salen igual que en serie. `alumnos` se consume poco a poco.
+    # En serie, los collages se codifican y guardan en `hilos_escritura` hilos
+    # mientras se compone el siguiente; con varios procesos cada uno guarda
+    # los suyos. Los tiempos por etapa de cada alumno se registran en `perfil`
+    # (perfilado.Perfilador) si se pasa
+    perfil = perfil or Perfilador("collage")
+    tareas = (
+        (identificador, nombre_completo, indice_fotos.get(identificador, {}).get("bf"),
+         indice_fotos.get(identificador, {}).get("af"), output_dir, font_path, escalado, ajustes)
+        for identificador, nombre_completo in alumnos
+    )
+
+    def recoger(resultado):
+        fila, mensajes, etapas = terminar_alumno(resultado)
+        for mensaje in mensajes:
+            print(mensaje)
+        registrar(fila)
+        perfil.registrar_item(fila["N"], etapas)
+
+    if workers == 1 and hilos_escritura < 1:
+        for tarea in tareas:
+            recoger(procesar_alumno(*tarea, cache=cache))
+        return
+
+    if workers == 1:
+        with EscritorAsincrono(ajustes, hilos_escritura) as escritor:
+            pendientes = deque()
+            for tarea in tareas:
+                pendientes.append(procesar_alumno(*tarea, cache=cache, escritor=escritor))
+                while pendientes and (len(pendientes) > hilos_escritura
+                                      or not isinstance(pendientes[0][2], Future) or pendientes[0][2].done()):
+                    recoger(pendientes.popleft())
+            while pendientes:
+                recoger(pendientes.popleft())
+        return
+
+    terminados = {}  # Resultados que esperan a que acaben los alumnos anteriores
+    siguiente = [0]
+
+    def volcar():
+        while siguiente[0] in terminados:
+            recoger(terminados.pop(siguiente[0]))
+            siguiente[0] += 1
+
+    max_en_curso = 2 * workers  # Incluye los terminados que aún no se han volcado
+    with ProcessPoolExecutor(max_workers=workers, initializer=_iniciar_worker, initargs=(cache,)) as pool:
+        en_curso = {}
+        for posicion, tarea in enumerate(tareas):
+            if len(en_curso) + len(terminados) >= max_en_curso:
+                listos, _ = wait(en_curso, return_when=FIRST_COMPLETED)
+                for futuro in listos:
+                    terminados[en_curso.pop(futuro)] = futuro.result()
+                volcar()
+            en_curso[pool.submit(_procesar_alumno_worker, *tarea)] = posicion
+        for futuro in wait(en_curso).done:
+            terminados[en_curso[futuro]] = futuro.result()
+        volcar()
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Crea un collage de antes y después para cada alumno de 'Lista alumnos.csv'.")
+    parser.add_argument("--dir", default=".",
+                        help="Carpeta con 'Fotos' y 'Lista alumnos.csv'; la salida va a 'Output' (por defecto: .)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Procesos en paralelo (por defecto: núcleos disponibles)")
+    parser.add_argument("--escalado", choices=METODOS_ESCALADO, default="lanczos",
+                        help="Método de escalado de las fotos: lanczos (referencia), draft (decodificación "
+                             "reducida de JPEG) u opencv (draft + INTER_AREA) (por defecto: lanczos)")
+    parser.add_argument("--comparar-escalado", type=int, metavar="N", default=None,
+                        help="No genera collages: compara draft y opencv con lanczos en N fotos y muestra "
+                             "PSNR, diferencia máxima y tiempos")
+    parser.add_argument("--reanudar", action="store_true",
+                        help="Saltar los alumnos que el log ya da como procesados y cuyo collage sigue en Output")
+    agregar_opciones_escritura(parser)
+    agregar_opciones_cache(parser)
+    agregar_opcion_perfil(parser)
+    agregar_opciones_reparto(parser)
+    args = parser.parse_args()
+
+    # Rutas
+    base_dir = args.dir
+    fotos_dir = os.path.join(base_dir, "Fotos")
+    output_dir = os.path.join(base_dir, "Output")
+    csv_path = os.path.join(base_dir, "Lista alumnos.csv")
+    try:
+        ajustes = ajustes_desde_args(args)
+        reparto = reparto_desde_args(args, output_dir, "collage")
+    except ValueError as e:
+        parser.error(str(e))
+    # Con --shard, cada nodo escribe su propio log hasta que se fusionan
+    log_path = os.path.join(output_dir, reparto.nombre_archivo(NOMBRE_LOG) if reparto else NOMBRE_LOG)
+    workers = max(1, args.workers or os.cpu_count() or 1)
+    cache = cache_desde_args(args, output_dir)
+
+    if args.fusionar:
+        fusion = fusionar_logs(output_dir, csv_path)
+        if fusion is None:
+            print(f"❌ No hay logs de shards que fusionar en '{output_dir}'.")
+            sys.exit(1)
+        filas, sin_terminar = fusion
+        print(f"🔗 Logs fusionados en: {os.path.join(output_dir, NOMBRE_LOG)}")
+        print(f"   - Alumnos: {len(filas)}")
+        for estado, cuantos in Counter(fila["Estado"] for fila in filas).most_common():
+            print(f"   - {estado}: {cuantos}")
+        if sin_terminar:
+            print(f"\n⚠️ {len(sin_terminar)} alumnos reclamados que ningún nodo terminó "
+                  f"(vuelve a lanzar el lote con --reanudar para procesarlos): {', '.join(sin_terminar)}")
+        return
+
+    # Verificación de archivos y directorios
+    print("🔍 Verificando archivos y directorios...")
+    print(f"Directorio actual: {os.getcwd()}")
+    print(f"¿Existe directorio Fotos?: {os.path.exists(fotos_dir)}")
+    print(f"¿Existe archivo CSV?: {os.path.exists(csv_path)}")
+    print(f"Contenido del directorio actual: {os.listdir('.')}")
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    print(f"📁 Directorio de fotos: {fotos_dir}")
+    print(f"📁 Directorio de salida: {output_dir}")
+
+    print("🔤 Buscando fuente...")
+    candidatas = POSIBLES_FUENTES
+    if os.environ.get("COLLAGE_FUENTE"):
+        candidatas = [os.environ["COLLAGE_FUENTE"]] + candidatas
+    font_path = buscar_fuente(candidatas)
+    if font_path:
+        print(f"✅ Fuente utilizada: {font_path}")
+    else:
+        print("⚠️ No se encontró Arial. Se usará la fuente por defecto.")
+        print("⚠️ No se pudo cargar una fuente TrueType, usando fuente por defecto. El texto puede verse pequeño.")
+
+    print("🗂️ Indexando fotos...")
+    indice_fotos = indexar_fotos(fotos_dir)
+    print(f"   - Alumnos con fotos: {len(indice_fotos)}")
+
+    if args.comparar_escalado is not None:
+        rutas = sorted(ruta for fotos in indice_fotos.values() for ruta in fotos.values())[:args.comparar_escalado]
+        print(f"\n📏 Comparando métodos de escalado con lanczos en {len(rutas)} fotos...")
+        comparacion = comparar_escalado(rutas, [m for m in METODOS_ESCALADO if m != "lanczos"])
+        print(f"   - lanczos: {comparacion['lanczos']['tiempo_medio'] * 1000:.0f} ms/foto")
+        for metodo, datos in comparacion.items():
+            if metodo == "lanczos" or datos["psnr_medio"] is None:
+                continue
+            aceleracion = comparacion["lanczos"]["tiempo_medio"] / datos["tiempo_medio"]
+            print(f"   - {metodo}: {datos['tiempo_medio'] * 1000:.0f} ms/foto ({aceleracion:.1f}x), "
+                  f"PSNR medio {datos['psnr_medio']:.1f} dB (mínimo {datos['psnr_minimo']:.1f} dB), "
+                  f"diferencia máxima {datos['max_dif']}")
+        return
+
+    # Al reanudar se conservan los alumnos ya procesados cuyo collage sigue en la carpeta de salida
+    # (con --shard, también los que ya hicieron los demás shards o la última
+    # ejecución fusionada, aunque en el log propio solo se copian los suyos)
+    hechos = {}
+    previas = []
+    if args.reanudar:
+        logs = [log_path]
+        if reparto:
+            logs = [os.path.join(output_dir, NOMBRE_LOG)] + archivos_de_shards(output_dir, NOMBRE_LOG)
+        for ruta in logs:
+            for fila in leer_log(ruta):
+                if (fila.get("Estado") == "✅ Procesado"
+                        and os.path.exists(ruta_collage(output_dir, fila["N"], ajustes))):
+                    hechos[fila["N"]] = fila
+                    if ruta == log_path:
+                        previas.append(fila)
+        print(f"♻️  {len(hechos)} alumnos ya procesados en una ejecución anterior (se saltan)")
+
+    # Leer CSV
+    print(f"📄 Leyendo archivo CSV: {csv_path}")
+    identificadores = set()
+
+    def pendientes():
+        # Con --shard, solo los alumnos de esta parte. Con --reclamar, cada uno
+        # se reclama justo antes de empezarlo y, al acabar los propios, se
+        # sigue con los de los demás shards empezando por el final del CSV
+        ajenos = []
+        for identificador, nombre_completo in iterar_alumnos(csv_path):
+            identificadores.add(identificador)
+            if identificador in hechos:
+                continue
+            if reparto and not reparto.propio(identificador):
+                if reparto.carpeta_reclamos:
+                    ajenos.append((identificador, nombre_completo))
+                continue
+            if reparto is None or reparto.reclamar(identificador):
+                yield identificador, nombre_completo
+        for identificador, nombre_completo in reversed(ajenos):
+            if reparto.reclamar(identificador):
+                yield identificador, nombre_completo
+
+    # Procesar cada alumno; cada fila del log se escribe en cuanto termina su collage
+    print(f"\n🔄 Procesando alumnos ({workers} procesos, escalado {args.escalado})...")
+    if reparto:
+        print(f"🧩 Shard {reparto.indice}/{reparto.total}"
+              + (" (después, lo que quede de los demás)" if reparto.carpeta_reclamos else ""))
+    perfil = Perfilador("collage", args.profile).iniciar()
+    with abrir_log(log_path, previas if reparto else hechos.values()) as f:
+        escritor = csv.DictWriter(f, fieldnames=CAMPOS_LOG, lineterminator=os.linesep)
+
+        def registrar(fila):
+            escritor.writerow(fila)
+            f.flush()
+            if reparto:
+                reparto.terminar(fila["N"])
+
+        generar_collages(pendientes(), indice_fotos, output_dir, font_path, registrar, workers, args.escalado,
+                         ajustes, args.hilos_escritura, cache, perfil)
+    if args.reanudar:
+        ordenar_log(log_path, csv_path)
+
+    # Avisar de las fotos que no corresponden a ningún alumno
+    huerfanas = fotos_huerfanas(indice_fotos, identificadores)
+    if huerfanas:
+        print(f"\n⚠️ {len(huerfanas)} fotos no corresponden a ningún alumno del CSV:")
+        for ruta in huerfanas:
+            print(f"   - {ruta}")
+
+    if cache is not None and workers == 1:
+        print(f"🗃️ Caché de fotos: {cache.resumen()}")
+
+    print(f"\n📄 Log generado en: {log_path}")
+
+    ruta_perfil = perfil.terminar(output_dir)
+    if ruta_perfil:
+        print()
+        for linea in resumen_perfil(ruta_perfil):
+            print(linea)
 
-# Guardar log
-pd.DataFrame(log).to_csv(log_path, index=False, encoding="utf-8")
-print(f"\n📄 Log generado en: {log_path}")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,28 @@
 import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 import cv2
+import numpy as np
 from PIL import Image, ImageEnhance
+from cache_imagenes import agregar_opciones_cache, cache_desde_args, hash_archivo, orientar
+from perfilado import Cronometro, Perfilador, agregar_opcion_perfil, resumen_perfil
+from reparto import (agregar_opciones_reparto, archivos_de_shards, limpiar_reclamos, reclamos_sin_terminar,
+                     reparto_desde_args)
+from escritura import (AjustesEscritura, EscritorAsincrono, agregar_opciones_escritura, ajustes_desde_args,
+                       describir_escritura, guardar_imagen)
 
 # Aumentar el límite de tamaño de imagen de PIL
 Image.MAX_IMAGE_PIXELS = None
 
 def mejorar_imagen_autoenhance(ruta_entrada, ruta_salida):
+    # Versión original con PIL, de archivo a archivo. Se mantiene como referencia
+    # de mejorar_imagen_autoenhance_array, que es la que usa el proceso por lotes
+
     # Abrir imagen con PIL
     img = Image.open(ruta_entrada)
     
@@ -28,6 +45,49 @@ def mejorar_imagen_autoenhance(ruta_entrada, ruta_salida):
     # Guardar imagen mejorada
     img.save(ruta_salida)
 
+# Kernel del filtro SMOOTH de PIL, que ImageEnhance.Sharpness usa como imagen degenerada
+KERNEL_SUAVIZADO = np.array([[1, 1, 1], [1, 5, 1], [1, 1, 1]], dtype=np.float32) / 13
+# PIL trunca al mezclar y OpenCV redondea: restar casi medio punto equivale a truncar
+AJUSTE_TRUNCADO = -0.5 + 1e-3
+
+def tabla_contraste_brillo(media, contraste, brillo):
+    # Contraste y brillo de PIL combinados en una sola tabla de 256 valores,
+    # con la misma aritmética (float de 32 bits, truncado y recorte) que Image.blend
+    valores = np.arange(256, dtype=np.float32)
+    valores = np.floor(np.clip(np.float32(media) + np.float32(contraste) * (valores - np.float32(media)), 0, 255))
+    valores = np.floor(np.clip(np.float32(brillo) * valores, 0, 255))
+    return valores.astype(np.uint8)
+
+def media_gris(img):
+    # Gris medio redondeado, como lo calcula ImageEnhance.Contrast
+    return int(cv2.mean(cv2.cvtColor(img, cv2.COLOR_BGR2GRAY))[0] + 0.5)
+
+def mejorar_imagen_autoenhance_array(img, contraste=1.2, brillo=1.1, color=1.1, nitidez=1.2, media=None):
+    # Mismo autoenhance que mejorar_imagen_autoenhance, pero en memoria sobre el
+    # array BGR de OpenCV: contraste y brillo en una única tabla (LUT) y
+    # saturación y nitidez como mezclas vectorizadas. Frente a la versión PIL
+    # (sobre la misma imagen sin pasar por disco) ningún canal difiere en más de
+    # 2 niveles y la diferencia media es inferior a 0.01 (benchmark.py lo
+    # comprueba en su corpus).
+    # `media` es el gris medio de la imagen completa; al procesar por tiles hay
+    # que pasarlo para que todos usen el mismo contraste
+    if media is None:
+        media = media_gris(img)
+    img = cv2.LUT(img, tabla_contraste_brillo(media, contraste, brillo))
+
+    # Saturación: mezcla con la versión en escala de grises
+    gris = cv2.cvtColor(cv2.cvtColor(img, cv2.COLOR_BGR2GRAY), cv2.COLOR_GRAY2BGR)
+    cv2.addWeighted(img, color, gris, 1 - color, AJUSTE_TRUNCADO, dst=img)
+    del gris
+
+    # Nitidez: mezcla con la versión suavizada; como en PIL, los píxeles del
+    # borde no se filtran y quedan igual
+    resultado = cv2.filter2D(img, -1, KERNEL_SUAVIZADO, borderType=cv2.BORDER_REPLICATE)
+    cv2.addWeighted(img, nitidez, resultado, 1 - nitidez, AJUSTE_TRUNCADO, dst=resultado)
+    resultado[0], resultado[-1] = img[0], img[-1]
+    resultado[:, 0], resultado[:, -1] = img[:, 0], img[:, -1]
+    return resultado
+
 def hacer_upscale(img, factor=2):
     # Aumentar resolución (escala x2 con interpolación bicúbica)
     return cv2.resize(img, None, fx=factor, fy=factor, interpolation=cv2.INTER_CUBIC)
@@ -43,114 +103,616 @@ def hacer_downscale(img, factor=0.25):
     # Reducir resolución usando INTER_AREA (mejor para reducción)
     return cv2.resize(img, (new_width, new_height), interpolation=cv2.INTER_AREA)
 
-# Solicitar carpeta de entrada al usuario
-input_dir = input("Por favor, introduce la ruta de la carpeta con las imágenes a mejorar: ").strip()
-if not os.path.exists(input_dir):
-    print(f"❌ La carpeta '{input_dir}' no existe.")
-    exit(1)
-
-# Preguntar qué mejoras quiere aplicar
-print("\nOpciones de escala:")
-print("1. Upscale (aumentar tamaño)")
-print("2. Downscale (reducir tamaño)")
-print("3. Mantener tamaño original")
-escala_opcion = input("Elige una opción (1/2/3): ").strip()
-
-if escala_opcion == "1":
-    hacer_upscale_resp = True
-    hacer_downscale_resp = False
-    factor = float(input("Factor de aumento (ej: 2 para doble tamaño): ").strip())
-elif escala_opcion == "2":
-    hacer_upscale_resp = False
-    hacer_downscale_resp = True
-    factor = float(input("Factor de reducción (ej: 0.25 para un cuarto del tamaño): ").strip())
-else:
-    hacer_upscale_resp = False
-    hacer_downscale_resp = False
-    factor = 1.0
-
-hacer_autoenhance_resp = input("\n¿Quieres mejorar las fotos con autoenhance? (y/n): ").lower().strip()
-
-if not hacer_upscale_resp and not hacer_downscale_resp and hacer_autoenhance_resp != 'y':
-    print("❌ No se ha seleccionado ninguna mejora. Saliendo...")
-    exit(1)
-
-# Configura rutas
-output_dir = "Output"             # Carpeta donde se guardarán las mejoradas
-os.makedirs(output_dir, exist_ok=True)
-
-print(f"\n📁 Carpeta de entrada: {input_dir}")
-print(f"📁 Carpeta de salida: {output_dir}")
+def leer_reducida(ruta_entrada, factor, cache):
+    # Imagen ya reducida por hacer_downscale, de la caché si está. La caché
+    # guarda las fotos sin girar, así que se leen ignorando la orientación EXIF
+    # y se giran después, como haría cv2.imread. Devuelve (imagen, tamaño
+    # original ya girado), o (None, None) si no se puede leer
+    try:
+        with Image.open(ruta_entrada) as im:
+            ancho, alto = im.size
+            orientacion = im.getexif().get(274, 1)
+    except Exception:
+        return None, None
+    tamano = (int(ancho * factor), int(alto * factor))
+
+    def generar():
+        original = cv2.imread(ruta_entrada, cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION)
+        if original is None:
+            raise IOError(f"No se pudo leer {ruta_entrada}")
+        return hacer_downscale(original, factor)
+
+    img = orientar(cache.obtener(ruta_entrada, tamano, "area", generar), orientacion)
+    if orientacion in (5, 6, 7, 8):
+        ancho, alto = alto, ancho
+    return img, (ancho, alto)
+
+# Procesamiento por tiles para imágenes enormes
+TAMANO_TILE = 2048  # Lado de cada tile, en píxeles de la imagen de salida
+UMBRAL_TILES = 100_000_000  # Píxeles de salida a partir de los cuales se procesa por tiles
+HALO_TILE = 4  # Píxeles de origen extra alrededor de cada tile (cúbica: 2, nitidez: 1)
+
+def necesita_tiles(img, factor=1):
+    alto, ancho = img.shape[:2]
+    return alto * ancho * factor * factor > UMBRAL_TILES
+
+def procesar_por_tiles(img, ruta_salida, factor=1, autoenhance=False, tamano_tile=TAMANO_TILE, ajustes=None):
+    # Aplica el upscale (factor entero) y/o el autoenhance por tiles solapados y
+    # escribe el resultado en un buffer mapeado en disco, de modo que la imagen de
+    # salida nunca está entera en memoria: solo un tile y sus intermedios. La
+    # entrada `img`, en cambio, sí está entera (ya decodificada). Cada
+    # tile se amplía con HALO_TILE píxeles de contexto para que la interpolación
+    # cúbica y el filtro de nitidez den exactamente lo mismo que sobre la imagen
+    # completa, y después se recorta el halo.
+    alto, ancho = img.shape[:2]
+    alto_salida, ancho_salida = alto * factor, ancho * factor
+    paso = max(1, tamano_tile // factor)  # Lado del tile en píxeles de origen
+
+    # El contraste depende del gris medio de toda la imagen; la interpolación
+    # conserva la media, así que basta con calcularlo sobre la entrada
+    media = media_gris(img) if autoenhance else None
+
+    carpeta_salida = os.path.dirname(ruta_salida) or "."
+    with tempfile.NamedTemporaryFile(dir=carpeta_salida, prefix=".tiles_", suffix=".raw") as temporal:
+        salida = np.memmap(temporal, dtype=np.uint8, mode="w+", shape=(alto_salida, ancho_salida, 3))
+        for y0 in range(0, alto, paso):
+            for x0 in range(0, ancho, paso):
+                y1, x1 = min(y0 + paso, alto), min(x0 + paso, ancho)
+                # Tile con su halo, recortado a los bordes de la imagen
+                hy0, hx0 = max(0, y0 - HALO_TILE), max(0, x0 - HALO_TILE)
+                hy1, hx1 = min(alto, y1 + HALO_TILE), min(ancho, x1 + HALO_TILE)
+                tile = img[hy0:hy1, hx0:hx1]
+                if factor > 1:
+                    tile = hacer_upscale(tile, factor)
+                if autoenhance:
+                    tile = mejorar_imagen_autoenhance_array(tile, media=media)
+                oy, ox = (y0 - hy0) * factor, (x0 - hx0) * factor
+                salida[y0 * factor:y1 * factor, x0 * factor:x1 * factor] = \
+                    tile[oy:oy + (y1 - y0) * factor, ox:ox + (x1 - x0) * factor]
+        # OpenCV codifica directamente desde el mapa en disco
+        escritura = guardar_imagen(salida, ruta_salida, ajustes)
+        del salida
+    return escritura
 
 # Extensiones válidas
 ext_validas = [".jpg", ".jpeg", ".png"]
 
-# Contador de archivos procesados
-total_archivos = 0
-archivos_procesados = 0
+def procesar_archivo(ruta_entrada, ruta_salida, escala=None, factor=1.0, autoenhance=False,
+                     ajustes=None, cache=None, escritor=None):
+    # Procesa una imagen y devuelve su resultado. Los mensajes se acumulan en vez
+    # de imprimirse para que, al trabajar en paralelo, cada archivo salga junto.
+    # Con un escritor, la imagen se guarda en segundo plano: el resultado queda
+    # con estado "escribiendo" hasta que lo complete esperar_escritura.
+    # Con una caché (cache_imagenes.CacheImagenes), el downscale reutiliza la
+    # versión reducida de ejecuciones anteriores sin decodificar el original
+    nombre_archivo = os.path.basename(ruta_entrada)
+    crono = Cronometro()
+    resultado = {"archivo": nombre_archivo, "salida": ruta_salida, "estado": "error",
+                 "error": None, "mensajes": [f"\n📸 Procesando: {nombre_archivo}"], "etapas": crono.etapas}
+    mensajes = resultado["mensajes"]
 
-# Proceso
-print("\n🔍 Buscando imágenes...")
-for nombre_archivo in os.listdir(input_dir):
-    ruta_entrada = os.path.join(input_dir, nombre_archivo)
-    nombre_base, ext = os.path.splitext(nombre_archivo)
-    
-    if ext.lower() not in ext_validas:
-        print(f"⚠️  Ignorando archivo no válido: {nombre_archivo}")
-        continue
-    
-    total_archivos += 1
-    print(f"\n📸 Procesando: {nombre_archivo}")
-    
     try:
         # Leer imagen
-        img = cv2.imread(ruta_entrada)
+        if escala == "down" and cache is not None:
+            with crono.etapa("lectura_cache"):
+                img, tamano_original = leer_reducida(ruta_entrada, factor, cache)
+        else:
+            with crono.etapa("lectura"):
+                img = cv2.imread(ruta_entrada)
         if img is None:
-            print(f"❌ No se pudo leer: {nombre_archivo}")
-            continue
+            resultado["error"] = "No se pudo leer"
+            mensajes.append(f"❌ No se pudo leer: {nombre_archivo}")
+            return resultado
 
         # Mostrar tamaño original
         height, width = img.shape[:2]
-        print(f"📐 Tamaño original: {width}x{height}")
-
-        # Aplicar upscale o downscale si se solicitó
-        if hacer_upscale_resp:
-            img = hacer_upscale(img, int(factor))
-            print(f"✅ Upscale aplicado (factor: {factor})")
-        elif hacer_downscale_resp:
-            img = hacer_downscale(img, factor)
-            print(f"✅ Downscale aplicado (factor: {factor})")
-
-        # Mostrar nuevo tamaño
-        new_height, new_width = img.shape[:2]
-        print(f"📐 Nuevo tamaño: {new_width}x{new_height}")
-
-        # Guardar temporalmente si necesitamos hacer autoenhance
-        if hacer_autoenhance_resp == 'y':
-            temp_path = os.path.join(output_dir, f"temp_{nombre_archivo}")
-            cv2.imwrite(temp_path, img)
-            print("✅ Imagen temporal guardada para autoenhance")
-            
-            # Aplicar autoenhance
-            ruta_salida = os.path.join(output_dir, nombre_archivo)
-            mejorar_imagen_autoenhance(temp_path, ruta_salida)
-            print("✅ Autoenhance aplicado")
-            
-            # Eliminar archivo temporal
-            os.remove(temp_path)
+        if escala == "down" and cache is not None:
+            width, height = tamano_original
+        resultado["tamano_original"] = (width, height)
+        mensajes.append(f"📐 Tamaño original: {width}x{height}")
+
+        # Aplicar downscale si se solicitó (con caché, la imagen ya viene reducida)
+        if escala == "down":
+            if cache is None:
+                with crono.etapa("downscale"):
+                    img = hacer_downscale(img, factor)
+            mensajes.append(f"✅ Downscale aplicado (factor: {factor})")
+
+        # Las imágenes enormes se amplían y mejoran por tiles, sin tener nunca
+        # la imagen de salida completa en memoria
+        factor_tiles = int(factor) if escala == "up" else 1
+        if (escala == "up" or autoenhance) and necesita_tiles(img, factor_tiles):
+            mensajes.append(f"🧩 Imagen muy grande: procesando por tiles de {TAMANO_TILE}px")
+            with crono.etapa("tiles"):
+                escritura = procesar_por_tiles(img, ruta_salida, factor_tiles, autoenhance, ajustes=ajustes)
+            if escala == "up":
+                mensajes.append(f"✅ Upscale aplicado (factor: {factor})")
+            new_width, new_height = img.shape[1] * factor_tiles, img.shape[0] * factor_tiles
+            mensajes.append(f"📐 Nuevo tamaño: {new_width}x{new_height}")
+            if autoenhance:
+                mensajes.append("✅ Autoenhance aplicado")
         else:
-            # Si no hay autoenhance, guardar directamente
-            ruta_salida = os.path.join(output_dir, nombre_archivo)
-            cv2.imwrite(ruta_salida, img)
+            # Aplicar upscale si se solicitó
+            if escala == "up":
+                with crono.etapa("upscale"):
+                    img = hacer_upscale(img, int(factor))
+                mensajes.append(f"✅ Upscale aplicado (factor: {factor})")
+
+            # Mostrar nuevo tamaño
+            new_height, new_width = img.shape[:2]
+            mensajes.append(f"📐 Nuevo tamaño: {new_width}x{new_height}")
+
+            # Aplicar autoenhance en memoria, sin pasar por un archivo temporal
+            if autoenhance:
+                with crono.etapa("autoenhance"):
+                    img = mejorar_imagen_autoenhance_array(img)
+                mensajes.append("✅ Autoenhance aplicado")
+
+            resultado["tamano_final"] = (new_width, new_height)
+            if escritor is not None:
+                resultado["estado"] = "escribiendo"
+                resultado["escritura"] = escritor.guardar(img, ruta_salida)
+                return resultado
+            with crono.etapa("escritura"):
+                escritura = guardar_imagen(img, ruta_salida, ajustes)
+
+        resultado["tamano_final"] = (new_width, new_height)
+        registrar_escritura(resultado, escritura)
 
-        print(f"✅ Procesado: {nombre_archivo}")
-        archivos_procesados += 1
-        
     except Exception as e:
-        print(f"❌ Error procesando {nombre_archivo}: {str(e)}")
-        continue
+        resultado["error"] = str(e)
+        mensajes.append(f"❌ Error procesando {nombre_archivo}: {str(e)}")
+
+    return resultado
+
+def registrar_escritura(resultado, escritura):
+    resultado["salida"] = escritura["ruta"]
+    resultado["bytes"] = escritura["bytes"]
+    resultado["segundos_escritura"] = escritura["segundos"]
+    resultado["estado"] = "procesado"
+    resultado["mensajes"].append(f"💾 Guardado: {describir_escritura(escritura)}")
+    resultado["mensajes"].append(f"✅ Procesado: {resultado['archivo']}")
+
+def esperar_escritura(resultado):
+    # Completa un resultado cuya imagen se estaba guardando en segundo plano
+    futuro = resultado.pop("escritura", None)
+    if futuro is None:
+        return resultado
+    try:
+        escritura = futuro.result()
+        # Escrita en otro hilo: solo se conoce su tiempo real
+        resultado["etapas"]["escritura"] = {"wall": escritura["segundos"], "cpu": 0.0}
+        registrar_escritura(resultado, escritura)
+    except Exception as e:
+        resultado["estado"] = "error"
+        resultado["error"] = str(e)
+        resultado["mensajes"].append(f"❌ Error procesando {resultado['archivo']}: {str(e)}")
+    return resultado
+
+# Caché incremental: manifiesto en la carpeta de salida con la huella de cada
+# entrada y los parámetros con los que se procesó
+MANIFIESTO = ".enhancer_cache.json"
+VERSION_PROCESADO = 1  # Subir cuando cambie el resultado del procesado para invalidar la caché
+# Segundos entre guardados del manifiesto durante el lote, para no perderlo todo
+# si se interrumpe. Cada guardado reescribe el JSON entero, así que se limita por
+# tiempo y no por resultados: con decenas de miles de archivos, guardar cada N
+# resultados haría un trabajo cuadrático
+GUARDAR_MANIFIESTO_CADA = 30
+
+def parametros_procesado(escala, factor, autoenhance, ajustes=None):
+    parametros = f"v{VERSION_PROCESADO}:{escala}:{float(factor)}:{int(bool(autoenhance))}"
+    clave = ajustes.clave() if ajustes else ""
+    return f"{parametros}:{clave}" if clave else parametros
+
+def cargar_manifiesto(carpeta, nombre=MANIFIESTO):
+    try:
+        with open(os.path.join(carpeta, nombre), encoding="utf-8") as f:
+            manifiesto = json.load(f)
+        if manifiesto.get("version") == 1:
+            return manifiesto
+    except (OSError, ValueError):
+        pass
+    return {"version": 1, "archivos": {}}
+
+def guardar_manifiesto(carpeta, manifiesto, nombre=MANIFIESTO):
+    # Escritura atómica: un manifiesto a medio escribir nunca sustituye al bueno
+    ruta = os.path.join(carpeta, nombre)
+    with open(ruta + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifiesto, f, ensure_ascii=False, indent=1)
+    os.replace(ruta + ".tmp", ruta)
+
+def entradas_de_shards(carpeta):
+    # Entradas de los manifiestos que deja cada nodo con --shard, aún sin fusionar
+    archivos = {}
+    for ruta in archivos_de_shards(carpeta, MANIFIESTO):
+        archivos.update(cargar_manifiesto(carpeta, os.path.basename(ruta))["archivos"])
+    return archivos
+
+def huella_entrada(ruta, entrada_previa=None):
+    # Hash del contenido de la entrada. Si tamaño y fecha de modificación no han
+    # cambiado desde la última vez, se reutiliza el hash guardado sin leer el archivo
+    estado = os.stat(ruta)
+    huella = {"tamano": estado.st_size, "mtime_ns": estado.st_mtime_ns}
+    if entrada_previa and all(entrada_previa.get(k) == v for k, v in huella.items()):
+        huella["sha256"] = entrada_previa["sha256"]
+    else:
+        huella["sha256"] = hash_archivo(ruta)
+    return huella
+
+def salida_en_cache(entrada, huella, parametros, ruta_salida, verificar=False):
+    # La salida es reutilizable si la entrada tiene el mismo contenido, se
+    # procesó con los mismos parámetros y el archivo de salida sigue ahí (y, al
+    # verificar, no ha cambiado)
+    if not entrada or entrada["sha256"] != huella["sha256"] or entrada["parametros"] != parametros:
+        return False
+    if not os.path.exists(ruta_salida):
+        return False
+    if verificar:
+        return (os.path.getsize(ruta_salida) == entrada.get("salida_tamano")
+                and hash_archivo(ruta_salida) == entrada.get("salida_sha256"))
+    return True
+
+def resumir_salida(resultado):
+    # Espera a que se guarde la salida y le añade su huella, calculada mientras
+    # el archivo recién escrito sigue en la caché del sistema
+    resultado = esperar_escritura(resultado)
+    if resultado["estado"] == "procesado":
+        with Cronometro(resultado["etapas"]).etapa("huella_salida"):
+            resultado["salida_tamano"] = os.path.getsize(resultado["salida"])
+            resultado["salida_sha256"] = hash_archivo(resultado["salida"])
+    return resultado
+
+def procesar_y_resumir(ruta_entrada, ruta_salida, **opciones):
+    return resumir_salida(procesar_archivo(ruta_entrada, ruta_salida, **opciones))
+
+def enhance_folder(src, dst="Output", scale=None, factor=1.0, autoenhance=False,
+                   workers=None, max_in_flight=None, verbose=True,
+                   cache=True, verify=False, evict=False, encoding=None, write_threads=2, image_cache=None,
+                   profile=None, files=None, shard=None):
+    # API por lotes: procesa todas las imágenes de `src` y guarda el resultado en
+    # `dst`. scale puede ser "up", "down" o None; factor es el factor de escala.
+    # Los archivos se reparten entre `workers` procesos (por defecto, uno por
+    # núcleo) con como mucho `max_in_flight` imágenes en curso a la vez para
+    # acotar la memoria. Devuelve un diccionario con el resumen y el resultado
+    # de cada archivo.
+    # Con cache=True se saltan las entradas cuyo contenido y parámetros coinciden
+    # con los del manifiesto de `dst`; verify=True comprueba además que la salida
+    # guardada no ha cambiado y evict=True elimina del manifiesto las entradas
+    # cuyo archivo de origen ya no existe (con files, solo entre esos nombres).
+    # encoding es un escritura.AjustesEscritura con las opciones del
+    # codificador (calidad, JPEG progresivo, WebP...). Con un solo proceso, las
+    # imágenes se codifican y guardan en `write_threads` hilos mientras se
+    # procesa la siguiente (0 para guardar en el hilo principal).
+    # image_cache es un cache_imagenes.CacheImagenes opcional para el downscale.
+    # profile es un perfilado.Perfilador ya iniciado en el que se registran los
+    # tiempos de cada archivo y etapa.
+    # files limita el lote a esos nombres de archivo de `src` (por defecto,
+    # todos); el resto del manifiesto se conserva.
+    # shard es un reparto.Reparto: solo se procesan los archivos de esa parte
+    # (y, si reclama, también lo que quede de las demás), y el manifiesto se
+    # guarda aparte, en uno propio del shard, hasta fusionar_shards.
+    if not os.path.exists(src):
+        raise ValueError(f"La carpeta '{src}' no existe.")
+    if scale not in (None, "up", "down"):
+        raise ValueError(f"Escala no válida: {scale!r} (usa 'up', 'down' o None)")
+    if scale is None and not autoenhance:
+        raise ValueError("No se ha seleccionado ninguna mejora.")
+    if shard and evict:
+        raise ValueError("No se puede purgar el manifiesto de un solo shard; purga después de fusionar.")
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = max(1, max_in_flight or 2 * workers)
+    os.makedirs(dst, exist_ok=True)
+
+    def log(mensaje):
+        if verbose:
+            print(mensaje)
+
+    log(f"\n📁 Carpeta de entrada: {src}")
+    log(f"📁 Carpeta de salida: {dst}")
+
+    perfil = profile or Perfilador("enhancer")
+    nombre_manifiesto = shard.nombre_archivo(MANIFIESTO) if shard else MANIFIESTO
+    manifiesto = cargar_manifiesto(dst, nombre_manifiesto) if cache else None
+    conocidos = manifiesto["archivos"] if manifiesto is not None else {}
+    if manifiesto is not None and shard:
+        # Cada shard guarda solo lo suyo, pero reutiliza también lo que ya
+        # procesaron los demás o la última ejecución fusionada
+        conocidos = {**cargar_manifiesto(dst)["archivos"], **entradas_de_shards(dst), **conocidos}
+    ajustes = encoding or AjustesEscritura()
+    parametros = parametros_procesado(scale, factor, autoenhance, ajustes)
+
+    # Proceso
+    log("\n🔍 Buscando imágenes...")
+    candidatos = []
+    huellas = {}
+    ignorados = []
+    resultados = []
+    validos = set()
+    if files is None:
+        nombres = sorted(os.listdir(src))
+    else:
+        # Los que ya no existen no se procesan; con evict, salen del manifiesto
+        nombres = sorted(nombre for nombre in files if os.path.isfile(os.path.join(src, nombre)))
+    for nombre_archivo in shard.ordenar(nombres) if shard else nombres:
+        nombre_base, ext = os.path.splitext(nombre_archivo)
+        if ext.lower() not in ext_validas:
+            if shard is None or shard.propio(nombre_archivo):
+                log(f"⚠️  Ignorando archivo no válido: {nombre_archivo}")
+                ignorados.append(nombre_archivo)
+            continue
+        candidatos.append((nombre_archivo, os.path.join(src, nombre_archivo),
+                           ajustes.ruta(os.path.join(dst, nombre_archivo))))
+    if shard:
+        propios = sum(1 for nombre_archivo, _, _ in candidatos if shard.propio(nombre_archivo))
+        log(f"🧩 Shard {shard.indice}/{shard.total}: {propios} imágenes propias"
+            + (" (después, lo que quede de los demás)" if shard.carpeta_reclamos else ""))
+
+    def tareas_pendientes():
+        # Con un reparto que reclama, cada archivo se reclama justo antes de
+        # empezarlo, y solo entonces se calcula su huella: así no se hace
+        # trabajo con los que acaba haciendo otro nodo
+        for nombre_archivo, ruta_entrada, ruta_salida in candidatos:
+            if shard and not shard.reclamar(nombre_archivo):
+                continue
+            validos.add(nombre_archivo)
+            if manifiesto is not None:
+                entrada = conocidos.get(nombre_archivo)
+                with perfil.etapa("huella_entrada"):
+                    huellas[nombre_archivo] = huella_entrada(ruta_entrada, entrada)
+                if salida_en_cache(entrada, huellas[nombre_archivo], parametros, ruta_salida, verify):
+                    resultados.append({"archivo": nombre_archivo, "salida": ruta_salida,
+                                       "estado": "en_cache", "error": None, "mensajes": []})
+                    if shard:
+                        shard.terminar(nombre_archivo)
+                    continue
+            yield ruta_entrada, ruta_salida
+
+    tareas = tareas_pendientes()
+
+    ultimo_guardado = [time.monotonic()]
+
+    def recoger(resultado):
+        resultados.append(resultado)
+        perfil.registrar_item(resultado["archivo"], resultado.pop("etapas"))
+        if shard:
+            shard.terminar(resultado["archivo"])
+        for mensaje in resultado["mensajes"]:
+            log(mensaje)
+        if manifiesto is None:
+            return
+        nombre_archivo = resultado["archivo"]
+        if resultado["estado"] == "procesado":
+            manifiesto["archivos"][nombre_archivo] = {
+                **huellas[nombre_archivo],
+                "parametros": parametros,
+                "salida_tamano": resultado["salida_tamano"],
+                "salida_sha256": resultado["salida_sha256"],
+            }
+        else:
+            manifiesto["archivos"].pop(nombre_archivo, None)
+        if time.monotonic() - ultimo_guardado[0] >= GUARDAR_MANIFIESTO_CADA:
+            with perfil.etapa("manifiesto"):
+                guardar_manifiesto(dst, manifiesto, nombre_manifiesto)
+            ultimo_guardado[0] = time.monotonic()
+
+    opciones = dict(escala=scale, factor=factor, autoenhance=autoenhance, ajustes=ajustes, cache=image_cache)
+    if workers == 1 and write_threads < 1:
+        for ruta_entrada, ruta_salida in tareas:
+            recoger(procesar_y_resumir(ruta_entrada, ruta_salida, **opciones))
+    elif workers == 1:
+        # La imagen de cada archivo se guarda mientras se procesa la siguiente
+        with EscritorAsincrono(ajustes, write_threads) as escritor:
+            pendientes = deque()
+            for ruta_entrada, ruta_salida in tareas:
+                pendientes.append(procesar_archivo(ruta_entrada, ruta_salida, escritor=escritor, **opciones))
+                while pendientes and (len(pendientes) > write_threads
+                                      or "escritura" not in pendientes[0] or pendientes[0]["escritura"].done()):
+                    recoger(resumir_salida(pendientes.popleft()))
+            while pendientes:
+                recoger(resumir_salida(pendientes.popleft()))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            en_curso = set()
+            for ruta_entrada, ruta_salida in tareas:
+                if len(en_curso) >= max_in_flight:
+                    terminados, en_curso = wait(en_curso, return_when=FIRST_COMPLETED)
+                    for futuro in terminados:
+                        recoger(futuro.result())
+                en_curso.add(pool.submit(procesar_y_resumir, ruta_entrada, ruta_salida, **opciones))
+            for futuro in wait(en_curso).done:
+                recoger(futuro.result())
+
+    if manifiesto is not None:
+        en_cache = sum(1 for resultado in resultados if resultado["estado"] == "en_cache")
+        if en_cache:
+            log(f"\n♻️  {en_cache} archivos sin cambios desde la última ejecución (se reutilizan)")
+        if evict:
+            # Con files solo se sabe algo de esos nombres: el resto del
+            # manifiesto no se toca
+            revisados = manifiesto["archivos"] if files is None else set(files)
+            obsoletas = [nombre for nombre in manifiesto["archivos"]
+                         if nombre in revisados and nombre not in validos]
+            for nombre in obsoletas:
+                del manifiesto["archivos"][nombre]
+            log(f"🧹 Entradas obsoletas eliminadas del manifiesto: {len(obsoletas)}")
+        with perfil.etapa("manifiesto"):
+            guardar_manifiesto(dst, manifiesto, nombre_manifiesto)
+
+    resultados.sort(key=lambda resultado: resultado["archivo"])
+    total = len(validos)
+    procesados = sum(1 for resultado in resultados if resultado["estado"] == "procesado")
+    en_cache = sum(1 for resultado in resultados if resultado["estado"] == "en_cache")
+    escritos = [resultado for resultado in resultados if resultado["estado"] == "procesado"]
+    return {
+        "entrada": src,
+        "salida": dst,
+        "total": total,
+        "procesados": procesados,
+        "en_cache": en_cache,
+        "fallidos": total - procesados - en_cache,
+        "no_validos": ignorados,
+        "bytes_escritos": sum(resultado["bytes"] for resultado in escritos),
+        "segundos_escritura": sum(resultado["segundos_escritura"] for resultado in escritos),
+        "archivos": resultados,
+    }
+
+def imprimir_resumen(resumen):
+    print(f"\n📊 Resumen:")
+    print(f"   - Total de archivos encontrados: {resumen['total']}")
+    print(f"   - Archivos procesados con éxito: {resumen['procesados']}")
+    if resumen["en_cache"]:
+        print(f"   - Archivos sin cambios (reutilizados): {resumen['en_cache']}")
+    print(f"   - Archivos ignorados: {resumen['fallidos']}")
+    if resumen["procesados"]:
+        print(f"   - Escrito: {resumen['bytes_escritos'] / 1024 ** 2:.1f} MB "
+              f"(codificación: {resumen['segundos_escritura']:.1f} s)")
+
+# Con --shard, cada nodo guarda su resumen en la carpeta de salida para que
+# --fusionar los combine
+RESUMEN = "resumen_enhancer.json"
+SUMAS_RESUMEN = ["total", "procesados", "en_cache", "fallidos", "bytes_escritos", "segundos_escritura"]
+
+def guardar_resumen(carpeta, resumen, nombre=RESUMEN):
+    archivos = [{clave: valor for clave, valor in resultado.items() if clave != "mensajes"}
+                for resultado in resumen["archivos"]]
+    ruta = os.path.join(carpeta, nombre)
+    with open(ruta + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({**resumen, "archivos": archivos}, f, ensure_ascii=False, indent=1)
+    os.replace(ruta + ".tmp", ruta)
+
+def fusionar_shards(dst):
+    # Combina los manifiestos y resúmenes que dejó cada shard en `dst` en el
+    # manifiesto normal y en RESUMEN, y borra los de cada shard y los reclamos.
+    # Devuelve el resumen combinado, o None si no había nada que fusionar. En
+    # "sin_terminar" quedan los archivos reclamados que ningún nodo terminó
+    rutas_manifiesto = archivos_de_shards(dst, MANIFIESTO)
+    rutas_resumen = archivos_de_shards(dst, RESUMEN)
+    if not rutas_manifiesto and not rutas_resumen:
+        return None
+    if rutas_manifiesto:
+        manifiesto = cargar_manifiesto(dst)
+        manifiesto["archivos"].update(entradas_de_shards(dst))
+        guardar_manifiesto(dst, manifiesto)
+
+    resumenes = []
+    for ruta in rutas_resumen:
+        with open(ruta, encoding="utf-8") as f:
+            resumenes.append(json.load(f))
+    resumen = {
+        "entrada": resumenes[0]["entrada"] if resumenes else None,
+        "salida": dst,
+        "shards": [os.path.basename(ruta) for ruta in rutas_resumen],
+        **{clave: sum(r[clave] for r in resumenes) for clave in SUMAS_RESUMEN},
+        "no_validos": sorted({nombre for r in resumenes for nombre in r["no_validos"]}),
+        "archivos": sorted((resultado for r in resumenes for resultado in r["archivos"]),
+                           key=lambda resultado: resultado["archivo"]),
+        "sin_terminar": reclamos_sin_terminar(dst, "enhancer"),
+    }
+    guardar_resumen(dst, resumen)
+    for ruta in rutas_manifiesto + rutas_resumen:
+        os.remove(ruta)
+    limpiar_reclamos(dst, "enhancer")
+    return resumen
+
+def preguntar_opciones():
+    # Modo interactivo original: se pregunta todo por consola
+    input_dir = input("Por favor, introduce la ruta de la carpeta con las imágenes a mejorar: ").strip()
+    if not os.path.exists(input_dir):
+        print(f"❌ La carpeta '{input_dir}' no existe.")
+        sys.exit(1)
+
+    # Preguntar qué mejoras quiere aplicar
+    print("\nOpciones de escala:")
+    print("1. Upscale (aumentar tamaño)")
+    print("2. Downscale (reducir tamaño)")
+    print("3. Mantener tamaño original")
+    escala_opcion = input("Elige una opción (1/2/3): ").strip()
+
+    if escala_opcion == "1":
+        escala = "up"
+        factor = float(input("Factor de aumento (ej: 2 para doble tamaño): ").strip())
+    elif escala_opcion == "2":
+        escala = "down"
+        factor = float(input("Factor de reducción (ej: 0.25 para un cuarto del tamaño): ").strip())
+    else:
+        escala = None
+        factor = 1.0
+
+    hacer_autoenhance_resp = input("\n¿Quieres mejorar las fotos con autoenhance? (y/n): ").lower().strip()
+    return input_dir, escala, factor, hacer_autoenhance_resp == 'y'
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Mejora por lotes las imágenes de una carpeta. Sin argumentos, pregunta las opciones por consola.")
+    parser.add_argument("carpeta", nargs="?", help="Carpeta con las imágenes a mejorar")
+    parser.add_argument("--salida", default="Output", help="Carpeta donde se guardarán las mejoradas (por defecto: Output)")
+    parser.add_argument("--escala", choices=["up", "down"], help="Upscale o downscale")
+    parser.add_argument("--factor", type=float, default=None,
+                        help="Factor de escala (ej: 2 para doble tamaño, 0.25 para un cuarto)")
+    parser.add_argument("--autoenhance", action="store_true", help="Mejorar contraste, brillo, saturación y nitidez")
+    parser.add_argument("--workers", type=int, default=None, help="Procesos en paralelo (por defecto: núcleos disponibles)")
+    parser.add_argument("--max-en-curso", type=int, default=None,
+                        help="Máximo de imágenes en proceso a la vez (por defecto: 2 por proceso)")
+    parser.add_argument("--sin-cache", action="store_true",
+                        help="Reprocesar todo aunque la entrada y las opciones no hayan cambiado")
+    parser.add_argument("--verificar", action="store_true",
+                        help="Comprobar que las salidas reutilizadas no se han modificado")
+    parser.add_argument("--purgar", action="store_true",
+                        help="Eliminar del manifiesto las entradas cuyo archivo de origen ya no existe")
+    agregar_opciones_escritura(parser)
+    agregar_opciones_cache(parser)
+    agregar_opcion_perfil(parser)
+    agregar_opciones_reparto(parser)
+    args = parser.parse_args()
+    try:
+        ajustes = ajustes_desde_args(args)
+        reparto = reparto_desde_args(args, args.salida, "enhancer")
+    except ValueError as e:
+        parser.error(str(e))
+    if reparto and args.purgar:
+        parser.error("--purgar no se puede combinar con --shard (purga después de --fusionar)")
+
+    if args.fusionar:
+        resumen = fusionar_shards(args.salida)
+        if resumen is None:
+            print(f"❌ No hay resultados de shards que fusionar en '{args.salida}'.")
+            sys.exit(1)
+        print(f"🔗 Fusionados {len(resumen['shards'])} shards en {os.path.join(args.salida, RESUMEN)}")
+        imprimir_resumen(resumen)
+        if resumen["sin_terminar"]:
+            print(f"\n⚠️ {len(resumen['sin_terminar'])} archivos reclamados que ningún nodo terminó "
+                  f"(vuelve a lanzar el lote para procesarlos):")
+            for nombre in resumen["sin_terminar"]:
+                print(f"   - {nombre}")
+        return
+
+    if args.carpeta:
+        input_dir, escala, autoenhance = args.carpeta, args.escala, args.autoenhance
+        factor = args.factor if args.factor is not None else {"up": 2.0, "down": 0.25}.get(escala, 1.0)
+        if not os.path.exists(input_dir):
+            print(f"❌ La carpeta '{input_dir}' no existe.")
+            sys.exit(1)
+    else:
+        input_dir, escala, factor, autoenhance = preguntar_opciones()
+
+    if escala is None and not autoenhance:
+        print("❌ No se ha seleccionado ninguna mejora. Saliendo...")
+        sys.exit(1)
+
+    perfil = Perfilador("enhancer", args.profile).iniciar()
+    resumen = enhance_folder(input_dir, args.salida, scale=escala, factor=factor, autoenhance=autoenhance,
+                             workers=args.workers, max_in_flight=args.max_en_curso,
+                             cache=not args.sin_cache, verify=args.verificar, evict=args.purgar,
+                             encoding=ajustes, write_threads=args.hilos_escritura,
+                             image_cache=cache_desde_args(args, args.salida), profile=perfil, shard=reparto)
+    imprimir_resumen(resumen)
+    if reparto:
+        guardar_resumen(args.salida, resumen, reparto.nombre_archivo(RESUMEN))
+    ruta_perfil = perfil.terminar(args.salida)
+    if ruta_perfil:
+        print()
+        for linea in resumen_perfil(ruta_perfil):
+            print(linea)
 
-print(f"\n📊 Resumen:")
-print(f"   - Total de archivos encontrados: {total_archivos}")
-print(f"   - Archivos procesados con éxito: {archivos_procesados}")
-print(f"   - Archivos ignorados: {total_archivos - archivos_procesados}")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+import os
+import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+
+# Escritura de las imágenes y vídeos de salida en segundo plano, compartida por
+# animacion.py, enhancer.py y "collage photos.py". Mientras un hilo codifica y
+# escribe un archivo, el hilo principal ya está calculando el siguiente.
+
+SUBMUESTREOS = {"444": 0, "422": 1, "420": 2}  # Valores del parámetro subsampling de PIL
+
+class AjustesEscritura:
+    # Opciones del codificador de las imágenes de salida. Las que se dejan en
+    # None/False usan el valor por defecto de la biblioteca que guarda (PIL u
+    # OpenCV), así que AjustesEscritura() guarda exactamente igual que antes.
+    # Los ajustes JPEG solo afectan a salidas .jpg/.jpeg; con webp=True todas
+    # las salidas se guardan como WebP.
+    def __init__(self, calidad=None, progresivo=False, optimizar=False, submuestreo=None, webp=False):
+        if calidad is not None and not 1 <= calidad <= 100:
+            raise ValueError(f"Calidad no válida: {calidad} (debe estar entre 1 y 100)")
+        if submuestreo is not None and submuestreo not in SUBMUESTREOS:
+            raise ValueError(f"Submuestreo no válido: {submuestreo!r} (usa 444, 422 o 420)")
+        self.calidad = calidad
+        self.progresivo = progresivo
+        self.optimizar = optimizar
+        self.submuestreo = submuestreo
+        self.webp = webp
+
+    def ruta(self, ruta):
+        # Ruta final del archivo, con la extensión del formato elegido
+        return os.path.splitext(ruta)[0] + ".webp" if self.webp else ruta
+
+    def clave(self):
+        # Texto que identifica los ajustes, vacío con los ajustes por defecto
+        partes = []
+        if self.webp:
+            partes.append("webp")
+        if self.calidad is not None:
+            partes.append(f"q{self.calidad}")
+        if self.progresivo:
+            partes.append("progresivo")
+        if self.optimizar:
+            partes.append("optimizado")
+        if self.submuestreo is not None:
+            partes.append(self.submuestreo)
+        return ",".join(partes)
+
+    def formato(self, ruta):
+        ext = os.path.splitext(ruta)[1].lower()
+        if ext in (".jpg", ".jpeg"):
+            return "jpeg"
+        if ext == ".webp":
+            return "webp"
+        return None
+
+    def opciones_pil(self, ruta):
+        formato = self.formato(ruta)
+        opciones = {}
+        if formato in ("jpeg", "webp") and self.calidad is not None:
+            opciones["quality"] = self.calidad
+        if formato == "jpeg":
+            if self.progresivo:
+                opciones["progressive"] = True
+            if self.optimizar:
+                opciones["optimize"] = True
+            if self.submuestreo is not None:
+                opciones["subsampling"] = SUBMUESTREOS[self.submuestreo]
+        return opciones
+
+    def parametros_cv2(self, ruta):
+        import cv2  # Solo hace falta al guardar arrays de OpenCV
+        formato = self.formato(ruta)
+        parametros = []
+        if formato == "webp" and self.calidad is not None:
+            parametros += [cv2.IMWRITE_WEBP_QUALITY, self.calidad]
+        if formato == "jpeg":
+            if self.calidad is not None:
+                parametros += [cv2.IMWRITE_JPEG_QUALITY, self.calidad]
+            if self.progresivo:
+                parametros += [cv2.IMWRITE_JPEG_PROGRESSIVE, 1]
+            if self.optimizar:
+                parametros += [cv2.IMWRITE_JPEG_OPTIMIZE, 1]
+            if self.submuestreo is not None:
+                parametros += [cv2.IMWRITE_JPEG_SAMPLING_FACTOR,
+                               getattr(cv2, f"IMWRITE_JPEG_SAMPLING_FACTOR_{self.submuestreo}")]
+        return parametros
+
+def guardar_imagen(imagen, ruta, ajustes=None):
+    # Guarda una imagen de PIL o un array BGR de OpenCV con los ajustes dados.
+    # Devuelve {"ruta", "bytes", "segundos"} con la ruta final, el tamaño del
+    # archivo y el tiempo de codificación y escritura
+    ajustes = ajustes or AjustesEscritura()
+    ruta = ajustes.ruta(ruta)
+    inicio = time.perf_counter()
+    if isinstance(imagen, Image.Image):
+        imagen.save(ruta, **ajustes.opciones_pil(ruta))
+    else:
+        import cv2
+        if not cv2.imwrite(ruta, imagen, ajustes.parametros_cv2(ruta)):
+            raise IOError(f"No se pudo escribir {ruta}")
+    return {"ruta": ruta, "bytes": os.path.getsize(ruta), "segundos": time.perf_counter() - inicio}
+
+def describir_escritura(escritura):
+    return f"{escritura['bytes'] / 1024:.0f} KB en {escritura['segundos'] * 1000:.0f} ms"
+
+class EscritorAsincrono:
+    # Guarda imágenes en un pool de hilos. guardar() devuelve un Future con el
+    # resultado de guardar_imagen y se bloquea mientras haya max_en_cola
+    # imágenes pendientes, para acotar la memoria. La imagen no debe
+    # modificarse después de entregarla.
+    def __init__(self, ajustes=None, hilos=2, max_en_cola=None):
+        self.ajustes = ajustes
+        self.pool = ThreadPoolExecutor(max_workers=hilos, thread_name_prefix="escritura")
+        self.huecos = threading.BoundedSemaphore(max_en_cola or 2 * hilos)
+        self.estadisticas = []
+        self.lock = threading.Lock()
+
+    def guardar(self, imagen, ruta):
+        self.huecos.acquire()
+        try:
+            return self.pool.submit(self._guardar, imagen, ruta)
+        except Exception:
+            self.huecos.release()
+            raise
+
+    def _guardar(self, imagen, ruta):
+        try:
+            escritura = guardar_imagen(imagen, ruta, self.ajustes)
+            with self.lock:
+                self.estadisticas.append(escritura)
+            return escritura
+        finally:
+            self.huecos.release()
+
+    def cerrar(self):
+        self.pool.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cerrar()
+
+class EscritorVideoAsincrono:
+    # Envuelve un escritor de vídeo (cv2.VideoWriter o FFmpegWriter de
+    # animacion.py) y le pasa los frames desde un hilo propio, en orden, a
+    # través de una cola acotada. write() copia el frame, así que el llamador
+    # puede seguir modificando su lienzo. Un error del escritor se relanza en
+    # la siguiente llamada a write() o en release().
+    def __init__(self, writer, max_en_cola=8, ruta=None):
+        self.writer = writer
+        self.ruta = ruta
+        self.cola = queue.Queue(max_en_cola)
+        self.error = None
+        self.frames = 0
+        self.segundos = 0.0
+        self.hilo = threading.Thread(target=self._escribir, daemon=True)
+        self.hilo.start()
+
+    def write(self, frame, repeat=1):
+        if self.error is not None:
+            raise self.error
+        self.cola.put((frame.copy(), repeat))
+
+    def _escribir(self):
+        while (item := self.cola.get()) is not None:
+            if self.error is not None:
+                continue  # Se vacía la cola para no bloquear al productor
+            frame, repeat = item
+            inicio = time.perf_counter()
+            try:
+                for _ in range(repeat):
+                    self.writer.write(frame)
+            except Exception as e:
+                self.error = e
+            self.segundos += time.perf_counter() - inicio
+            self.frames += repeat
+
+    def release(self):
+        self.cola.put(None)
+        self.hilo.join()
+        self.writer.release()
+        if self.error is not None:
+            raise self.error
+
+    def resumen(self):
+        # {"ruta", "bytes", "segundos", "frames"} una vez liberado el escritor
+        tamano = os.path.getsize(self.ruta) if self.ruta and os.path.exists(self.ruta) else None
+        return {"ruta": self.ruta, "bytes": tamano, "segundos": self.segundos, "frames": self.frames}
+
+def agregar_opciones_escritura(parser):
+    grupo = parser.add_argument_group("codificación de las imágenes de salida")
+    grupo.add_argument("--calidad", type=int, default=None,
+                       help="Calidad JPEG/WebP de 1 a 100 (por defecto: la de la biblioteca)")
+    grupo.add_argument("--progresivo", action="store_true", help="Guardar JPEG progresivos")
+    grupo.add_argument("--optimizar", action="store_true",
+                       help="Optimizar las tablas Huffman de los JPEG (archivos algo más pequeños)")
+    grupo.add_argument("--submuestreo", choices=sorted(SUBMUESTREOS), default=None,
+                       help="Submuestreo de color de los JPEG (por defecto: el de la biblioteca)")
+    grupo.add_argument("--webp", action="store_true", help="Guardar las salidas en WebP")
+    grupo.add_argument("--hilos-escritura", type=int, default=2,
+                       help="Hilos que codifican y escriben en segundo plano (por defecto: 2)")
+    return grupo
+
+def ajustes_desde_args(args):
+    return AjustesEscritura(args.calidad, args.progresivo, args.optimizar, args.submuestreo, args.webp)
@@ -0,0 +1,185 @@
+import os
+import sys
+import json
+import time
+import cProfile
+import threading
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Instrumentación de --profile, compartida por animacion.py, enhancer.py y
+# "collage photos.py": tiempo real y de CPU por etapa y por elemento, picos de
+# memoria y elementos por segundo. El resultado se guarda en JSON (y, con
+# --profile cprofile, también un volcado de cProfile) junto a las salidas.
+
+class Cronometro:
+    # Tiempos por etapa de un solo elemento (una foto, un collage). Es un
+    # diccionario normal, así que viaja sin problemas desde los procesos del
+    # pool en el resultado de cada elemento. La CPU es la del hilo que mide.
+    def __init__(self, etapas=None):
+        self.etapas = {} if etapas is None else etapas
+
+    @contextmanager
+    def etapa(self, nombre):
+        inicio, inicio_cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            self.sumar(nombre, time.perf_counter() - inicio, time.thread_time() - inicio_cpu)
+
+    def sumar(self, nombre, wall, cpu=None):
+        etapa = self.etapas.setdefault(nombre, {"wall": 0.0, "cpu": 0.0})
+        etapa["wall"] += wall
+        if cpu is not None:
+            etapa["cpu"] += cpu
+
+class Perfilador:
+    # Acumula los tiempos de una ejecución. Con modo=None no mide nada y
+    # etapa() no cuesta nada, así que se puede dejar en el código siempre.
+    # modo "json" guarda el resumen; "cprofile" además perfila las funciones de
+    # Python del proceso principal.
+    def __init__(self, herramienta, modo=None):
+        self.herramienta = herramienta
+        self.modo = modo
+        self.etapas = {}
+        self.items = []
+        self.lock = threading.Lock()
+        self.cprofile = None
+
+    @property
+    def activo(self):
+        return self.modo is not None
+
+    def iniciar(self):
+        if not self.activo:
+            return self
+        self.inicio = datetime.now()
+        self.inicio_wall, self.inicio_cpu = time.perf_counter(), time.process_time()
+        self.inicio_hijos = os.times()
+        tracemalloc.start()
+        if self.modo == "cprofile":
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+        return self
+
+    def etapa(self, nombre, item=None):
+        if not self.activo:
+            return nullcontext()
+        return self._etapa(nombre, item)
+
+    @contextmanager
+    def _etapa(self, nombre, item):
+        inicio, inicio_cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - inicio, time.thread_time() - inicio_cpu
+            with self.lock:
+                self._sumar(nombre, wall, cpu)
+                if item is not None:
+                    self.items.append({"item": item, "etapas": {nombre: {"wall": wall, "cpu": cpu}}})
+
+    def _sumar(self, nombre, wall, cpu=None, n=1):
+        etapa = self.etapas.setdefault(nombre, {"n": 0, "wall": 0.0, "cpu": 0.0, "wall_max": 0.0})
+        etapa["n"] += n
+        etapa["wall"] += wall
+        etapa["wall_max"] = max(etapa["wall_max"], wall)
+        if cpu is not None:
+            etapa["cpu"] += cpu
+
+    def sumar(self, nombre, wall, cpu=None, n=1):
+        # Para etapas medidas por otros medios (estadísticas del pipeline, del escritor...)
+        if self.activo:
+            with self.lock:
+                self._sumar(nombre, wall, cpu, n)
+
+    def registrar_item(self, item, etapas):
+        # Añade los tiempos de un elemento medidos con un Cronometro
+        if not self.activo:
+            return
+        with self.lock:
+            for nombre, tiempos in etapas.items():
+                self._sumar(nombre, tiempos["wall"], tiempos.get("cpu"))
+            self.items.append({"item": item, "etapas": etapas})
+
+    def terminar(self, carpeta, items=None):
+        # Cierra la medición y guarda el perfil en `carpeta`. `items` es el
+        # número de elementos procesados (por defecto, los registrados).
+        # Devuelve la ruta del JSON, o None si no estaba activo
+        if not self.activo:
+            return None
+        if self.cprofile is not None:
+            self.cprofile.disable()
+        wall = time.perf_counter() - self.inicio_wall
+        cpu = time.process_time() - self.inicio_cpu
+        hijos = os.times()
+        cpu_hijos = (hijos.children_user - self.inicio_hijos.children_user
+                     + hijos.children_system - self.inicio_hijos.children_system)
+        _, pico_tracemalloc = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        items = len(self.items) if items is None else items
+
+        etapas = {}
+        for nombre, etapa in self.etapas.items():
+            etapas[nombre] = {
+                **etapa,
+                "wall_medio": etapa["wall"] / etapa["n"] if etapa["n"] else 0.0,
+                "items_por_segundo": etapa["n"] / etapa["wall"] if etapa["wall"] else None,
+            }
+        perfil = {
+            "herramienta": self.herramienta,
+            "inicio": self.inicio.isoformat(timespec="seconds"),
+            "argumentos": sys.argv[1:],
+            "total": {
+                "wall": wall,
+                "cpu": cpu,
+                "cpu_procesos_hijos": cpu_hijos,
+                "items": items,
+                "items_por_segundo": items / wall if wall else None,
+            },
+            "memoria": {
+                "pico_rss_mb": pico_rss_mb(resource.RUSAGE_SELF) if resource else None,
+                "pico_rss_hijos_mb": pico_rss_mb(resource.RUSAGE_CHILDREN) if resource else None,
+                "pico_tracemalloc_mb": pico_tracemalloc / 1024 ** 2,
+            },
+            "etapas": etapas,
+            "items": self.items,
+        }
+
+        os.makedirs(carpeta, exist_ok=True)
+        base = os.path.join(carpeta, f"perfil_{self.herramienta}_{self.inicio:%Y%m%d-%H%M%S}")
+        with open(base + ".json", "w", encoding="utf-8") as f:
+            json.dump(perfil, f, ensure_ascii=False, indent=1)
+        if self.cprofile is not None:
+            self.cprofile.dump_stats(base + ".prof")
+        return base + ".json"
+
+def pico_rss_mb(quien):
+    # ru_maxrss viene en KB en Linux y en bytes en macOS
+    pico = resource.getrusage(quien).ru_maxrss
+    return pico / 1024 ** 2 if sys.platform == "darwin" else pico / 1024
+
+def resumen_perfil(ruta):
+    # Líneas para la consola con lo más relevante de un perfil guardado
+    with open(ruta, encoding="utf-8") as f:
+        perfil = json.load(f)
+    total = perfil["total"]
+    lineas = [f"⏱️ Perfil guardado en: {ruta}",
+              f"   - Total: {total['wall']:.2f} s ({total['cpu']:.2f} s de CPU, "
+              f"{total['cpu_procesos_hijos']:.2f} s en procesos hijos)"]
+    for nombre, etapa in sorted(perfil["etapas"].items(), key=lambda e: -e[1]["wall"]):
+        lineas.append(f"   - {nombre}: {etapa['wall']:.2f} s en {etapa['n']} ({etapa['cpu']:.2f} s de CPU)")
+    if perfil["memoria"]["pico_rss_mb"] is not None:
+        lineas.append(f"   - Pico de memoria: {perfil['memoria']['pico_rss_mb']:.0f} MB")
+    return lineas
+
+def agregar_opcion_perfil(parser):
+    parser.add_argument("--profile", nargs="?", const="json", choices=["json", "cprofile"], default=None,
+                        help="Medir tiempos por etapa y memoria y guardarlos en JSON junto a las salidas "
+                             "('cprofile' guarda además un volcado de cProfile)")
@@ -0,0 +1,199 @@
+import os
+import glob
+import json
+import time
+import shutil
+import socket
+import hashlib
+import argparse
+
+# Reparto del trabajo de enhancer.py y "collage photos.py" entre varias
+# máquinas que comparten almacenamiento. Con --shard i/N cada nodo procesa los
+# elementos (archivos o alumnos) cuyo hash cae en su parte, sin coordinarse con
+# los demás. Con --reclamar ID, además, cada elemento se reclama con un archivo
+# de bloqueo en la carpeta de salida antes de procesarlo, y el nodo que termina
+# su parte sigue con lo que les queda a los demás. Cada nodo escribe su propio
+# log/manifiesto/resumen, y --fusionar los combina al final.
+# Al terminar un elemento se deja junto a su reclamo un archivo ".hecho". Un
+# reclamo sin ".hecho" cuyo proceso ya no existe (en la misma máquina) o que
+# lleva más de la caducidad sin terminarse se da por abandonado y otro nodo
+# puede quedárselo, así que un nodo caído no deja su trabajo bloqueado.
+
+CARPETA_RECLAMOS = ".reclamos"
+CADUCIDAD_RECLAMOS = 30  # Minutos tras los que un reclamo sin terminar se da por abandonado
+
+def proceso_vivo(pid):
+    if os.name == "nt":
+        return True  # En Windows os.kill terminaría el proceso; solo vale la caducidad
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # Existe, pero es de otro usuario
+    return True
+
+def leer_reclamo(ruta):
+    # Contenido de un archivo de reclamo, o {} si está a medio escribir
+    try:
+        with open(ruta, encoding="utf-8") as f:
+            return json.load(f)
+    except ValueError:
+        return {}
+
+def shard_desde_texto(texto):
+    # "2/3" -> (2, 3): segunda parte de tres. Para usar como type= de argparse
+    try:
+        indice, total = (int(parte) for parte in texto.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Shard no válido: {texto!r} (usa i/N, por ejemplo 2/3)")
+    if not 1 <= indice <= total:
+        raise argparse.ArgumentTypeError(f"Shard no válido: {texto!r} (i debe estar entre 1 y N)")
+    return indice, total
+
+def parte_de(clave, total):
+    # Parte (1..total) a la que pertenece una clave. Usa un hash estable, no
+    # hash() de Python, que cambia entre procesos
+    return int.from_bytes(hashlib.sha1(clave.encode("utf-8")).digest()[:8], "big") % total + 1
+
+class Reparto:
+    # Parte `indice` de `total`. Con carpeta_reclamos, reclamar() crea en ella
+    # un archivo por elemento con O_EXCL: solo un nodo puede crearlo, así que
+    # solo uno procesa cada elemento aunque varios lo intenten a la vez
+    def __init__(self, indice, total, carpeta_reclamos=None, caducidad=CADUCIDAD_RECLAMOS * 60):
+        self.indice = indice
+        self.total = total
+        self.carpeta_reclamos = carpeta_reclamos
+        self.caducidad = caducidad  # Segundos
+        if carpeta_reclamos:
+            os.makedirs(carpeta_reclamos, exist_ok=True)
+
+    @property
+    def sufijo(self):
+        return f"shard{self.indice}-{self.total}"
+
+    def propio(self, clave):
+        return parte_de(clave, self.total) == self.indice
+
+    def ordenar(self, claves):
+        # Primero las claves propias, en orden. Si se reclama, después las de
+        # los demás nodos en orden inverso, para robarles trabajo por el final
+        # mientras ellos avanzan por el principio
+        claves = list(claves)
+        propias = [clave for clave in claves if self.propio(clave)]
+        if not self.carpeta_reclamos:
+            return propias
+        return propias + [clave for clave in reversed(claves) if not self.propio(clave)]
+
+    def ruta_reclamo(self, clave):
+        # Ruta sin extensión: el reclamo es "<ruta>.lock" y la marca de terminado "<ruta>.hecho"
+        return os.path.join(self.carpeta_reclamos, hashlib.sha1(clave.encode("utf-8")).hexdigest())
+
+    def crear_reclamo(self, ruta, clave):
+        try:
+            descriptor = os.open(ruta, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(descriptor, "w", encoding="utf-8") as f:
+            json.dump({"clave": clave, "shard": self.sufijo, "nodo": socket.gethostname(),
+                       "pid": os.getpid(), "hora": time.time()}, f, ensure_ascii=False)
+        return True
+
+    def abandonado(self, ruta):
+        # Devuelve el contenido del reclamo si está abandonado, o None
+        try:
+            datos, antiguedad = leer_reclamo(ruta), time.time() - os.path.getmtime(ruta)
+        except FileNotFoundError:
+            return None
+        if datos.get("nodo") == socket.gethostname() and datos.get("pid") and not proceso_vivo(datos["pid"]):
+            return datos
+        return datos if antiguedad > self.caducidad else None
+
+    def reclamar(self, clave):
+        if not self.carpeta_reclamos:
+            return True
+        ruta = self.ruta_reclamo(clave)
+        if os.path.exists(ruta + ".hecho"):
+            return False
+        if self.crear_reclamo(ruta + ".lock", clave):
+            return True
+        datos = self.abandonado(ruta + ".lock")
+        if datos is None:
+            return False
+        # Se aparta el reclamo abandonado con un nombre propio; si entretanto
+        # otro nodo ya lo había sustituido por uno nuevo, se devuelve a su sitio
+        apartado = f"{ruta}.abandonado.{socket.gethostname()}.{os.getpid()}"
+        try:
+            os.rename(ruta + ".lock", apartado)
+        except FileNotFoundError:
+            return False
+        if leer_reclamo(apartado) != datos:
+            try:
+                os.link(apartado, ruta + ".lock")
+            except FileExistsError:
+                pass
+            os.remove(apartado)
+            return False
+        os.remove(apartado)
+        return self.crear_reclamo(ruta + ".lock", clave)
+
+    def terminar(self, clave):
+        # Marca el elemento como hecho: su reclamo ya no caduca
+        if self.carpeta_reclamos:
+            open(self.ruta_reclamo(clave) + ".hecho", "w").close()
+
+    def nombre_archivo(self, nombre):
+        # "log_procesado.csv" -> "log_procesado.shard2-3.csv"
+        base, ext = os.path.splitext(nombre)
+        return f"{base}.{self.sufijo}{ext}"
+
+def archivos_de_shards(carpeta, nombre):
+    # Archivos por shard de `nombre` en `carpeta`, ordenados por shard
+    base, ext = os.path.splitext(nombre)
+    return sorted(glob.glob(os.path.join(glob.escape(carpeta), f"{glob.escape(base)}.shard*-*{ext}")))
+
+def reclamos_sin_terminar(carpeta, herramienta):
+    # Claves reclamadas por `herramienta` en cualquier ejecución que ningún nodo
+    # marcó como hechas (nodos caídos o que aún no han acabado)
+    patron = os.path.join(glob.escape(carpeta), CARPETA_RECLAMOS, glob.escape(herramienta), "*", "*.lock")
+    claves = []
+    for ruta in glob.glob(patron):
+        if not os.path.exists(ruta[:-len(".lock")] + ".hecho"):
+            try:
+                claves.append(leer_reclamo(ruta).get("clave", os.path.basename(ruta)))
+            except FileNotFoundError:
+                pass
+    return sorted(claves)
+
+def limpiar_reclamos(carpeta, herramienta):
+    shutil.rmtree(os.path.join(carpeta, CARPETA_RECLAMOS, herramienta), ignore_errors=True)
+    try:
+        os.rmdir(os.path.join(carpeta, CARPETA_RECLAMOS))
+    except OSError:
+        pass  # Quedan reclamos de otra herramienta, o no había carpeta
+
+def agregar_opciones_reparto(parser):
+    grupo = parser.add_argument_group("reparto entre varias máquinas")
+    grupo.add_argument("--shard", type=shard_desde_texto, default=None, metavar="i/N",
+                       help="Procesar solo la parte i de N (por hash del nombre de archivo o del alumno)")
+    grupo.add_argument("--reclamar", metavar="ID", default=None,
+                       help="Reclamar cada elemento con un archivo de bloqueo antes de procesarlo y, al "
+                            "terminar la parte propia, seguir con lo que quede de las demás. Todos los nodos "
+                            "de una misma ejecución deben usar el mismo ID")
+    grupo.add_argument("--caducidad-reclamos", type=float, default=CADUCIDAD_RECLAMOS, metavar="MIN",
+                       help="Minutos tras los que un elemento reclamado que nadie ha terminado se da por "
+                            f"abandonado y otro nodo puede quedárselo (por defecto: {CADUCIDAD_RECLAMOS})")
+    grupo.add_argument("--fusionar", action="store_true",
+                       help="No procesa nada: combina los logs y resúmenes de todos los shards")
+    return grupo
+
+def reparto_desde_args(args, carpeta_salida, herramienta):
+    # Los reclamos de cada ejecución (ID) y herramienta van en su propia carpeta
+    if args.shard is None:
+        if args.reclamar:
+            raise ValueError("--reclamar necesita --shard")
+        return None
+    carpeta_reclamos = None
+    if args.reclamar:
+        carpeta_reclamos = os.path.join(carpeta_salida, CARPETA_RECLAMOS, herramienta, args.reclamar)
+    return Reparto(*args.shard, carpeta_reclamos, args.caducidad_reclamos * 60)
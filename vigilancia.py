@@ -0,0 +1,276 @@
+import os
+import sys
+import time
+import argparse
+import multiprocessing
+import importlib.util
+from cache_imagenes import agregar_opciones_cache, cache_desde_args
+from escritura import agregar_opciones_escritura, ajustes_desde_args
+
+# Modo servicio: vigila las carpetas de entrada y procesa las fotos nuevas con
+# las rutinas de enhancer.py, "collage photos.py" y animacion.py, que se
+# importan una sola vez al arrancar (OpenCV, pandas, soundfile...). Las carpetas
+# se revisan cada pocos segundos, sin dependencias externas, y un archivo no se
+# procesa hasta que lleva un tiempo sin cambiar, para no leer fotos a medio copiar.
+
+INTERVALO = 2.0  # Segundos entre revisiones
+ESPERA = 3.0  # Segundos que un archivo debe pasar sin cambios antes de procesarlo
+EXTENSIONES_IMAGEN = (".jpg", ".jpeg", ".png")
+
+CARPETA_REPO = os.path.dirname(os.path.abspath(__file__))
+
+def cargar_modulo(nombre, archivo):
+    # Importa un script del repositorio por ruta ("collage photos.py" tiene un
+    # espacio). También lo usa benchmark.py
+    spec = importlib.util.spec_from_file_location(nombre, os.path.join(CARPETA_REPO, archivo))
+    modulo = importlib.util.module_from_spec(spec)
+    sys.modules[nombre] = modulo  # Para que los procesos del pool encuentren sus funciones
+    spec.loader.exec_module(modulo)
+    return modulo
+
+class Vigilante:
+    # Sigue los archivos de una carpeta entre revisiones. revisar() devuelve
+    # (listos, inestables, borrados): los que han cambiado desde la última vez
+    # que se marcaron y llevan `espera` segundos sin cambiar, los que aún están
+    # cambiando y los que han desaparecido
+    def __init__(self, carpeta, filtro=None, espera=ESPERA):
+        self.carpeta = carpeta
+        self.filtro = filtro or (lambda nombre: nombre.lower().endswith(EXTENSIONES_IMAGEN))
+        self.espera = espera
+        self.vistos = {}  # nombre -> (firma, momento desde el que no cambia)
+        self.hechos = {}  # nombre -> firma con la que se procesó
+
+    def revisar(self, ahora=None):
+        ahora = time.monotonic() if ahora is None else ahora
+        actuales = {}
+        try:
+            with os.scandir(self.carpeta) as entradas:
+                for entrada in entradas:
+                    if entrada.is_file() and self.filtro(entrada.name):
+                        estado = entrada.stat()
+                        actuales[entrada.name] = (estado.st_size, estado.st_mtime_ns)
+        except FileNotFoundError:
+            pass
+        for nombre, firma in actuales.items():
+            visto = self.vistos.get(nombre)
+            if visto is None or visto[0] != firma:
+                self.vistos[nombre] = (firma, ahora)
+        borrados = sorted(nombre for nombre in self.vistos if nombre not in actuales)
+        for nombre in borrados:
+            del self.vistos[nombre]
+            self.hechos.pop(nombre, None)
+        listos, inestables = [], set()
+        for nombre, (firma, desde) in self.vistos.items():
+            if ahora - desde < self.espera:
+                inestables.add(nombre)
+            elif self.hechos.get(nombre) != firma:
+                listos.append(nombre)
+        return sorted(listos), inestables, borrados
+
+    def marcar(self, nombres):
+        for nombre in nombres:
+            if nombre in self.vistos:
+                self.hechos[nombre] = self.vistos[nombre][0]
+
+    def marcar_todo(self):
+        self.marcar(list(self.vistos))
+
+class TareaEnhancer:
+    # Mejora cada foto estable que llega a la bandeja de entrada. Usa el
+    # manifiesto de enhance_folder, así que lo ya procesado no se repite
+    nombre = "enhancer"
+
+    def __init__(self, bandeja, salida, opciones, espera):
+        self.enhancer = cargar_modulo("enhancer", "enhancer.py")
+        self.vigilante = Vigilante(bandeja, lambda nombre: os.path.splitext(nombre)[1].lower()
+                                   in self.enhancer.ext_validas, espera)
+        self.vigilantes = [self.vigilante]
+        self.bandeja, self.salida, self.opciones = bandeja, salida, opciones
+
+    def revisar(self):
+        listos, inestables, _ = self.vigilante.revisar()
+        if listos:
+            print(f"\n📥 {len(listos)} fotos nuevas en {self.bandeja}")
+            resumen = self.enhancer.enhance_folder(self.bandeja, self.salida, files=listos, **self.opciones)
+            self.enhancer.imprimir_resumen(resumen)
+            self.vigilante.marcar(listos)
+        return bool(inestables)
+
+class TareaCollage:
+    # Genera los collages de los alumnos cuyas dos fotos están en Fotos y cuyo
+    # collage no existe o es anterior a sus fotos o a 'Lista alumnos.csv'.
+    # El log se actualiza por alumno, conservando las filas de los demás
+    nombre = "collage"
+
+    def __init__(self, carpeta, opciones, espera):
+        self.collage = cargar_modulo("collage_photos", "collage photos.py")
+        import pandas  # noqa: F401 - se carga ya para que el primer lote no espere
+        self.fotos_dir = os.path.join(carpeta, "Fotos")
+        self.output_dir = os.path.join(carpeta, "Output")
+        self.csv_path = os.path.join(carpeta, "Lista alumnos.csv")
+        self.log_path = os.path.join(self.output_dir, "log_procesado.csv")
+        self.vigilante = Vigilante(self.fotos_dir, espera=espera)
+        self.vigilante_csv = Vigilante(carpeta, lambda nombre: nombre == "Lista alumnos.csv", espera)
+        self.vigilantes = [self.vigilante, self.vigilante_csv]
+        self.opciones = opciones
+        if multiprocessing.get_start_method() != "fork":
+            # Sin fork, los procesos del pool no pueden importar el módulo del
+            # collage (su archivo tiene un espacio en el nombre)
+            self.opciones = {**opciones, "workers": 1}
+        candidatas = self.collage.POSIBLES_FUENTES
+        if os.environ.get("COLLAGE_FUENTE"):
+            candidatas = [os.environ["COLLAGE_FUENTE"]] + candidatas
+        self.font_path = self.collage.buscar_fuente(candidatas)
+
+    def desactualizado(self, identificador, fotos):
+        salida = self.collage.ruta_collage(self.output_dir, identificador, self.opciones["ajustes"])
+        if not os.path.exists(salida):
+            return True
+        referencias = [fotos["bf"], fotos["af"], self.csv_path]
+        return os.path.getmtime(salida) < max(os.path.getmtime(ruta) for ruta in referencias)
+
+    def revisar(self):
+        listos, inestables, _ = self.vigilante.revisar()
+        listos_csv, inestables_csv, _ = self.vigilante_csv.revisar()
+        if not (listos or listos_csv) or inestables_csv or not os.path.exists(self.csv_path):
+            return bool(inestables or inestables_csv)
+
+        indice = self.collage.indexar_fotos(self.fotos_dir)
+        alumnos = []
+        for identificador, nombre_completo in self.collage.iterar_alumnos(self.csv_path):
+            fotos = indice.get(identificador, {})
+            if not ("bf" in fotos and "af" in fotos):
+                continue
+            if {os.path.basename(fotos["bf"]), os.path.basename(fotos["af"])} & inestables:
+                continue  # Alguna de sus fotos se está copiando todavía
+            if self.desactualizado(identificador, fotos):
+                alumnos.append((identificador, nombre_completo))
+
+        if alumnos:
+            print(f"\n🖼️ {len(alumnos)} collages por generar en {self.output_dir}")
+            os.makedirs(self.output_dir, exist_ok=True)
+            filas = {fila["N"]: fila for fila in self.collage.leer_log(self.log_path)}
+
+            def registrar(fila):
+                filas[fila["N"]] = fila
+
+            self.collage.generar_collages(alumnos, indice, self.output_dir, self.font_path, registrar,
+                                          **self.opciones)
+            self.collage.abrir_log(self.log_path, filas.values()).close()
+        self.vigilante.marcar(listos)
+        self.vigilante_csv.marcar(listos_csv)
+        return bool(inestables)
+
+class TareaAnimacion:
+    # Vuelve a generar el vídeo cuando cambian las fotos de su carpeta (y el
+    # vídeo es anterior a ellas), una vez que todas han terminado de copiarse
+    nombre = "animacion"
+
+    def __init__(self, carpeta, encoder, image_cache, espera):
+        self.animacion = cargar_modulo("animacion", "animacion.py")
+        import soundfile  # noqa: F401 - se carga ya para que el primer vídeo no espere
+        from scipy import signal  # noqa: F401
+        self.animacion.ENCODER = encoder
+        self.animacion.IMAGE_CACHE = image_cache
+        self.carpeta = carpeta
+        self.vigilante = Vigilante(carpeta, espera=espera)
+        self.vigilantes = [self.vigilante]
+
+    def revisar(self):
+        listos, inestables, borrados = self.vigilante.revisar()
+        if inestables or not (listos or borrados):
+            return bool(inestables)
+        paths = self.animacion.list_images(self.carpeta)
+        salida = os.path.join(self.animacion.OUTPUT_FOLDER, self.animacion.OUTPUT_NAME)
+        if paths and (borrados or not os.path.exists(salida)
+                      or os.path.getmtime(salida) < max(os.path.getmtime(path) for path in paths)):
+            print(f"\n🎞️ Generando la animación con {len(paths)} fotos de {self.carpeta}")
+            os.makedirs(self.animacion.OUTPUT_FOLDER, exist_ok=True)
+            self.animacion.create_animation(self.animacion.iter_images_with_frame(paths), len(paths))
+        self.vigilante.marcar(listos)
+        return False
+
+def vigilar(tareas, intervalo=INTERVALO, una_vez=False):
+    # Bucle principal. Un error en un lote se muestra y no detiene el servicio;
+    # los archivos de ese lote (en todas las carpetas que vigila la tarea) no
+    # se reintentan hasta que vuelvan a cambiar.
+    # Con una_vez termina en cuanto no queda nada pendiente
+    while True:
+        pendiente = False
+        for tarea in tareas:
+            try:
+                pendiente |= tarea.revisar()
+            except Exception as e:
+                print(f"❌ Error en {tarea.nombre}: {e}")
+                for vigilante in tarea.vigilantes:
+                    vigilante.marcar_todo()
+        if una_vez and not pendiente:
+            return
+        time.sleep(intervalo)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Vigila las carpetas de entrada y procesa las fotos nuevas sin volver a arrancar las herramientas.")
+    parser.add_argument("--bandeja", help="Carpeta de entrada de enhancer.py")
+    parser.add_argument("--salida", default="Output",
+                        help="Carpeta de salida de enhancer.py (por defecto: Output)")
+    parser.add_argument("--escala", choices=["up", "down"], help="Upscale o downscale de enhancer.py")
+    parser.add_argument("--factor", type=float, default=None,
+                        help="Factor de escala de enhancer.py (por defecto: 2 para up y 0.25 para down)")
+    parser.add_argument("--autoenhance", action="store_true", help="Aplicar autoenhance en enhancer.py")
+    parser.add_argument("--dir", help="Carpeta con 'Fotos' y 'Lista alumnos.csv' para los collages")
+    parser.add_argument("--escalado", choices=["lanczos", "draft", "opencv"], default="lanczos",
+                        help="Método de escalado de los collages (por defecto: lanczos)")
+    parser.add_argument("--animacion", metavar="CARPETA",
+                        help="Carpeta de fotos de la animación; el vídeo se regenera cuando cambia")
+    parser.add_argument("--encoder", choices=["opencv", "ffmpeg"], default="opencv",
+                        help="Codificador de la animación (por defecto: opencv)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Procesos en paralelo de enhancer.py y de los collages (por defecto: núcleos disponibles)")
+    parser.add_argument("--intervalo", type=float, default=INTERVALO,
+                        help=f"Segundos entre revisiones de las carpetas (por defecto: {INTERVALO})")
+    parser.add_argument("--espera", type=float, default=ESPERA,
+                        help=f"Segundos sin cambios antes de procesar un archivo (por defecto: {ESPERA})")
+    parser.add_argument("--una-vez", action="store_true",
+                        help="Procesar lo pendiente y terminar en lugar de seguir vigilando")
+    agregar_opciones_escritura(parser)
+    agregar_opciones_cache(parser)
+    args = parser.parse_args()
+    if not (args.bandeja or args.dir or args.animacion):
+        parser.error("Indica al menos una carpeta que vigilar: --bandeja, --dir o --animacion")
+    if args.bandeja and args.escala is None and not args.autoenhance:
+        parser.error("Con --bandeja hay que elegir --escala y/o --autoenhance")
+    try:
+        ajustes = ajustes_desde_args(args)
+    except ValueError as e:
+        parser.error(str(e))
+    workers = max(1, args.workers or os.cpu_count() or 1)
+
+    # Todas las importaciones pesadas se hacen aquí, una sola vez
+    print("⏳ Cargando herramientas...")
+    inicio = time.perf_counter()
+    tareas = []
+    if args.bandeja:
+        factor = args.factor if args.factor is not None else {"up": 2.0, "down": 0.25}.get(args.escala, 1.0)
+        opciones = dict(scale=args.escala, factor=factor, autoenhance=args.autoenhance, workers=workers,
+                        encoding=ajustes, write_threads=args.hilos_escritura,
+                        image_cache=cache_desde_args(args, args.salida))
+        tareas.append(TareaEnhancer(args.bandeja, args.salida, opciones, args.espera))
+    if args.dir:
+        opciones = dict(workers=workers, escalado=args.escalado, ajustes=ajustes,
+                        hilos_escritura=args.hilos_escritura,
+                        cache=cache_desde_args(args, os.path.join(args.dir, "Output")))
+        tareas.append(TareaCollage(args.dir, opciones, args.espera))
+    if args.animacion:
+        tareas.append(TareaAnimacion(args.animacion, args.encoder, cache_desde_args(args), args.espera))
+    print(f"✅ Listo en {time.perf_counter() - inicio:.1f} s")
+
+    for tarea in tareas:
+        print(f"👀 Vigilando {tarea.vigilante.carpeta} ({tarea.nombre})")
+    try:
+        vigilar(tareas, args.intervalo, args.una_vez)
+    except KeyboardInterrupt:
+        print("\n👋 Vigilancia detenida")
+
+if __name__ == "__main__":
+    main()